@@ -0,0 +1,189 @@
+"""
+Export completed stories (with their parts) as NDJSON or CSV, and import them
+back from NDJSON with Postgres COPY (for backups, restores and seeding)
+
+python archive.py export [--format ndjson|csv] [--output stories.ndjson]
+python archive.py import stories.ndjson [--batch-size 5000] [--without-users]
+"""
+from datetime import datetime
+from decouple import config, Csv
+from sqlalchemy import exists, func, text, update
+from sqlalchemy.orm import selectinload
+from sqlalchemy.sql.operators import is_not
+from sqlmodel import select
+import argparse
+import asyncio
+import csv
+import io
+import orjson
+import random
+import sys
+import time
+
+from models import Story, Part, StorySearch, Users
+from database import async_session_maker, async_engine
+from serialization import serialize_story
+from search import index_stories
+from counters import add_to_counters
+
+
+# Auth user ids (Google sub) allowed to export through the api, comma separated
+ADMIN_USER_IDS = config("ADMIN_USER_IDS", default="", cast=Csv())
+
+# Stories loaded from the database at a time (with their parts)
+EXPORT_BATCH_SIZE = config("EXPORT_BATCH_SIZE", default=500, cast=int)
+
+EXPORT_FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+# one row per part in CSV
+CSV_COLUMNS = ["story_id", "title", "story_date_complete", "part_id", "part_number", "part_text",
+               "user_id", "date_started", "date_complete"]
+
+STORY_COLUMNS = ["id", "title", "date_complete", "locked", "last_user_id", "random_key", "next_part", "votes"]
+PART_COLUMNS = ["id", "part_number", "part_text", "story_id", "user_id", "date_started", "date_complete"]
+
+
+def story_csv_rows(story: Story):
+    return [[story.id, story.title, story.date_complete, part.id, part.part_number, part.part_text,
+             part.user_id, part.date_started, part.date_complete] for part in story.parts]
+
+
+def csv_lines(rows: list):
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    return buffer.getvalue().encode()
+
+
+"""
+Completed stories, oldest first, as chunks of NDJSON (a StoryPublicWithParts per line)
+or CSV (a row per part)
+
+Stories come from a server side cursor EXPORT_BATCH_SIZE at a time (their parts loaded
+a batch at a time too) so memory use doesn't grow with the number of stories
+"""
+async def export_stories(format: str = "ndjson"):
+    if format == "csv":
+        yield csv_lines([CSV_COLUMNS])
+
+    # (its own session, the request's is closed before a streamed response is sent)
+    async with async_session_maker() as session:
+        result = await session.stream(
+            select(Story).options(selectinload(Story.parts))
+                         .where(is_not(Story.date_complete, None))
+                         .order_by(Story.id)
+                         .execution_options(yield_per=EXPORT_BATCH_SIZE)
+        )
+        async for stories in result.scalars().partitions():
+            if format == "csv":
+                yield csv_lines([row for story in stories for row in story_csv_rows(story)])
+            else:
+                yield b"".join(serialize_story(story) + b"\n" for story in stories)
+            # the stories aren't needed again
+            session.expunge_all()
+
+
+def parse_datetime(value: str | None):
+    return datetime.fromisoformat(value) if value else None
+
+
+def story_record(story: dict):
+    return (story["id"], story["title"], parse_datetime(story["date_complete"]), True,
+            story["last_user_id"], random.random(), 6, 0)
+
+def part_record(part: dict, with_users: bool):
+    return (part["id"], part["part_number"], part["part_text"], part["story_id"],
+            part["user_id"] if with_users else None,
+            parse_datetime(part["date_started"]), parse_datetime(part["date_complete"]))
+
+
+"""
+Import stories exported as NDJSON, copying them into the story and part tables
+batch_size stories at a time, in one transaction
+
+Story and part ids are kept (so they must not be in use). Without users, parts
+aren't linked to their writers (for databases without the same users).
+Returns the number of stories and parts imported
+"""
+async def import_stories(lines, batch_size: int = 5000, with_users: bool = True):
+    stories = parts = 0
+
+    async with async_session_maker() as session:
+        # (this also starts the transaction, so the copies below are part of it)
+        await session.exec(text("SET LOCAL synchronous_commit TO OFF"))
+        connection = await (await session.connection()).get_raw_connection()
+        driver_connection = connection.driver_connection
+
+        async def copy(story_batch: list[dict]):
+            await driver_connection.copy_records_to_table(
+                "story", columns=STORY_COLUMNS, records=[story_record(story) for story in story_batch])
+            await driver_connection.copy_records_to_table(
+                "part", columns=PART_COLUMNS,
+                records=[part_record(part, with_users) for story in story_batch for part in story["parts"]])
+
+        story_batch = []
+        for line in lines:
+            if not line.strip():
+                continue
+            story = orjson.loads(line)
+            story_batch.append(story)
+            stories += 1
+            parts += len(story["parts"])
+            if len(story_batch) >= batch_size:
+                await copy(story_batch)
+                story_batch = []
+        if story_batch:
+            await copy(story_batch)
+
+        # new ids carry on after the imported ones
+        await session.exec(text("SELECT setval(pg_get_serial_sequence('story', 'id'), (SELECT max(id) FROM story))"))
+        await session.exec(text("SELECT setval(pg_get_serial_sequence('part', 'id'), (SELECT max(id) FROM part))"))
+
+        # search documents for the imported stories, and the stats
+        await session.exec(index_stories(is_not(Story.date_complete, None), ~exists().where(StorySearch.story_id == Story.id)))
+        await add_to_counters(session, stories_complete=stories, parts_complete=parts)
+        if with_users:
+            parts_complete = (select(func.count(Part.id))
+                                .where(Part.user_id == Users.id, is_not(Part.date_complete, None))
+                                .scalar_subquery())
+            await session.exec(update(Users).values(parts_complete=parts_complete))
+
+        await session.commit()
+
+    return stories, parts
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = commands.add_parser("export", help="write completed stories to a file (or stdout)")
+    export_parser.add_argument("--format", choices=EXPORT_FORMATS, default="ndjson")
+    export_parser.add_argument("--output", help="file to write to (default stdout)")
+
+    import_parser = commands.add_parser("import", help="copy stories exported as NDJSON into the database")
+    import_parser.add_argument("file")
+    import_parser.add_argument("--batch-size", type=int, default=5000, help="stories copied at a time")
+    import_parser.add_argument("--without-users", action="store_true", help="don't link parts to their writers")
+
+    args = parser.parse_args()
+    start = time.perf_counter()
+
+    if args.command == "export":
+        output = open(args.output, "wb") if args.output else sys.stdout.buffer
+        try:
+            async for chunk in export_stories(args.format):
+                output.write(chunk)
+        finally:
+            if args.output:
+                output.close()
+        print(f"Exported in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+    else:
+        with open(args.file, "rb") as lines:
+            stories, parts = await import_stories(lines, args.batch_size, not args.without_users)
+        print(f"Imported {stories} stories and {parts} parts in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+
+    await async_engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
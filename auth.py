@@ -1,19 +1,23 @@
 from fastapi import FastAPI, Depends, HTTPException, status, Request, Cookie, APIRouter
 from fastapi.responses import JSONResponse, RedirectResponse
 from typing import Annotated
-from authlib.integrations.starlette_client import OAuth
 from starlette.middleware.sessions import SessionMiddleware
 from datetime import datetime, timedelta
 from jose import jwt, ExpiredSignatureError, JWTError
 from decouple import config
 import uuid
-import traceback
-import requests
-
-from sqlmodel import select, Session
+import asyncio
+import time
+from cachetools import TTLCache
+from functools import lru_cache
+
+from sqlalchemy.dialects.postgresql import insert
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
 from models import Users
 
-from database import SessionDep, get_session, engine
+from database import SessionDep, get_session, async_engine, async_session_maker
+from metrics import logger, google_refresh_seconds
 
 # App Configuration
 app = FastAPI()
@@ -22,43 +26,92 @@ router = APIRouter()
 # Token expiry from env
 TOKEN_EXPIRY_IN_MINUTES = config('TOKEN_EXPIRY_IN_MINUTES', default=60, cast=int)
 
-# OAuth Setup
-oauth = OAuth()
-oauth.register(
-    name="auth",
-    client_id=config("GOOGLE_CLIENT_ID"),
-    client_secret=config("GOOGLE_CLIENT_SECRET"),
-    authorize_url="https://accounts.google.com/o/oauth2/auth",
-    authorize_params=None,
-    access_token_url="https://accounts.google.com/o/oauth2/token",
-    access_token_params=None,
-    refresh_token_url=None,
-    authorize_state=config("SECRET_KEY"),
-    redirect_uri=config("REDIRECT_URL"),
-    jwks_uri="https://www.googleapis.com/oauth2/v3/certs",
-    client_kwargs={
-        "scope": "openid profile email",
-        "access_type": "offline",
-        "prompt": "consent",
-    },
-)
+"""
+OAuth client for Google login
+Registered on first use, so authlib is only imported when someone logs in
+"""
+@lru_cache
+def get_oauth():
+    from authlib.integrations.starlette_client import OAuth
+
+    oauth = OAuth()
+    oauth.register(
+        name="auth",
+        client_id=config("GOOGLE_CLIENT_ID"),
+        client_secret=config("GOOGLE_CLIENT_SECRET"),
+        authorize_url=GOOGLE_AUTHORIZE_URL,
+        authorize_params=None,
+        access_token_url=GOOGLE_TOKEN_URL,
+        access_token_params=None,
+        refresh_token_url=None,
+        authorize_state=config("SECRET_KEY"),
+        redirect_uri=config("REDIRECT_URL"),
+        jwks_uri=GOOGLE_JWKS_URL,
+        client_kwargs={
+            "scope": "openid profile email",
+            "access_type": "offline",
+            "prompt": "consent",
+        },
+    )
+    return oauth
 
 # JWT Configurations
 JWT_SECRET_KEY = config("JWT_SECRET_KEY")
 ALGORITHM = "HS256"
 
+# Google endpoints for login and token refresh
+# (the Google URLs can point at local stand-in endpoints for testing)
+GOOGLE_AUTHORIZE_URL = config("GOOGLE_AUTHORIZE_URL", default="https://accounts.google.com/o/oauth2/auth")
+GOOGLE_TOKEN_URL = config("GOOGLE_TOKEN_URL", default="https://oauth2.googleapis.com/token")
+GOOGLE_JWKS_URL = config("GOOGLE_JWKS_URL", default="https://www.googleapis.com/oauth2/v3/certs")
+GOOGLE_USERINFO_URL = config("GOOGLE_USERINFO_URL", default="https://www.googleapis.com/oauth2/v2/userinfo")
+
+# Token refresh configuration
+TOKEN_REFRESH_THRESHOLD_IN_MINUTES = config("TOKEN_REFRESH_THRESHOLD_IN_MINUTES", default=10, cast=int)
+REFRESH_CACHE_TTL_IN_SECONDS = config("REFRESH_CACHE_TTL_IN_SECONDS", default=300, cast=int)
+HTTP_TIMEOUT_IN_SECONDS = config("HTTP_TIMEOUT_IN_SECONDS", default=10, cast=float)
+
+# Pooled client for outbound calls to Google (made on first use, so httpx is only imported then)
+http_client: "httpx.AsyncClient | None" = None
+
+def get_http_client():
+    global http_client
+    if http_client is None:
+        import httpx
+        http_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(HTTP_TIMEOUT_IN_SECONDS),
+            limits=httpx.Limits(max_connections=20, max_keepalive_connections=10),
+        )
+    return http_client
+
+async def close_http_client():
+    global http_client
+    if http_client is not None:
+        await http_client.aclose()
+        http_client = None
+
+# Access tokens recently refreshed for each user (keyed by auth user id)
+# and the refreshes currently running, so concurrent requests share one
+refreshed_tokens = TTLCache(maxsize=1024, ttl=REFRESH_CACHE_TTL_IN_SECONDS)
+refreshes_in_progress: dict[str, asyncio.Task] = {}
+
+# User rows by auth user id (least recently used dropped when full)
+USER_CACHE_SIZE = config("USER_CACHE_SIZE", default=1024, cast=int)
+USER_CACHE_TTL_IN_SECONDS = config("USER_CACHE_TTL_IN_SECONDS", default=60, cast=int)
+cached_users = TTLCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL_IN_SECONDS)
+
 """
 Get the currently logged in user
 """
-def get_current_user(access_token: Annotated[str | None, Cookie()] = None):
+async def get_current_user(access_token: Annotated[str | None, Cookie()] = None):
 
-    print("Getting current user from token...")
+    logger.debug("Getting current user from token...")
 
     if not access_token:
-        print("No access token found in cookies.")
+        logger.debug("No access token found in cookies.")
         raise HTTPException(status_code=401, detail="Not authenticated")
 
-    print("Access token found, decoding...")
+    logger.debug("Access token found, decoding...")
 
     credentials_exception = HTTPException(
         status_code=401,
@@ -74,34 +127,51 @@ def get_current_user(access_token: Annotated[str | None, Cookie()] = None):
         if user_id is None or user_name is None:
             raise credentials_exception
 
-        return {"user_id": user_id, "user_name": user_name}
+        user = await get_user_details(user_id)
+        if user is None or user.locked:
+            raise credentials_exception
+
+        return {"user_id": user_id, "user_name": user_name, "user": user}
 
     except ExpiredSignatureError:
         # Specifically handle expired tokens
         # https://github.com/mpdavis/python-jose/blob/master/jose/jwt.py#L174
-        traceback.print_exc()
+        logger.info("Access token expired")
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Session expired. Please login again.")
     except JWTError:
         # Handle other JWT-related errors
-        traceback.print_exc()
+        logger.warning("Invalid access token", exc_info=True)
         raise credentials_exception
     except Exception as e:
-        traceback.print_exc()
+        logger.exception("Could not get current user")
         raise HTTPException(status_code=401, detail="Not Authenticated")
 
 
+"""
+Get the currently logged in user, or None if nobody is logged in
+"""
+async def get_optional_current_user(access_token: Annotated[str | None, Cookie()] = None):
+    if not access_token:
+        return None
+    try:
+        return await get_current_user(access_token)
+    except HTTPException:
+        return None
+
+
 """
 Get the currently logged in user and refresh the token
+The token is only refreshed when it is close to expiry
 """
-def get_current_user_with_refresh(access_token: Annotated[str | None, Cookie()] = None):
+async def get_current_user_with_refresh(access_token: Annotated[str | None, Cookie()] = None):
 
-    print("Getting current user from token...")
+    logger.debug("Getting current user from token...")
 
     if not access_token:
-        print("No access token found in cookies.")
+        logger.debug("No access token found in cookies.")
         raise HTTPException(status_code=401, detail="Not authenticated")
 
-    print("Access token found, decoding...")
+    logger.debug("Access token found, decoding...")
 
     credentials_exception = HTTPException(
         status_code=401,
@@ -117,43 +187,102 @@ def get_current_user_with_refresh(access_token: Annotated[str | None, Cookie()]
         if user_id is None or user_name is None:
             raise credentials_exception
 
-        print("Refreshing token...")
+        user = await get_user_details(user_id)
+        if user is None or user.locked:
+            raise credentials_exception
 
-        # Refresh the access token
-        with Session(engine) as session:
-            user = session.exec(select(Users).filter_by(auth_user_id=user_id)).first()
-        if user:
-            # Use refresh_token to get new access token from Google
-            response = requests.post("https://oauth2.googleapis.com/token", 
-                                        data={
-                                            "client_id": config("GOOGLE_CLIENT_ID"),
-                                            "client_secret": config("GOOGLE_CLIENT_SECRET"),
-                                            "grant_type": "refresh_token",
-                                            "refresh_token": user.refresh_token
-                                        }
-                                    )
-            expires_in = response.json().get("expires_in")
-
-            # Create JWT token
-            access_token_expires = timedelta(seconds=expires_in)
-            access_token = create_access_token(data={"sub": user_id, "user_name": user_name}, expires_delta=access_token_expires)
-
-        return {"user_id": user_id, "user_name": user_name, "access_token": access_token}
+        if payload.get("exp") - time.time() < TOKEN_REFRESH_THRESHOLD_IN_MINUTES * 60:
+            logger.debug("Refreshing token...")
+            try:
+                access_token = await refresh_access_token(user, user_name)
+            except Exception:
+                # the token hasn't expired yet, so keep using it (e.g. while Google is timing out)
+                # and try again on the next request, the user only logs in again once it expires
+                logger.warning("Could not refresh access token, keeping the current one", exc_info=True)
+
+        return {"user_id": user_id, "user_name": user_name, "user": user, "access_token": access_token}
 
     except ExpiredSignatureError:
         # Specifically handle expired tokens
         # https://github.com/mpdavis/python-jose/blob/master/jose/jwt.py#L174
-        traceback.print_exc()
+        logger.info("Access token expired")
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Session expired. Please login again.")
     except JWTError:
         # Handle other JWT-related errors
-        traceback.print_exc()
+        logger.warning("Invalid access token", exc_info=True)
         raise credentials_exception
     except Exception as e:
-        traceback.print_exc()
+        logger.exception("Could not get current user")
         raise HTTPException(status_code=401, detail="Not Authenticated")
 
 
+"""
+Get a refreshed access token for the user
+Reuses a recently refreshed token, or joins a refresh already running for the user
+"""
+async def refresh_access_token(user: Users, user_name: str):
+    user_id = user.auth_user_id
+    access_token = refreshed_tokens.get(user_id)
+    if access_token:
+        return access_token
+
+    task = refreshes_in_progress.get(user_id)
+    if task is None:
+        task = asyncio.create_task(request_access_token(user, user_name))
+        refreshes_in_progress[user_id] = task
+        task.add_done_callback(lambda _: refreshes_in_progress.pop(user_id, None))
+
+    # shield so one request disconnecting doesn't cancel the refresh for the others
+    return await asyncio.shield(task)
+
+
+"""
+Use the user's refresh_token to get a new access token from Google
+"""
+async def request_access_token(user: Users, user_name: str):
+    user_id = user.auth_user_id
+    with google_refresh_seconds.time():
+        response = await get_http_client().post(GOOGLE_TOKEN_URL, 
+                                            data={
+                                                "client_id": config("GOOGLE_CLIENT_ID"),
+                                                "client_secret": config("GOOGLE_CLIENT_SECRET"),
+                                                "grant_type": "refresh_token",
+                                                "refresh_token": user.refresh_token
+                                            }
+                                        )
+    response.raise_for_status()
+    expires_in = response.json().get("expires_in")
+
+    # Create JWT token
+    access_token_expires = timedelta(seconds=expires_in)
+    access_token = create_access_token(data={"sub": user_id, "user_name": user_name}, expires_delta=access_token_expires)
+    refreshed_tokens[user_id] = access_token
+
+    return access_token
+
+
+"""
+Get the user's row from the database using their auth user id
+Rows are cached for a short time so each request doesn't look the user up again
+"""
+async def get_user_details(auth_user_id: str):
+    user = cached_users.get(auth_user_id)
+    if user is None:
+        async with AsyncSession(async_engine) as session:
+            user = (await session.exec(select(Users).filter_by(auth_user_id=auth_user_id))).first()
+        if user:
+            cached_users[auth_user_id] = user
+
+    return user
+
+
+"""
+Drop a cached user row (call when locked or refresh_token changes)
+"""
+def invalidate_user_details(auth_user_id: str):
+    cached_users.pop(auth_user_id, None)
+
+
 """
 Login using Google authentication
 """
@@ -165,7 +294,7 @@ async def login(request: Request):
     redirect_url = config("REDIRECT_URL")
     request.session["login_redirect"] = frontend_url 
 
-    return await oauth.auth.authorize_redirect(request, redirect_url, prompt="consent", access_type="offline")
+    return await get_oauth().auth.authorize_redirect(request, redirect_url, prompt="consent", access_type="offline")
 
 
 @router.route("/auth")
@@ -174,18 +303,17 @@ async def auth(request: Request):
     redirect_url = request.session.pop("login_redirect", "")
 
     try:
-        token = await oauth.auth.authorize_access_token(request)
+        token = await get_oauth().auth.authorize_access_token(request)
     except Exception as e:
-        print(f"Google authentication failed: {e}")
+        logger.warning("Google authentication failed: %s", e)
         return RedirectResponse(redirect_url)
 
     try:
-        user_info_endpoint = "https://www.googleapis.com/oauth2/v2/userinfo"
         headers = {"Authorization": f'Bearer {token["access_token"]}'}
-        google_response = requests.get(user_info_endpoint, headers=headers)
+        google_response = await get_http_client().get(GOOGLE_USERINFO_URL, headers=headers)
         user_info = google_response.json()
     except Exception as e:
-        print(f"Google authentication failed: {e}")
+        logger.warning("Google authentication failed: %s", e)
         return RedirectResponse(redirect_url)
 
     refresh_token = token.get("refresh_token")
@@ -201,17 +329,17 @@ async def auth(request: Request):
     user_name = user_info.get("name")
     user_pic = user_info.get("picture")
 
-    print(f'User details: [user_id = {user_id}, user_name = {user_name} ]')
+    logger.info('User details: [user_id = %s, user_name = %s ]', user_id, user_name)
 
     if iss not in ["https://accounts.google.com", "accounts.google.com"]:
-        print(f"Google authentication failed: Invalid issuer")
+        logger.warning("Google authentication failed: Invalid issuer")
         return RedirectResponse(redirect_url)
 
     if user_id is None:
-        print(f"Google authentication failed: Invalid user_id")
+        logger.warning("Google authentication failed: Invalid user_id")
         return RedirectResponse(redirect_url)
 
-    success = check_and_insert_user_details(user_id=user_id, refresh_token=refresh_token)
+    success = await check_and_insert_user_details(user_id=user_id, refresh_token=refresh_token)
     if not success:
         return RedirectResponse(redirect_url + "?message=User account is locked")
 
@@ -240,20 +368,27 @@ def create_access_token(data: dict, expires_delta: timedelta = None):
     return jwt.encode(to_encode, JWT_SECRET_KEY, algorithm=ALGORITHM)
 
 """
-Check whether logged in user already on database and if not add them
-Update refresh_token on database
+Add the logged in user to the database if they aren't already on it
+and update their refresh_token, in one statement
+Returns False if the user is locked
 """
-def check_and_insert_user_details(user_id: str, refresh_token: str):
-    with Session(engine) as session:
-        user = session.exec(select(Users).filter_by(auth_user_id=user_id)).first()
-        if not user:
-            user = Users(auth_user_id=user_id, refresh_token=refresh_token)
-        else:
-            if user.locked:
-                print(f"User {user_id} attempted to login but is locked")
-                return False
-            user.refresh_token = refresh_token
-        session.add(user)
-        session.commit()
-
-    return True
\ No newline at end of file
+async def check_and_insert_user_details(user_id: str, refresh_token: str):
+    async with async_session_maker() as session:
+        # a locked user's row isn't updated, so nothing is returned
+        statement = insert(Users).values(auth_user_id=user_id, refresh_token=refresh_token, locked=False)
+        statement = statement.on_conflict_do_update(
+            index_elements=[Users.auth_user_id],
+            set_={"refresh_token": statement.excluded.refresh_token},
+            where=Users.locked.is_not(True),
+        ).returning(Users.id)
+
+        updated = (await session.exec(statement)).first()
+        await session.commit()
+
+    if updated is None:
+        logger.warning("User %s attempted to login but is locked", user_id)
+        return False
+
+    invalidate_user_details(user_id)
+
+    return True
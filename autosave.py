@@ -0,0 +1,142 @@
+from cachetools import TTLCache
+from decouple import config
+from sqlalchemy import update
+from sqlalchemy.sql.operators import is_
+from sqlmodel import select
+import asyncio
+import hashlib
+import time
+
+from models import Part, Story
+from database import async_session_maker, WEB_CONCURRENCY
+from profanity import load_profanity_checker
+from metrics import profanity_check_seconds
+
+
+# Saves of the same part within this many seconds are combined into one write
+# (0 writes every save straight away, the default with more than one worker: a user's
+#  saves can go to different workers, so none of them can hold saves back or skip them)
+AUTOSAVE_WINDOW_IN_SECONDS = config("AUTOSAVE_WINDOW_IN_SECONDS", default=5 if WEB_CONCURRENCY == 1 else 0, cast=float)
+
+
+def part_digest(part_text: str | None, story_title: str | None):
+    return hashlib.sha1(f"{part_text}\0{story_title}".encode()).digest()
+
+
+"""
+The last text accepted for a part
+"""
+class SavedPart:
+
+    def __init__(self, part_text: str | None, story_title: str | None):
+        self.part_text = part_text
+        self.story_title = story_title
+        self.digest = part_digest(part_text, story_title)
+        self.saved_at = time.monotonic()
+        self.pending = False
+        self.flush_task = None
+
+
+"""
+Saves parts as users type
+
+- with a window, a save with the same text (and title) as the last one is not
+  sent, and saves arriving within the window of the last write are combined,
+  the latest text being written when the window ends
+- without one every save is sent, the database skipping rows it wouldn't change
+- only the region edited since the last save is checked for profanity
+"""
+class Autosaver:
+
+    def __init__(self, window: float = AUTOSAVE_WINDOW_IN_SECONDS, maxsize: int = 4096, ttl: int = 3600):
+        self.window = window
+        # (user id, part id) -> SavedPart
+        self.saved = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    async def check_profanity(self, user_id: int, part_id: int, part_text: str | None, story_title: str | None):
+        checker = await load_profanity_checker()
+        saved = self.saved.get((user_id, part_id))
+        with profanity_check_seconds.time():
+            if saved is None:
+                title_results, text_results = checker.check_part(part_text, story_title)
+            else:
+                title_results = checker.check(story_title) if story_title != saved.story_title else []
+                text_results = checker.check_edit(saved.part_text, part_text)
+
+        return title_results + text_results
+
+    async def save(self, user_id: int, part_id: int, part_text: str | None, story_title: str | None):
+        key = (user_id, part_id)
+        saved = self.saved.get(key)
+
+        # (only with a window can this worker be sure it has seen every save of the part)
+        if saved is not None and self.window > 0:
+            # a save without a title keeps the last one
+            if story_title is None:
+                story_title = saved.story_title
+
+            if part_digest(part_text, story_title) == saved.digest:
+                return
+
+            if time.monotonic() - saved.saved_at < self.window:
+                saved.part_text = part_text
+                saved.story_title = story_title
+                saved.digest = part_digest(part_text, story_title)
+                saved.pending = True
+                if saved.flush_task is None:
+                    saved.flush_task = asyncio.create_task(self.flush_later(saved, user_id, part_id))
+                return
+
+        await write_part(user_id, part_id, part_text, story_title)
+        self.saved[key] = SavedPart(part_text, story_title)
+
+    async def flush_later(self, saved: SavedPart, user_id: int, part_id: int):
+        await asyncio.sleep(max(self.window - (time.monotonic() - saved.saved_at), 0))
+        await self.flush(saved, user_id, part_id)
+
+    async def flush(self, saved: SavedPart, user_id: int, part_id: int):
+        saved.flush_task = None
+        if saved.pending:
+            saved.pending = False
+            saved.saved_at = time.monotonic()
+            await write_part(user_id, part_id, saved.part_text, saved.story_title)
+
+    """
+    Write any saves still waiting for their window to end (e.g. on shutdown)
+    """
+    async def flush_all(self):
+        for (user_id, part_id), saved in list(self.saved.items()):
+            if saved.flush_task is not None:
+                saved.flush_task.cancel()
+            await self.flush(saved, user_id, part_id)
+
+    """
+    Forget a part (once it is complete nothing more should be saved)
+    """
+    def discard(self, user_id: int, part_id: int):
+        saved = self.saved.pop((user_id, part_id), None)
+        if saved is not None and saved.flush_task is not None:
+            saved.flush_task.cancel()
+
+
+"""
+Write the part text (and story title) if the part is still the user's and not complete
+Rows already holding the text (or title) aren't updated, so an unchanged save writes nothing
+"""
+async def write_part(user_id: int, part_id: int, part_text: str | None, story_title: str | None):
+    async with async_session_maker() as session:
+        await session.exec(
+            update(Part).where(Part.id == part_id, Part.user_id == user_id, is_(Part.date_complete, None),
+                               Part.part_text.is_distinct_from(part_text))
+                        .values(part_text=part_text)
+        )
+
+        if story_title is not None:
+            story_id = select(Part.story_id).where(Part.id == part_id, Part.user_id == user_id, is_(Part.date_complete, None))
+            await session.exec(update(Story).where(Story.id == story_id.scalar_subquery(), Story.title.is_distinct_from(story_title))
+                                            .values(title=story_title))
+
+        await session.commit()
+
+
+autosaver = Autosaver()
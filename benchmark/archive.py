@@ -0,0 +1,94 @@
+"""
+Throughput of exporting completed stories (archive.py) in each format, and
+optionally of importing them back with COPY
+
+Seed the database first (seed.py). --reimport empties the story tables (all
+stories, including those in progress) and imports the NDJSON export into them.
+
+python benchmark/archive.py [--formats ndjson,csv] [--reimport] [--json archive.json]
+"""
+from sqlalchemy import text
+import argparse
+import asyncio
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from archive import export_stories, import_stories
+from database import async_session_maker, async_engine
+
+
+def max_rss_mb():
+    # (kilobytes on Linux)
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+async def measure_export(format: str, path: str):
+    start = time.perf_counter()
+    size = lines = 0
+    with open(path, "wb") as output:
+        async for chunk in export_stories(format):
+            output.write(chunk)
+            size += len(chunk)
+            lines += chunk.count(b"\n")
+    seconds = time.perf_counter() - start
+
+    # (csv has a header line, and a line per part rather than per story)
+    return {"seconds": seconds, "lines": lines, "megabytes": size / 1e6,
+            "lines_per_second": lines / seconds, "megabytes_per_second": size / 1e6 / seconds,
+            "max_rss_mb": max_rss_mb()}
+
+
+async def measure_import(path: str):
+    async with async_session_maker() as session:
+        await session.exec(text("TRUNCATE story_search, vote, part, story CASCADE"))
+        await session.exec(text("UPDATE counters SET value = 0"))
+        await session.commit()
+
+    start = time.perf_counter()
+    with open(path, "rb") as lines:
+        stories, parts = await import_stories(lines)
+    seconds = time.perf_counter() - start
+
+    return {"seconds": seconds, "stories": stories, "parts": parts,
+            "stories_per_second": stories / seconds, "parts_per_second": parts / seconds,
+            "max_rss_mb": max_rss_mb()}
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--formats", default="ndjson,csv")
+    parser.add_argument("--reimport", action="store_true", help="empty the story tables and import the NDJSON export")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    results = {"export": {}}
+    with tempfile.TemporaryDirectory() as directory:
+        formats = args.formats.split(",")
+        if args.reimport and "ndjson" not in formats:
+            formats.append("ndjson")
+
+        for format in formats:
+            result = results["export"][format] = await measure_export(format, os.path.join(directory, f"stories.{format}"))
+            print(f"export {format:6} {result['lines']:9} lines  {result['megabytes']:8.1f}MB  {result['seconds']:6.1f}s  "
+                  f"{result['lines_per_second']:9.0f} lines/s  max rss {result['max_rss_mb']:.0f}MB")
+
+        if args.reimport:
+            result = results["import"] = await measure_import(os.path.join(directory, "stories.ndjson"))
+            print(f"import        {result['stories']:9} stories {result['parts']:9} parts  {result['seconds']:6.1f}s  "
+                  f"{result['parts_per_second']:9.0f} parts/s  max rss {result['max_rss_mb']:.0f}MB")
+
+    await async_engine.dispose()
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
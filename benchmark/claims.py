@@ -0,0 +1,175 @@
+"""
+Stress test of part assignment (/get_part/): more and more writers claim parts
+at once, and no story or part number may be handed out twice
+
+Each writer is a different benchmark user. In each round every writer claims a
+part at the same moment, then completes it ready for the next (completions
+aren't timed: they all update the same stats rows). Every claim is checked: a
+part must only ever be given to one writer, and a (story, part number) only
+ever to one part. The database is checked for duplicate part numbers at the
+end too. Claim latency is reported for each number of writers, it should stay
+flat as writers are added while the server and database have cores to spare.
+
+Seed the database first (seed.py) and run the server with RATE_LIMIT_ENABLED=False.
+
+python benchmark/claims.py [--base-url http://localhost:8000] [--writers 1,2,4,8,16,32,64] [--duration 10]
+"""
+from sqlalchemy import text
+import argparse
+import asyncio
+import httpx
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import get_engine
+from seed import PART_TEXT
+from tokens import bench_cookie
+from workloads import percentile_ms
+
+
+"""
+Claims made by all the writers, and any handed out twice
+"""
+class Claims:
+
+    def __init__(self):
+        self.latencies = []
+        self.errors = 0
+        # part id -> writer, (story id, part number) -> part id
+        self.part_writers = {}
+        self.part_numbers = {}
+        self.double_assignments = []
+
+    def record(self, writer: int, part: dict):
+        part_id = part["id"]
+        story_part = (part["story_id"], part["part_number"])
+
+        if self.part_writers.setdefault(part_id, writer) != writer:
+            self.double_assignments.append(f"part {part_id} given to writers {self.part_writers[part_id]} and {writer}")
+        if self.part_numbers.setdefault(story_part, part_id) != part_id:
+            self.double_assignments.append(f"story {story_part[0]} part {story_part[1]} given as parts "
+                                           f"{self.part_numbers[story_part]} and {part_id}")
+
+
+"""
+A benchmark user claiming parts
+"""
+class Writer:
+
+    def __init__(self, base_url: str, user: int):
+        self.user = user
+        self.client = httpx.AsyncClient(base_url=base_url, cookies=bench_cookie(user), timeout=30)
+        self.part = None
+
+    async def claim(self, claims: Claims):
+        start = time.perf_counter()
+        response = await self.client.get("/get_part/")
+        claims.latencies.append(time.perf_counter() - start)
+        if response.status_code != 200:
+            claims.errors += 1
+            self.part = None
+            return
+
+        self.part = response.json()
+        claims.record(self.user, self.part)
+
+    async def complete(self, claims: Claims | None = None):
+        if self.part is None:
+            return
+        story_title = "A benchmark story" if self.part["part_number"] == 1 else None
+        response = await self.client.patch(f"/complete_part/{self.part['id']}", json={"part_text": PART_TEXT, "story_title": story_title})
+        if claims is not None and (response.status_code != 200 or response.json().get("status") != 200):
+            claims.errors += 1
+        self.part = None
+
+
+"""
+Rounds of every writer claiming a part at once (timed), then completing it (not
+timed, so claims only contend with each other) ready for the next round
+"""
+async def run_writers(base_url: str, writers: int, first_user: int, duration: float):
+    claims = Claims()
+    writers = [Writer(base_url, first_user + i) for i in range(writers)]
+    try:
+        # finish any part the writers were already given, so every claim below is new
+        for writer in writers:
+            response = await writer.client.get("/get_part/")
+            if response.status_code != 200:
+                sys.exit(f"benchmark user {writer.user} can't claim a part ({response.status_code}), were they seeded?")
+            writer.part = response.json()
+        await asyncio.gather(*(writer.complete() for writer in writers))
+
+        seconds = 0.0
+        while seconds < duration:
+            start = time.perf_counter()
+            await asyncio.gather(*(writer.claim(claims) for writer in writers))
+            seconds += time.perf_counter() - start
+            await asyncio.gather(*(writer.complete(claims) for writer in writers))
+    finally:
+        for writer in writers:
+            await writer.client.aclose()
+
+    latencies = sorted(claims.latencies)
+    return claims, {
+        "claims": len(latencies),
+        "errors": claims.errors,
+        "double_assignments": len(claims.double_assignments),
+        "claims_per_second": len(latencies) / seconds,
+        "p50_ms": percentile_ms(latencies, 50),
+        "p99_ms": percentile_ms(latencies, 99),
+        "mean_ms": statistics.fmean(latencies) * 1000 if latencies else None,
+    }
+
+
+"""
+Stories with the same part number more than once, however they were handed out
+"""
+def duplicate_part_numbers():
+    with get_engine().connect() as connection:
+        return connection.execute(text("""
+            SELECT story_id, part_number, count(*) FROM part
+            GROUP BY story_id, part_number HAVING count(*) > 1
+        """)).all()
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--writers", default="1,2,4,8,16,32,64", help="numbers of writers claiming at once, comma separated")
+    parser.add_argument("--duration", type=float, default=10, help="seconds of claiming for each number of writers")
+    parser.add_argument("--first-user", type=int, default=1, help="benchmark user number the writers start from")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    results = {}
+    failed = False
+    for writers in map(int, args.writers.split(",")):
+        claims, result = await run_writers(args.base_url, writers, args.first_user, args.duration)
+        results[writers] = result
+        print(f"{writers:3} writers  {result['claims']:7} claims  {result['claims_per_second']:8.1f} claims/s   "
+              f"p50 {result['p50_ms'] or 0:7.1f}ms   p99 {result['p99_ms'] or 0:7.1f}ms   "
+              f"errors {result['errors']}   double assignments {result['double_assignments']}")
+        for double_assignment in claims.double_assignments[:10]:
+            print(f"  {double_assignment}")
+        failed = failed or bool(claims.double_assignments)
+
+    duplicates = duplicate_part_numbers()
+    for story_id, part_number, count in duplicates[:10]:
+        print(f"story {story_id} has {count} parts numbered {part_number}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"writers": results, "duplicate_part_numbers": len(duplicates)}, f, indent=2)
+
+    if failed or duplicates:
+        sys.exit("Parts were handed out more than once")
+    print("No part was handed out more than once")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
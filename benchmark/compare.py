@@ -0,0 +1,66 @@
+"""
+Compare two workloads.py results, e.g. before and after a change
+
+python benchmark/compare.py benchmark/results/OLD.json benchmark/results/NEW.json [--threshold 10]
+
+Exits with status 1 if any p99 latency or throughput got worse by more than the threshold (percent).
+"""
+import argparse
+import json
+import sys
+
+
+# metric -> whether bigger is better
+METRICS = {
+    "throughput_rps": True,
+    "p50_ms": False,
+    "p99_ms": False,
+    "queries_per_request": False,
+}
+
+# regressions in these fail the comparison
+CHECKED_METRICS = ("throughput_rps", "p99_ms")
+
+
+def change_percent(old: float | None, new: float | None):
+    if not old or new is None:
+        return None
+    return (new - old) / old * 100
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("old")
+    parser.add_argument("new")
+    parser.add_argument("--threshold", type=float, default=10, help="percent worse counted as a regression")
+    args = parser.parse_args()
+
+    with open(args.old) as f:
+        old = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+
+    print(f"{old['commit']} -> {new['commit']}")
+    regressions = []
+    for name, new_summary in new["workloads"].items():
+        old_summary = old["workloads"].get(name)
+        if old_summary is None:
+            continue
+
+        for metric, bigger_is_better in METRICS.items():
+            change = change_percent(old_summary.get(metric), new_summary.get(metric))
+            if change is None:
+                continue
+            worse = -change if bigger_is_better else change
+            flag = ""
+            if metric in CHECKED_METRICS and worse > args.threshold:
+                regressions.append(f"{name} {metric}")
+                flag = "  REGRESSION"
+            print(f"{name:22} {metric:20} {old_summary[metric]:10.2f} -> {new_summary[metric]:10.2f}  {change:+7.1f}%{flag}")
+
+    if regressions:
+        sys.exit(f"Regressed: {', '.join(regressions)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""
+Racing submissions of the same part (/complete_part/): a writer's part sent
+several times at once (a double click, a retry after a timeout) must be
+completed exactly once, whether it is a middle part or the story's last
+
+Each round sets up stories in SQL, each with an open part for a different
+benchmark user (part 3, or part 5 so the submission completes the story), then
+fires --racers submissions of every part at once. Exactly one submission of
+each part may succeed, and the parts, stories, users' counts and stats must
+show each part completed once. Completions committed per second are reported.
+
+Seed the database first (seed.py) and run the server with RATE_LIMIT_ENABLED=False.
+
+python benchmark/complete_race.py [--base-url http://localhost:8000] [--rounds 50] [--stories 8] [--racers 8]
+"""
+from sqlalchemy import text
+import argparse
+import asyncio
+import httpx
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import get_engine
+from seed import BENCH_USER_PREFIX, PART_TEXT
+from tokens import bench_cookie
+
+
+"""
+A story with parts 1 to part_number - 1 complete, and part_number open for
+the user, as if they had just claimed it
+Returns the open part's id
+"""
+def create_story(connection, user_id: int, part_number: int):
+    story_id = connection.execute(text("""
+        INSERT INTO story (title, locked, next_part, last_user_id) VALUES ('A racing story', true, :part_number + 1, :user_id)
+        RETURNING id
+    """), {"part_number": part_number, "user_id": user_id}).scalar()
+    parts = connection.execute(text("""
+        INSERT INTO part (part_number, part_text, story_id, user_id, date_started, date_complete)
+        SELECT k, :part_text, :story_id, :user_id, now(), CASE WHEN k < :part_number THEN now() END
+        FROM generate_series(1, :part_number) k
+        RETURNING id, part_number
+    """), {"part_text": PART_TEXT, "story_id": story_id, "user_id": user_id, "part_number": part_number}).all()
+    return next(part_id for part_id, number in parts if number == part_number)
+
+
+def user_ids(first_user: int, users: int):
+    with get_engine().connect() as connection:
+        return connection.execute(text("""
+            SELECT n, id FROM generate_series(:first_user, :first_user + :users - 1) n
+            LEFT JOIN users ON auth_user_id = :prefix || n ORDER BY n
+        """), {"first_user": first_user, "users": users, "prefix": BENCH_USER_PREFIX}).all()
+
+
+"""
+Counts the submissions can change: completed parts, completed stories and the
+users' parts_complete, from the rows and from the stats
+"""
+def totals(users: list):
+    with get_engine().connect() as connection:
+        return connection.execute(text("""
+            SELECT (SELECT count(*) FROM part WHERE date_complete IS NOT NULL),
+                   (SELECT count(*) FROM story WHERE date_complete IS NOT NULL),
+                   (SELECT count(*) FROM story_search),
+                   (SELECT sum(parts_complete) FROM users WHERE id = ANY(:users)),
+                   (SELECT value FROM counters WHERE name = 'parts_complete'),
+                   (SELECT value FROM counters WHERE name = 'stories_complete'),
+                   (SELECT value FROM counters WHERE name = 'stories_in_progress')
+        """), {"users": users}).one()
+
+
+async def submit(client: httpx.AsyncClient, part_id: int, cookies: dict):
+    response = await client.patch(f"/complete_part/{part_id}", cookies=cookies,
+                                  json={"part_text": PART_TEXT, "story_title": None})
+    # only 404 (already completed by another submission) may be refused
+    if response.status_code not in (200, 404):
+        sys.exit(f"part {part_id}: unexpected response {response.status_code} {response.text}")
+    return response.status_code == 200 and response.json().get("status") == 200
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--rounds", type=int, default=50)
+    parser.add_argument("--stories", type=int, default=8, help="stories raced at once in a round, each by its own user")
+    parser.add_argument("--racers", type=int, default=8, help="submissions of each part at once")
+    parser.add_argument("--first-user", type=int, default=900, help="benchmark user number the writers start from")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    users = user_ids(args.first_user, args.stories)
+    missing = [n for n, user_id in users if user_id is None]
+    if missing:
+        sys.exit(f"benchmark users {missing} weren't seeded")
+    cookies = {user_id: bench_cookie(n) for n, user_id in users}
+
+    before = totals(list(cookies))
+    winners = []
+    seconds = 0.0
+    last_parts = 0
+    earlier_parts = 0
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=30) as client:
+        for round in range(args.rounds):
+            # alternately middle parts and last parts
+            part_number = 5 if round % 2 else 3
+            with get_engine().begin() as connection:
+                parts = [create_story(connection, user_id, part_number) for user_id in cookies]
+                connection.execute(text("UPDATE counters SET value = value + :stories WHERE name = 'stories_in_progress'"),
+                                   {"stories": len(parts)})
+            last_parts += len(parts) if part_number == 5 else 0
+            earlier_parts += len(parts) * (part_number - 1)
+
+            start = time.perf_counter()
+            succeeded = await asyncio.gather(*(submit(client, part_id, cookies[user_id])
+                                               for part_id, user_id in zip(parts, cookies) for _ in range(args.racers)))
+            seconds += time.perf_counter() - start
+            winners += [sum(succeeded[i:i + args.racers]) for i in range(0, len(succeeded), args.racers)]
+
+    after = totals(list(cookies))
+    parts = args.rounds * args.stories
+    changes = [b - a for a, b in zip(before, after)]
+    # (the setup added the earlier parts, already complete, and every story to stories_in_progress,
+    #  completing the last parts takes them off again)
+    expected = [earlier_parts + parts, last_parts, last_parts, parts, parts, last_parts, parts - last_parts]
+
+    results = {
+        "parts": parts,
+        "racers": args.racers,
+        "submissions": parts * args.racers,
+        "parts_completed_more_than_once": sum(1 for count in winners if count > 1),
+        "parts_not_completed": sum(1 for count in winners if count == 0),
+        "commits_per_second": parts / seconds,
+        "submissions_per_second": parts * args.racers / seconds,
+        "counts_changed_by": dict(zip(["parts", "stories", "search", "users", "stats_parts", "stats_stories", "stats_in_progress"], changes)),
+    }
+    print(f"{parts} parts each submitted {args.racers} times at once, {args.stories} a round")
+    print(f"{results['commits_per_second']:.1f} completions committed/s, {results['submissions_per_second']:.1f} submissions/s")
+    print(f"parts completed more than once {results['parts_completed_more_than_once']}, "
+          f"not completed {results['parts_not_completed']}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if results["parts_completed_more_than_once"] or results["parts_not_completed"] or changes != expected:
+        sys.exit(f"Counts changed by {changes}, expected {expected}")
+    print("Every part was completed exactly once")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
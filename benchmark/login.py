@@ -0,0 +1,130 @@
+"""
+Login throughput: concurrent users going through the whole Google login
+(/login, Google's authorize page, then /auth with the code) against the stand-in
+Google (stub_google.py), reporting logins per second and their latency
+
+/auth exchanges the code for tokens, fetches the keys and checks the id_token,
+fetches the user's info and adds or updates their row, the stand-in answering
+for Google. Start it and point the server at it:
+
+python benchmark/stub_google.py --port 8001
+GOOGLE_AUTHORIZE_URL=http://localhost:8001/authorize GOOGLE_TOKEN_URL=http://localhost:8001/token \\
+GOOGLE_JWKS_URL=http://localhost:8001/certs GOOGLE_USERINFO_URL=http://localhost:8001/userinfo uvicorn main:app
+
+python benchmark/login.py [--base-url REDIRECT_URL without /auth] [--concurrency 1,4,16] [--duration 10] [--users 1000]
+"""
+from decouple import config
+import argparse
+import asyncio
+import httpx
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from workloads import percentile_ms
+
+
+"""
+Latencies of whole logins and of their /auth requests
+"""
+class Logins:
+
+    def __init__(self):
+        self.latencies = []
+        self.auth_latencies = []
+        self.errors = 0
+
+
+"""
+One login, as a browser makes it: /login sends the user to Google, who (already
+signed in) sends them back to /auth with a code, which sets the access_token cookie
+"""
+async def log_in(client: httpx.AsyncClient, user: str, logins: Logins):
+    client.cookies.clear()
+    start = time.perf_counter()
+
+    response = await client.get("/login")
+    if response.status_code != 302:
+        logins.errors += 1
+        return
+    # (login_hint picks the stand-in's user)
+    response = await client.get(f"{response.headers['location']}&login_hint={user}")
+    if response.status_code != 302:
+        logins.errors += 1
+        return
+
+    auth_start = time.perf_counter()
+    response = await client.get(response.headers["location"])
+    end = time.perf_counter()
+
+    if not any(cookie.startswith("access_token=") for cookie in response.headers.get_list("set-cookie")):
+        logins.errors += 1
+        return
+    logins.latencies.append(end - start)
+    logins.auth_latencies.append(end - auth_start)
+
+
+async def run_user(base_url: str, users: list, logins: Logins, deadline: float):
+    async with httpx.AsyncClient(base_url=base_url, timeout=30) as client:
+        n = 0
+        while time.perf_counter() < deadline:
+            await log_in(client, users[n % len(users)], logins)
+            n += 1
+
+
+async def run_logins(base_url: str, concurrency: int, duration: float, users: int):
+    logins = Logins()
+    start = time.perf_counter()
+    deadline = start + duration
+    # each concurrent user logs in as their share of the users in turn
+    await asyncio.gather(*(run_user(base_url, [f"login-bench-{n}" for n in range(i, users, concurrency)], logins, deadline)
+                           for i in range(concurrency)))
+    seconds = time.perf_counter() - start
+
+    latencies, auth_latencies = sorted(logins.latencies), sorted(logins.auth_latencies)
+    return {
+        "logins": len(latencies),
+        "errors": logins.errors,
+        "logins_per_second": len(latencies) / seconds,
+        "p50_ms": percentile_ms(latencies, 50),
+        "p99_ms": percentile_ms(latencies, 99),
+        "mean_ms": statistics.fmean(latencies) * 1000 if latencies else None,
+        "auth_p50_ms": percentile_ms(auth_latencies, 50),
+        "auth_p99_ms": percentile_ms(auth_latencies, 99),
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    # (the session cookie /login sets is only sent back to /auth on the same host)
+    parser.add_argument("--base-url", default=config("REDIRECT_URL").removesuffix("/auth"), help="the server, by default REDIRECT_URL's")
+    parser.add_argument("--concurrency", default="1,4,16", help="users logging in at once, comma separated")
+    parser.add_argument("--duration", type=float, default=10, help="seconds for each concurrency")
+    parser.add_argument("--users", type=int, default=1000, help="different users logging in (added on their first login)")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    # the server must send logins to the stand-in Google
+    async with httpx.AsyncClient(base_url=args.base_url) as client:
+        location = (await client.get("/login")).headers.get("location", "")
+    if "accounts.google.com" in location or not location:
+        sys.exit("run the server with GOOGLE_AUTHORIZE_URL etc. pointing at stub_google.py (see --help)")
+
+    results = {}
+    for concurrency in map(int, args.concurrency.split(",")):
+        result = results[concurrency] = await run_logins(args.base_url, concurrency, args.duration, args.users)
+        print(f"{concurrency:3} at once  {result['logins']:6} logins  {result['logins_per_second']:7.1f} logins/s   "
+              f"p50 {result['p50_ms'] or 0:7.1f}ms   p99 {result['p99_ms'] or 0:7.1f}ms   "
+              f"(/auth p50 {result['auth_p50_ms'] or 0:.1f}ms)   errors {result['errors']}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
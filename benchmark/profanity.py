@@ -0,0 +1,119 @@
+"""
+Checking a part for profanity the old way, a new SafeText per request scanning
+the title and text separately, against the shared checker (profanity.py)
+
+Parts are realistic text at the part_text_chk limit of 1000 characters, most
+clean and some with a word from SafeText's list. Both ways must give the same
+results for every part. No database is needed.
+
+python benchmark/profanity.py [--parts 200] [--profane-share 0.1] [--json profanity.json]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from profanity import get_profanity_checker, load_word_list
+
+
+# part_text_chk in database/tables.sql
+PART_LENGTH = 1000
+
+WORDS = ("the once upon a time there was little girl who lived in village near forest her mother "
+         "made red riding hood for she went to see grandmother with basket of cakes and wolf met "
+         "path asked where going said house other side wood ran ahead knocked door opened ate up "
+         "waited bed when arrived what big eyes have all better you teeth woodcutter heard came "
+         "saved them both from that day never again spoke strangers on way home castle dragon king "
+         "queen prince sword night storm river bridge ship sea island treasure map secret garden").split()
+
+
+def make_part(rng: random.Random, profane_words: list | None = None):
+    words = []
+    while len(" ".join(words)) < PART_LENGTH - 20:
+        words.append(rng.choice(WORDS))
+    if profane_words:
+        words.insert(rng.randrange(len(words)), rng.choice(profane_words))
+
+    text = " ".join(words).capitalize()
+    return text[:PART_LENGTH - 1].rstrip() + "."
+
+
+"""
+What complete_part and save_part did before: a new SafeText each request,
+the text and title checked one after the other
+"""
+def check_per_request(part_text: str, story_title: str):
+    from safetext import SafeText
+    safe_text = SafeText(language="en")
+    return safe_text.check_profanity(text=story_title), safe_text.check_profanity(text=part_text)
+
+
+def check_shared(part_text: str, story_title: str):
+    title_results, text_results = get_profanity_checker().check_part(part_text, story_title)
+    return title_results, text_results
+
+
+"""
+An autosave: the part as last saved, then with a few words added at the end
+"""
+def check_edit_shared(previous_text: str, part_text: str):
+    return get_profanity_checker().check_edit(previous_text, part_text)
+
+
+def time_calls(function, calls: list):
+    start = time.perf_counter()
+    for arguments in calls:
+        function(*arguments)
+    return (time.perf_counter() - start) / len(calls) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--parts", type=int, default=200)
+    parser.add_argument("--profane-share", type=float, default=0.1, help="share of parts with a word from the list")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    profane_words = sorted(load_word_list("en"))
+    parts = [(make_part(rng, profane_words if rng.random() < args.profane_share else None), "A story title")
+             for _ in range(args.parts)]
+    edits = [(part_text[:-40], part_text) for part_text, _ in parts]
+
+    # (made once before timing, as it is when the app starts)
+    start = time.perf_counter()
+    get_profanity_checker()
+    load_ms = (time.perf_counter() - start) * 1000
+
+    # the shared checker must find exactly what SafeText finds
+    for part_text, story_title in parts:
+        assert check_shared(part_text, story_title) == check_per_request(part_text, story_title), part_text
+    profane = sum(1 for part_text, story_title in parts if check_shared(part_text, story_title)[1])
+
+    results = {
+        "parts": len(parts),
+        "profane_parts": profane,
+        "shared_load_ms": load_ms,
+        "per_request_us": time_calls(check_per_request, parts),
+        "shared_us": time_calls(check_shared, parts),
+        "shared_edit_us": time_calls(check_edit_shared, edits),
+    }
+    results["speedup"] = results["per_request_us"] / results["shared_us"]
+
+    print(f"{len(parts)} parts of {PART_LENGTH} characters, {profane} with profanity")
+    print(f"per request SafeText      {results['per_request_us']:10.1f}us per part")
+    print(f"shared checker            {results['shared_us']:10.1f}us per part   x{results['speedup']:.0f}   (made once in {load_ms:.0f}ms)")
+    print(f"shared checker, autosave  {results['shared_edit_us']:10.1f}us per part   (only the edit checked)")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
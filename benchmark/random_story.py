@@ -0,0 +1,106 @@
+"""
+Latency of picking a random completed story (/random_complete_story/) with the
+random_key index seek, against the ORDER BY random() query it replaced, at
+10k, 100k and 1M completed stories
+
+Each size is seeded in turn with seed.py, so the database is emptied first.
+
+python benchmark/random_story.py [--sizes 10000,100000,1000000] [--samples 200] [--json random_story.json]
+"""
+from sqlalchemy import func, text
+from sqlalchemy.sql.operators import is_not
+from sqlmodel import select
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import get_engine, async_engine, async_session_maker
+from models import Story
+from main import select_random_complete_story
+from seed import seed
+from workloads import percentile_ms
+
+
+"""
+The query /random_complete_story/ used to run: every completed story sorted
+(and, without a limit, fetched) to take the first
+"""
+async def order_by_random(session):
+    return (await session.exec(select(Story).where(is_not(Story.date_complete, None)).order_by(func.random()))).first()
+
+"""
+The same with a LIMIT, so only the sort is left
+"""
+async def order_by_random_limit(session):
+    return (await session.exec(select(Story).where(is_not(Story.date_complete, None)).order_by(func.random()).limit(1))).first()
+
+
+# name -> query picking a story
+QUERIES = {
+    "order_by_random": order_by_random,
+    "order_by_random_limit_1": order_by_random_limit,
+    "random_key": select_random_complete_story,
+}
+
+
+def seed_stories(stories: int):
+    start = time.perf_counter()
+    with get_engine().begin() as connection:
+        connection.execute(text("TRUNCATE story_search, vote, part, story, users RESTART IDENTITY CASCADE"))
+        seed(connection, users=1000, stories=stories, in_progress=1000)
+    with get_engine().connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        connection.execute(text("ANALYZE"))
+    return time.perf_counter() - start
+
+
+async def measure(query, samples: int):
+    latencies = []
+    async with async_session_maker() as session:
+        # (one untimed run first, so the connection and plan are warm)
+        await query(session)
+        for _ in range(samples):
+            start = time.perf_counter()
+            story = await query(session)
+            latencies.append(time.perf_counter() - start)
+            assert story is not None
+
+    latencies.sort()
+    return {"p50_ms": percentile_ms(latencies, 50), "p99_ms": percentile_ms(latencies, 99),
+            "mean_ms": statistics.fmean(latencies) * 1000}
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="10000,100000,1000000", help="completed stories, comma separated")
+    parser.add_argument("--samples", type=int, default=200, help="stories picked per query and size")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    results = {}
+    for size in map(int, args.sizes.split(",")):
+        print(f"Seeding {size} completed stories... ({seed_stories(size):.1f}s)")
+        results[size] = {}
+        for name, query in QUERIES.items():
+            # (the old query fetches every story, so fewer samples at the larger sizes)
+            samples = args.samples if name == "random_key" else max(args.samples * 10000 // size, 10)
+            result = results[size][name] = await measure(query, samples)
+            print(f"{size:8} stories  {name:24} p50 {result['p50_ms']:9.2f}ms   p99 {result['p99_ms']:9.2f}ms")
+
+        speedup = results[size]["order_by_random"]["p50_ms"] / results[size]["random_key"]["p50_ms"]
+        print(f"{size:8} stories  random_key is x{speedup:.0f} faster at p50")
+
+    await async_engine.dispose()
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
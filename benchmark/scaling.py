@@ -0,0 +1,95 @@
+"""
+Throughput from 1 to N gunicorn workers: starts the server (gunicorn.conf.py)
+with each worker count in turn and runs workloads against it
+
+Seed the database first (seed.py). The server gets this process's environment,
+so set DB_MAX_CONNECTIONS to see the pool shared between the workers.
+
+python benchmark/scaling.py [--max-workers 4] [--workloads random_complete_story,get_part] [--duration 20]
+"""
+from datetime import datetime
+import argparse
+import asyncio
+import httpx
+import json
+import os
+import signal
+import subprocess
+import time
+
+from workloads import run_workload, git_commit
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def start_server(workers: int, port: int):
+    env = {**os.environ, "WEB_CONCURRENCY": str(workers), "PORT": str(port), "QUERY_COUNT_HEADER": "True",
+           "RATE_LIMIT_ENABLED": "False"}
+    return subprocess.Popen(["gunicorn", "main:app", "-c", "gunicorn.conf.py"], cwd=ROOT, env=env)
+
+
+async def wait_until_ready(base_url: str, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(base_url=base_url) as client:
+        while time.monotonic() < deadline:
+            try:
+                if (await client.get("/stats")).status_code == 200:
+                    return
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.5)
+    raise TimeoutError(f"Server at {base_url} didn't start")
+
+
+def stop_server(server: subprocess.Popen):
+    server.send_signal(signal.SIGTERM)
+    server.wait(timeout=60)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count())
+    parser.add_argument("--workloads", default="random_complete_story,get_part")
+    parser.add_argument("--concurrency", type=int, default=50, help="benchmark users making requests at once")
+    parser.add_argument("--duration", type=float, default=20, help="seconds each workload runs for")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--output", help="file to write the results to (default benchmark/results/scaling-<commit>-<time>.json)")
+    args = parser.parse_args()
+
+    base_url = f"http://127.0.0.1:{args.port}"
+    commit = git_commit()
+    run = {
+        "commit": commit,
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "concurrency": args.concurrency,
+        "duration": args.duration,
+        "workers": {},
+    }
+
+    for workers in range(1, args.max_workers + 1):
+        server = start_server(workers, args.port)
+        try:
+            await wait_until_ready(base_url)
+            run["workers"][workers] = {}
+            for name in args.workloads.split(","):
+                summary = await run_workload(base_url, name, args.concurrency, args.duration, first_user=1)
+                run["workers"][workers][name] = summary
+
+                # throughput relative to one worker
+                scaling = summary["throughput_rps"] / run["workers"][1][name]["throughput_rps"]
+                print(f"{workers:2} workers  {name:22} {summary['throughput_rps']:8.1f} req/s  x{scaling:.2f}   "
+                      f"p99 {summary['p99_ms'] or 0:7.1f}ms   errors {summary['errors']}")
+        finally:
+            stop_server(server)
+
+    output = args.output or os.path.join(ROOT, "benchmark", "results",
+                                         f"scaling-{commit or 'unknown'}-{datetime.now():%Y%m%d%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(run, f, indent=2)
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
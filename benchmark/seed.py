@@ -0,0 +1,117 @@
+"""
+Fill the database (from the usual DB_ environment variables) with users,
+completed stories and stories in progress, for benchmarking
+
+Rows are generated by Postgres (generate_series) so a million stories take
+seconds rather than hours. Benchmark users have auth user ids bench-user-1,
+bench-user-2, ... (see tokens.py for their cookies).
+
+python benchmark/seed.py --stories 100000 [--users 1000] [--in-progress 1000] --reset
+
+--reset empties the tables first, it is needed if the database isn't empty.
+"""
+from sqlalchemy import text
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import get_engine
+from models import Story
+from search import index_stories
+
+
+BENCH_USER_PREFIX = "bench-user-"
+
+# text of roughly the length of a real part (up to 1000 characters)
+PART_TEXT = "The quick brown fox jumps over the lazy dog. " * 20
+
+# how many different words parts end with, so a search for one matches a few stories
+SEARCH_WORDS = 1000
+
+
+def seed(connection, users: int, stories: int, in_progress: int):
+    parameters = {"users": users, "stories": stories, "in_progress": in_progress,
+                  "prefix": BENCH_USER_PREFIX, "part_text": PART_TEXT, "search_words": SEARCH_WORDS}
+
+    # users 1..users
+    connection.execute(text("""
+        INSERT INTO users (auth_user_id, refresh_token, locked, parts_complete)
+        SELECT :prefix || n, 'bench-refresh-token', false, 0 FROM generate_series(1, :users) n
+    """), parameters)
+
+    # completed stories 1..stories, a story completed every minute up to now
+    connection.execute(text("""
+        INSERT INTO story (id, title, date_complete, locked, last_user_id, random_key, next_part, votes, score)
+        SELECT n, 'Story ' || n, now() - make_interval(mins => :stories - n), true,
+               (n * 5 + 4) % :users + 1, random(), 6, 0, NULL
+        FROM generate_series(1, :stories) n
+    """), parameters)
+
+    # stories in progress after them, unlocked with 1 to 4 parts written
+    connection.execute(text("""
+        INSERT INTO story (id, title, date_complete, locked, last_user_id, random_key, next_part, votes, score)
+        SELECT n, 'Story ' || n, NULL, false, (n * 5 + n % 4) % :users + 1, NULL, n % 4 + 2, 0, NULL
+        FROM generate_series(:stories + 1, :stories + :in_progress) n
+    """), parameters)
+
+    # each part written by a different user, a day apart
+    # (ending with one of SEARCH_WORDS words, e.g. word123, to search for)
+    connection.execute(text("""
+        INSERT INTO part (part_number, part_text, story_id, user_id, date_started, date_complete)
+        SELECT k, :part_text || ' word' || (story.id * 7 + k * 13) % :search_words, story.id, (story.id * 5 + k - 1) % :users + 1,
+               coalesce(story.date_complete, now()) - make_interval(days => 6 - k),
+               coalesce(story.date_complete, now()) - make_interval(days => 5 - k)
+        FROM story CROSS JOIN generate_series(1, 5) k
+        WHERE k < story.next_part
+    """), parameters)
+
+    # search documents for the completed stories
+    connection.execute(index_stories(Story.date_complete.is_not(None)))
+
+    # carry on the sequences after the generated ids
+    connection.execute(text("SELECT setval(pg_get_serial_sequence('story', 'id'), (SELECT max(id) FROM story))"))
+
+    # counters and contribution counts, as the migrations start them
+    connection.execute(text("""
+        INSERT INTO counters (name, value) VALUES
+            ('stories_complete',    (SELECT count(*) FROM story WHERE date_complete IS NOT NULL)),
+            ('stories_in_progress', (SELECT count(*) FROM story WHERE date_complete IS NULL)),
+            ('parts_complete',      (SELECT count(*) FROM part WHERE date_complete IS NOT NULL))
+        ON CONFLICT (name) DO UPDATE SET value = excluded.value
+    """))
+    connection.execute(text("""
+        UPDATE users SET parts_complete = counts.parts_complete
+        FROM (SELECT user_id, count(*) AS parts_complete FROM part GROUP BY user_id) counts
+        WHERE users.id = counts.user_id
+    """))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--stories", type=int, default=10000, help="completed stories (5 parts each)")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--in-progress", type=int, default=1000, help="stories with 1 to 4 parts written")
+    parser.add_argument("--reset", action="store_true", help="empty the tables first")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    with get_engine().begin() as connection:
+        if args.reset:
+            connection.execute(text("TRUNCATE story_search, vote, part, story, users RESTART IDENTITY CASCADE"))
+        elif connection.execute(text("SELECT EXISTS (SELECT 1 FROM story)")).scalar():
+            sys.exit("The database already has stories, use --reset to empty it first")
+
+        seed(connection, args.users, args.stories, args.in_progress)
+
+        # fresh statistics for the planner
+        connection.execute(text("ANALYZE"))
+
+    print(f"Seeded {args.users} users, {args.stories} completed stories and {args.in_progress} "
+          f"in progress in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""
+Compare the time and allocations taken to serialize each hot read response
+the default way (response_model validation then the stdlib json encoder, as
+FastAPI does) and the FAST_JSON way (rows mapped to dicts then orjson)
+
+No database is needed, stories are built in memory (the app is imported for
+/my_stories/'s response model, so the app's environment variables must be set).
+
+python benchmark/serialization.py [--number 2000] [--json results.json]
+"""
+from datetime import datetime, timedelta
+from fastapi.responses import JSONResponse, ORJSONResponse
+from pydantic import TypeAdapter
+import argparse
+import json
+import orjson
+import os
+import sys
+import timeit
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models import Story, Part, PartPublic, PartPublicWithStory, StoryPublicWithParts
+from serialization import part_to_dict, story_to_dict
+
+
+def make_story(story_id: int, part_length: int = 1000):
+    date_started = datetime(2025, 1, 1, 12, 0, 0, 123456)
+    story = Story(id=story_id, title="A story title", date_complete=date_started + timedelta(days=5), locked=True, last_user_id=5)
+    story.parts = [
+        Part(id=story_id * 5 + number, part_number=number, part_text="word " * (part_length // 5),
+             story_id=story_id, user_id=number, date_started=date_started + timedelta(days=number - 1),
+             date_complete=date_started + timedelta(days=number))
+        for number in range(1, 6)
+    ]
+    return story
+
+
+"""
+What FastAPI does with a response_model: validate from the ORM object,
+dump to JSON compatible python, then encode with json.dumps
+"""
+def default_serializer(response_type):
+    adapter = TypeAdapter(response_type)
+    def serialize(value):
+        content = adapter.dump_python(adapter.validate_python(value, from_attributes=True), mode="json")
+        return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode()
+    return serialize
+
+
+"""
+/my_stories/ returns a Page that apaginate has already validated (so the same for
+both ways, and not timed): by default FastAPI validates it against the route's
+response model, serializes it and renders it with JSONResponse, the FAST_JSON
+way it is dumped and rendered with ORJSONResponse
+(validate then serialize is what fastapi.routing.serialize_response does, called
+directly as it is a coroutine)
+"""
+def my_stories_serializers(page_size: int):
+    from fastapi_pagination.api import _req_val
+    from main import app
+    from starlette.requests import Request
+
+    # the page's links are made from the request, set for each request by the route's pagination dependency
+    _req_val.set(Request({"type": "http", "method": "GET", "scheme": "http", "server": ("bench", 80), "path": "/my_stories/",
+                          "query_string": f"page=1&size={page_size}".encode(), "headers": []}))
+
+    route = next(route for route in app.routes if getattr(route, "path", None) == "/my_stories/")
+    Page = route.response_model
+    page = Page.create([make_story(story_id) for story_id in range(1, page_size + 1)], total=page_size,
+                       params=Page.__params_type__(page=1, size=page_size))
+
+    def default(page):
+        value, errors = route.response_field.validate(page, {}, loc=("response",))
+        assert not errors, errors
+        return JSONResponse(route.response_field.serialize(value, by_alias=True)).body
+
+    def fast(page):
+        return ORJSONResponse(page.model_dump()).body
+
+    return page, default, fast
+
+
+def allocations(function):
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    before = tracemalloc.take_snapshot()
+    function()
+    after = tracemalloc.take_snapshot()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    blocks = sum(stat.count_diff for stat in after.compare_to(before, "filename") if stat.count_diff > 0)
+    return {"peak_bytes": peak, "blocks": blocks}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--number", type=int, default=2000, help="serializations timed per endpoint")
+    parser.add_argument("--page-size", type=int, default=10, help="stories in a /my_stories/ page")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    story = make_story(1)
+    part = story.parts[-1]
+
+    # endpoint -> (value, default serializer, fast serializer)
+    endpoints = {
+        "/get_part/": (part, default_serializer(PartPublicWithStory), lambda part: orjson.dumps(part_to_dict(part, with_story=True))),
+        "/get_previous_part/": (part, default_serializer(PartPublic), lambda part: orjson.dumps(part_to_dict(part))),
+        "/stories/{story_id} (cache miss)": (story, default_serializer(StoryPublicWithParts), lambda story: orjson.dumps(story_to_dict(story))),
+        "/my_stories/": my_stories_serializers(args.page_size),
+    }
+
+    results = []
+    for endpoint, (value, default, fast) in endpoints.items():
+        # both ways must give the same JSON
+        assert json.loads(default(value)) == json.loads(fast(value)), endpoint
+
+        result = {"endpoint": endpoint}
+        for name, serialize in (("default", default), ("fast", fast)):
+            seconds = timeit.timeit(lambda: serialize(value), number=args.number)
+            result[name] = {"microseconds": seconds / args.number * 1e6, **allocations(lambda: serialize(value))}
+        result["speedup"] = result["default"]["microseconds"] / result["fast"]["microseconds"]
+        results.append(result)
+
+        print(f"{endpoint:36} default {result['default']['microseconds']:8.1f}us {result['default']['blocks']:6} blocks"
+              f"   fast {result['fast']['microseconds']:8.1f}us {result['fast']['blocks']:6} blocks"
+              f"   x{result['speedup']:.1f}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
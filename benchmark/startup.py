@@ -0,0 +1,103 @@
+"""
+How long the app takes to import (python -X importtime) and to answer its first
+request once started, the cost of a cold start
+
+python benchmark/startup.py [--runs 5] [--top 15] [--max-import-ms 1500] [--json startup.json]
+
+Exits with status 1 if the median import time is over --max-import-ms, to catch regressions.
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# "import time: self [us] | cumulative | imported package"
+IMPORT_TIME_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)")
+
+
+"""
+Import main with -X importtime
+Returns the time to import main and the modules it imports that take longest (including what they import)
+"""
+def measure_import(top: int):
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import main"],
+                            cwd=ROOT, capture_output=True, text=True)
+    if result.returncode != 0:
+        sys.exit(f"Importing main failed:\n{result.stderr[-2000:]}")
+
+    # (main's own line comes last, the modules it imports directly are indented one level under it)
+    modules = []
+    for line in result.stderr.splitlines():
+        match = IMPORT_TIME_LINE.match(line)
+        if match:
+            _, cumulative_us, indent, module = match.groups()
+            modules.append((module, int(cumulative_us), len(indent)))
+
+    main_index = next(i for i, (module, _, depth) in enumerate(modules) if module == "main" and depth == 1)
+    first_index = main_index
+    while first_index > 0 and modules[first_index - 1][2] > 1:
+        first_index -= 1
+
+    total_ms = modules[main_index][1] / 1000
+    imported = [module for module in modules[first_index:main_index] if module[2] == 3]
+    slowest = sorted(imported, key=lambda module: -module[1])[:top]
+    return total_ms, [{"module": module, "cumulative_ms": cumulative / 1000} for module, cumulative, _ in slowest]
+
+
+"""
+Start the server and time how long until it answers a request
+"""
+def measure_first_response(port: int, path: str, timeout: float = 60):
+    start = time.perf_counter()
+    server = subprocess.Popen([sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+                              cwd=ROOT)
+    try:
+        while time.perf_counter() - start < timeout:
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}{path}", timeout=5):
+                    return (time.perf_counter() - start) * 1000
+            except OSError:
+                time.sleep(0.01)
+        raise TimeoutError("Server didn't answer")
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15, help="slowest imports to show")
+    parser.add_argument("--port", type=int, default=8200)
+    parser.add_argument("--path", default="/metrics", help="request timed for the first response")
+    parser.add_argument("--max-import-ms", type=float, help="fail if the median import time is over this")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    imports = [measure_import(args.top) for _ in range(args.runs)]
+    import_ms = statistics.median(total for total, _ in imports)
+    first_response_ms = statistics.median(measure_first_response(args.port, args.path) for _ in range(args.runs))
+
+    print(f"import main: {import_ms:.0f}ms (median of {args.runs})")
+    for module in imports[-1][1]:
+        print(f"  {module['module']:40} {module['cumulative_ms']:8.1f}ms")
+    print(f"first response ({args.path}): {first_response_ms:.0f}ms (median of {args.runs})")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"import_ms": import_ms, "first_response_ms": first_response_ms, "slowest_imports": imports[-1][1]}, f, indent=2)
+
+    if args.max_import_ms and import_ms > args.max_import_ms:
+        sys.exit(f"Import took {import_ms:.0f}ms, over {args.max_import_ms:.0f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Stand-in for Google's login (authorize, token and keys) and userinfo endpoints,
+so logins and token refreshes can be benchmarked offline. Run it, then start
+the server with
+GOOGLE_AUTHORIZE_URL=http://localhost:8001/authorize
+GOOGLE_TOKEN_URL=http://localhost:8001/token
+GOOGLE_JWKS_URL=http://localhost:8001/certs and
+GOOGLE_USERINFO_URL=http://localhost:8001/userinfo
+
+/authorize logs in whoever is named by login_hint (or someone new) straight
+away, and /token signs their id_token with a key made at startup.
+
+python benchmark/stub_google.py [--port 8001] [--latency 0.05]
+"""
+from fastapi import FastAPI, Form, Header, HTTPException
+from fastapi.responses import RedirectResponse
+from urllib.parse import urlencode
+import argparse
+import asyncio
+import time
+import uuid
+import uvicorn
+
+
+app = FastAPI()
+
+# seconds each response is delayed by, to stand in for the round trip to Google
+latency = 0.0
+
+ISSUER = "https://accounts.google.com"
+
+# the key id_tokens are signed with (made on first use, authlib is only needed for logins)
+signing_key = None
+
+def get_signing_key():
+    global signing_key
+    if signing_key is None:
+        from authlib.jose import JsonWebKey
+        signing_key = JsonWebKey.generate_key("RSA", 2048, is_private=True)
+    return signing_key
+
+# codes given out by /authorize and not yet exchanged -> (client id, user, nonce)
+codes = {}
+
+
+@app.get("/authorize")
+async def authorize(client_id: str, redirect_uri: str, state: str, nonce: str = None, login_hint: str = None):
+    await asyncio.sleep(latency)
+    code = uuid.uuid4().hex
+    codes[code] = (client_id, login_hint or f"stub-user-{uuid.uuid4().hex}", nonce)
+    return RedirectResponse(f"{redirect_uri}?{urlencode({'code': code, 'state': state})}", status_code=302)
+
+
+@app.post("/token")
+async def token(grant_type: str = Form(), refresh_token: str = Form(None), code: str = Form(None)):
+    await asyncio.sleep(latency)
+    token = {"access_token": uuid.uuid4().hex, "expires_in": 3599, "token_type": "Bearer", "scope": "openid profile email"}
+    if grant_type != "authorization_code":
+        return token
+
+    if code not in codes:
+        raise HTTPException(status_code=400, detail="invalid_grant")
+    client_id, user, nonce = codes.pop(code)
+
+    from authlib.jose import jwt
+    now = int(time.time())
+    claims = {"iss": ISSUER, "aud": client_id, "sub": user, "email": f"{user}@example.com", "iat": now, "exp": now + 3599}
+    if nonce:
+        claims["nonce"] = nonce
+    key = get_signing_key()
+    id_token = jwt.encode({"alg": "RS256", "kid": key.thumbprint()}, claims, key).decode()
+    return {**token, "id_token": id_token, "refresh_token": uuid.uuid4().hex}
+
+
+@app.get("/certs")
+async def certs():
+    await asyncio.sleep(latency)
+    key = get_signing_key()
+    return {"keys": [{**key.as_dict(is_private=False), "kid": key.thumbprint(), "alg": "RS256", "use": "sig"}]}
+
+
+@app.get("/userinfo")
+async def userinfo(authorization: str = Header(None)):
+    await asyncio.sleep(latency)
+    return {"id": "bench", "name": "Bench User", "picture": ""}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds to delay each response")
+    args = parser.parse_args()
+
+    latency = args.latency
+    uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning")
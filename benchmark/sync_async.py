@@ -0,0 +1,125 @@
+"""
+Throughput of the same request served by a sync route (a threadpool worker held
+while it waits on Postgres, as the routes were) and by an async route (the event
+loop waiting on asyncpg, as they are now), in one uvicorn worker
+
+Both load a completed story with its parts by id, what /stories/{id} does on a
+cache miss. The server (this module's app) is started on --port, using the
+pools from database.py: the sync engine's defaults and the async engine's
+DB_POOL_SIZE/DB_MAX_OVERFLOW.
+
+Seed the database first (seed.py).
+
+python benchmark/sync_async.py [--concurrency 1,10,50,100] [--duration 10]
+"""
+from fastapi import FastAPI
+from sqlalchemy import func
+from sqlalchemy.orm import selectinload
+from sqlmodel import select
+import argparse
+import asyncio
+import httpx
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import SessionDep, AsyncSessionDep, get_engine
+from models import Story, StoryPublicWithParts
+from workloads import percentile_ms
+
+
+app = FastAPI()
+
+
+def story_query(story_id: int):
+    return select(Story).options(selectinload(Story.parts)).where(Story.id == story_id)
+
+
+@app.get("/sync/stories/{story_id}", response_model=StoryPublicWithParts)
+def get_story_sync(story_id: int, session: SessionDep):
+    return session.exec(story_query(story_id)).first()
+
+
+@app.get("/async/stories/{story_id}", response_model=StoryPublicWithParts)
+async def get_story_async(story_id: int, session: AsyncSessionDep):
+    return (await session.exec(story_query(story_id))).first()
+
+
+async def wait_until_ready(client: httpx.AsyncClient, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            await client.get("/docs")
+            return
+        except httpx.TransportError:
+            await asyncio.sleep(0.2)
+    raise TimeoutError("Server didn't start")
+
+
+async def run(client: httpx.AsyncClient, mode: str, max_story_id: int, concurrency: int, duration: float):
+    latencies = []
+    errors = 0
+
+    async def user():
+        nonlocal errors
+        deadline = time.perf_counter() + duration
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            response = await client.get(f"/{mode}/stories/{random.randint(1, max_story_id)}")
+            latencies.append(time.perf_counter() - start)
+            if response.status_code != 200:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(user() for _ in range(concurrency)))
+    seconds = time.perf_counter() - start
+
+    latencies.sort()
+    return {"requests": len(latencies), "errors": errors, "throughput_rps": len(latencies) / seconds,
+            "p50_ms": percentile_ms(latencies, 50), "p99_ms": percentile_ms(latencies, 99)}
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", default="1,10,50,100", help="requests made at once, comma separated")
+    parser.add_argument("--duration", type=float, default=10, help="seconds each mode runs for at each concurrency")
+    parser.add_argument("--port", type=int, default=8300)
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    with get_engine().connect() as connection:
+        max_story_id = connection.execute(select(func.max(Story.id)).where(Story.date_complete.is_not(None))).scalar()
+    if not max_story_id:
+        sys.exit("No completed stories, seed the database first (seed.py)")
+
+    server = subprocess.Popen([sys.executable, "-m", "uvicorn", "sync_async:app", "--port", str(args.port), "--log-level", "warning"],
+                              cwd=os.path.dirname(os.path.abspath(__file__)))
+    results = {}
+    try:
+        limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{args.port}", limits=limits, timeout=60) as client:
+            await wait_until_ready(client)
+            for concurrency in map(int, args.concurrency.split(",")):
+                results[concurrency] = {}
+                for mode in ("sync", "async"):
+                    result = results[concurrency][mode] = await run(client, mode, max_story_id, concurrency, args.duration)
+                    print(f"{concurrency:4} at once  {mode:5} {result['throughput_rps']:8.1f} req/s   "
+                          f"p50 {result['p50_ms'] or 0:7.1f}ms   p99 {result['p99_ms'] or 0:7.1f}ms   errors {result['errors']}")
+                speedup = results[concurrency]["async"]["throughput_rps"] / results[concurrency]["sync"]["throughput_rps"]
+                print(f"{concurrency:4} at once  async x{speedup:.2f} the throughput of sync")
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,29 @@
+"""
+Access token cookies for the seeded benchmark users, signed with the app's
+own create_access_token (so JWT_SECRET_KEY etc. must match the server's)
+
+python benchmark/tokens.py 3    (prints a cookie for bench-user-3)
+"""
+from datetime import timedelta
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from auth import create_access_token
+from seed import BENCH_USER_PREFIX
+
+
+"""
+The access_token cookie for benchmark user n
+An expiry inside TOKEN_REFRESH_THRESHOLD_IN_MINUTES makes the server refresh
+the token (against the stub Google token endpoint, see stub_google.py)
+"""
+def bench_cookie(n: int, expires_in: timedelta = timedelta(hours=1)):
+    access_token = create_access_token(data={"sub": f"{BENCH_USER_PREFIX}{n}", "user_name": f"Bench User {n}"},
+                                       expires_delta=expires_in)
+    return {"access_token": access_token}
+
+
+if __name__ == "__main__":
+    print(bench_cookie(int(sys.argv[1]))["access_token"])
@@ -0,0 +1,212 @@
+"""
+Voting at scale: a million votes over the seeded stories, then the latency of
+voting (add_vote), of /top_stories/, and of picking a story weighted by its
+votes with the in-memory sampler against doing it in SQL
+
+Votes go to stories with a skew (a few stories get most of them) from random
+users over the last 30 days, and every story's votes and score are computed from
+them in SQL. The scores add_vote keeps up one vote at a time are then checked
+against the same SQL. The database is emptied and seeded first (seed.py).
+
+python benchmark/voting.py [--stories 100000] [--users 10000] [--votes 1000000] [--samples 500] [--json voting.json]
+"""
+from sqlalchemy import text
+import argparse
+import asyncio
+import httpx
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import get_engine, async_engine, async_session_maker
+from main import app
+from metrics import logger
+from seed import seed
+from voting import add_vote, WeightedStorySampler, SCORE_EPOCH, VOTE_HALF_LIFE_IN_HOURS
+from workloads import percentile_ms
+
+
+# a story's score from its votes, as voting.py keeps it: the log of the sum of
+# the votes' weights, 2 ** (hours since SCORE_EPOCH / half life)
+SCORE_SQL = """
+    SELECT story_id, count(*) AS votes, max(weight) + ln(sum(exp(weight - max_weight))) AS score
+    FROM (
+        SELECT story_id, weight, max(weight) OVER (PARTITION BY story_id) AS max_weight
+        FROM (
+            SELECT story_id, extract(epoch FROM date_voted - :epoch) / 3600 / :half_life * ln(2) AS weight
+            FROM vote {where}
+        ) weights
+    ) weights
+    GROUP BY story_id
+"""
+
+
+def seed_votes(stories: int, users: int, votes: int):
+    start = time.perf_counter()
+    parameters = {"stories": stories, "users": users, "votes": votes,
+                  "epoch": SCORE_EPOCH, "half_life": VOTE_HALF_LIFE_IN_HOURS}
+    with get_engine().begin() as connection:
+        connection.execute(text("TRUNCATE story_search, vote, part, story, users RESTART IDENTITY CASCADE"))
+        seed(connection, users=users, stories=stories, in_progress=1000)
+
+        # random() cubed, so low story ids get most of the votes (a user's second vote for a story is dropped)
+        connection.execute(text("""
+            INSERT INTO vote (user_id, story_id, date_voted)
+            SELECT floor(random() * :users) + 1, floor(random() ^ 3 * :stories) + 1, now() - random() * interval '30 days'
+            FROM generate_series(1, :votes)
+            ON CONFLICT ON CONSTRAINT vote_user_story_key DO NOTHING
+        """), parameters)
+
+        connection.execute(text(f"""
+            UPDATE story SET votes = scores.votes, score = scores.score
+            FROM ({SCORE_SQL.format(where="")}) scores
+            WHERE story.id = scores.story_id
+        """), parameters)
+        seeded = connection.execute(text("SELECT count(*) FROM vote")).scalar()
+
+    with get_engine().connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        connection.execute(text("ANALYZE"))
+    return seeded, time.perf_counter() - start
+
+
+def summary(latencies: list):
+    latencies = sorted(latencies)
+    return {"p50_ms": percentile_ms(latencies, 50), "p99_ms": percentile_ms(latencies, 99),
+            "mean_ms": statistics.fmean(latencies) * 1000}
+
+
+"""
+Votes by new users for random stories, then the stories' scores checked against the SQL
+"""
+async def measure_add_vote(stories: int, samples: int):
+    # new users, so every vote is counted rather than a no-op
+    with get_engine().begin() as connection:
+        first_user = connection.execute(text("""
+            INSERT INTO users (auth_user_id, refresh_token) SELECT 'voting-bench-' || n, '' FROM generate_series(1, :samples) n
+            RETURNING id
+        """), {"samples": samples}).scalars().all()[0]
+
+    latencies = []
+    story_ids = set()
+    async with async_session_maker() as session:
+        for n in range(samples):
+            story_id = int(random.random() ** 3 * stories) + 1
+            start = time.perf_counter()
+            votes = await add_vote(session, first_user + n, story_id)
+            latencies.append(time.perf_counter() - start)
+            assert votes is not None
+            story_ids.add(story_id)
+
+    parameters = {"epoch": SCORE_EPOCH, "half_life": VOTE_HALF_LIFE_IN_HOURS, "story_ids": list(story_ids)}
+    with get_engine().connect() as connection:
+        expected = connection.execute(text(SCORE_SQL.format(where="WHERE story_id = ANY(:story_ids)")), parameters).all()
+        kept = dict(connection.execute(text("SELECT id, score FROM story WHERE id = ANY(:story_ids)"), parameters).all())
+    for story_id, _, score in expected:
+        assert abs(kept[story_id] - float(score)) < 1e-6, (story_id, kept[story_id], score)
+
+    return summary(latencies)
+
+
+async def measure_top_stories(samples: int):
+    # (not a log line per request)
+    logger.setLevel("WARNING")
+    latencies = []
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+        cursor = None
+        for n in range(samples + 1):
+            # the first page, then on through the pages
+            params = {"size": 50} if cursor is None or n % 10 == 0 else {"size": 50, "cursor": cursor}
+            start = time.perf_counter()
+            response = await client.get("/top_stories/", params=params)
+            if n:
+                latencies.append(time.perf_counter() - start)
+            assert response.status_code == 200, response.text
+            cursor = response.json()["next_cursor"]
+    return summary(latencies)
+
+
+async def measure_sampler(samples: int):
+    sampler = WeightedStorySampler()
+    start = time.perf_counter()
+    await sampler.rebuild()
+    rebuild_ms = (time.perf_counter() - start) * 1000
+
+    latencies = []
+    for _ in range(samples):
+        start = time.perf_counter()
+        await sampler.sample()
+        latencies.append(time.perf_counter() - start)
+
+    # a cold worker: requests arriving together share one rebuild
+    cold = WeightedStorySampler()
+    rebuilds = 0
+    rebuild = cold.rebuild
+    async def counted_rebuild():
+        nonlocal rebuilds
+        rebuilds += 1
+        await rebuild()
+    cold.rebuild = counted_rebuild
+    start = time.perf_counter()
+    await asyncio.gather(*(cold.sample() for _ in range(100)))
+    cold_ms = (time.perf_counter() - start) * 1000
+
+    return {"rebuild_ms": rebuild_ms, **summary(latencies), "cold_100_requests_ms": cold_ms, "cold_rebuilds": rebuilds}
+
+
+"""
+The same pick in SQL: the smallest -ln(random()) / weight is a story picked in
+proportion to its weight, but every completed story is read for each pick
+"""
+async def measure_sql_sampling(samples: int):
+    latencies = []
+    async with async_session_maker() as session:
+        for _ in range(samples):
+            start = time.perf_counter()
+            story_id = (await session.exec(text(
+                "SELECT id FROM story WHERE date_complete IS NOT NULL ORDER BY -ln(random()) / (votes + 1) LIMIT 1"
+            ))).scalar()
+            latencies.append(time.perf_counter() - start)
+            assert story_id is not None
+    return summary(latencies)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--stories", type=int, default=100000, help="completed stories")
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--votes", type=int, default=1000000, help="votes to seed (a user's second vote for a story is dropped)")
+    parser.add_argument("--samples", type=int, default=500, help="votes, pages and picks timed")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    votes, seconds = seed_votes(args.stories, args.users, args.votes)
+    print(f"Seeded {args.stories} stories and {votes} votes ({seconds:.1f}s)")
+
+    results = {"stories": args.stories, "votes": votes}
+    results["add_vote"] = await measure_add_vote(args.stories, args.samples)
+    results["top_stories"] = await measure_top_stories(args.samples)
+    results["sampler"] = await measure_sampler(args.samples * 100)
+    results["sql_sampling"] = await measure_sql_sampling(max(args.samples // 10, 10))
+    await async_engine.dispose()
+
+    for name in ("add_vote", "top_stories", "sampler", "sql_sampling"):
+        result = results[name]
+        print(f"{name:14} p50 {result['p50_ms']:9.3f}ms   p99 {result['p99_ms']:9.3f}ms")
+    sampler = results["sampler"]
+    print(f"sampler rebuilt in {sampler['rebuild_ms']:.0f}ms, x{results['sql_sampling']['p50_ms'] / sampler['p50_ms']:.0f} faster "
+          f"than SQL at p50; 100 requests on a cold worker took {sampler['cold_100_requests_ms']:.0f}ms "
+          f"with {sampler['cold_rebuilds']} rebuild")
+    print("add_vote's scores match the scores computed from every vote")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
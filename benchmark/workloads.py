@@ -0,0 +1,197 @@
+"""
+Drive the main routes of a running server with concurrent benchmark users and
+report p50/p99 latency, throughput and database statements per request
+
+Seed the database first (seed.py) and run the server with QUERY_COUNT_HEADER=True
+to get statement counts (and RATE_LIMIT_ENABLED=False, so it isn't throttled). Results are written as JSON to compare between commits
+(compare.py).
+
+python benchmark/workloads.py [--base-url http://localhost:8000] [--concurrency 20]
+                              [--duration 30] [--workloads get_part,my_stories] [--output results.json]
+"""
+from datetime import datetime
+import argparse
+import asyncio
+import httpx
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from seed import PART_TEXT, SEARCH_WORDS
+from tokens import bench_cookie
+
+
+"""
+Nearest rank percentile of sorted latencies
+"""
+def percentile_ms(latencies: list, percentile: int):
+    if not latencies:
+        return None
+    return latencies[min(len(latencies) * percentile // 100, len(latencies) - 1)] * 1000
+
+
+"""
+Latencies, errors and statement counts for one workload's requests
+"""
+class Results:
+
+    def __init__(self):
+        self.latencies = []
+        self.query_counts = []
+        self.errors = 0
+
+    async def request(self, client: httpx.AsyncClient, method: str, url: str, **kwargs):
+        start = time.perf_counter()
+        response = await client.request(method, url, **kwargs)
+        self.latencies.append(time.perf_counter() - start)
+
+        # (the part routes report a rejected part in the body)
+        if response.status_code >= 400 or (method == "PATCH" and response.json().get("status") != 200):
+            self.errors += 1
+
+        query_count = response.headers.get("X-Query-Count")
+        if query_count is not None:
+            self.query_counts.append(int(query_count))
+
+        return response
+
+    def summary(self, seconds: float):
+        latencies = sorted(self.latencies)
+        return {
+            "requests": len(latencies),
+            "errors": self.errors,
+            "throughput_rps": len(latencies) / seconds,
+            "p50_ms": percentile_ms(latencies, 50),
+            "p99_ms": percentile_ms(latencies, 99),
+            "mean_ms": statistics.fmean(latencies) * 1000 if latencies else None,
+            "queries_per_request": statistics.fmean(self.query_counts) if self.query_counts else None,
+        }
+
+
+# Workloads, each run in a loop by every concurrent user
+# (setup runs once per user before the clock starts)
+
+async def get_part(client: httpx.AsyncClient, results: Results, state: dict):
+    await results.request(client, "GET", "/get_part/")
+
+
+async def setup_save_part(client: httpx.AsyncClient, state: dict):
+    state["part_id"] = (await client.get("/get_part/")).json()["id"]
+    state["saves"] = 0
+
+async def save_part(client: httpx.AsyncClient, results: Results, state: dict):
+    # different text each time, otherwise the save is skipped
+    state["saves"] += 1
+    await results.request(client, "PATCH", f"/save_part/{state['part_id']}",
+                          json={"part_text": f"{PART_TEXT}{state['saves']}", "story_title": None})
+
+
+async def complete_part(client: httpx.AsyncClient, results: Results, state: dict):
+    # only the completion is timed, getting the next part to complete isn't
+    part = (await client.get("/get_part/")).json()
+    story_title = "A benchmark story" if part["part_number"] == 1 else None
+    await results.request(client, "PATCH", f"/complete_part/{part['id']}",
+                          json={"part_text": PART_TEXT, "story_title": story_title})
+
+
+async def random_complete_story(client: httpx.AsyncClient, results: Results, state: dict):
+    await results.request(client, "GET", "/random_complete_story/")
+
+
+async def my_stories(client: httpx.AsyncClient, results: Results, state: dict):
+    await results.request(client, "GET", "/my_stories/", params={"page": 1})
+
+
+async def search(client: httpx.AsyncClient, results: Results, state: dict):
+    await results.request(client, "GET", "/search", params={"q": f"word{random.randrange(SEARCH_WORDS)}"})
+
+
+# name -> (workload, setup)
+WORKLOADS = {
+    "get_part": (get_part, None),
+    "save_part": (save_part, setup_save_part),
+    "complete_part": (complete_part, None),
+    "random_complete_story": (random_complete_story, None),
+    "my_stories": (my_stories, None),
+    "search": (search, None),
+}
+
+
+async def run_user(base_url: str, user: int, workload, setup, results: Results, started: asyncio.Barrier, duration: float):
+    async with httpx.AsyncClient(base_url=base_url, cookies=bench_cookie(user), timeout=30) as client:
+        state = {}
+        if setup is not None:
+            await setup(client, state)
+
+        await started.wait()
+        deadline = time.perf_counter() + duration
+        while time.perf_counter() < deadline:
+            await workload(client, results, state)
+
+
+async def run_workload(base_url: str, name: str, concurrency: int, duration: float, first_user: int):
+    workload, setup = WORKLOADS[name]
+    results = Results()
+    # (everyone waits here once set up, so setup isn't timed)
+    started = asyncio.Barrier(concurrency + 1)
+
+    # each concurrent user is a different benchmark user, so they never share parts
+    tasks = [asyncio.create_task(run_user(base_url, first_user + i, workload, setup, results, started, duration))
+             for i in range(concurrency)]
+
+    await started.wait()
+    start = time.perf_counter()
+    await asyncio.gather(*tasks)
+
+    return results.summary(time.perf_counter() - start)
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--concurrency", type=int, default=20, help="benchmark users making requests at once")
+    parser.add_argument("--duration", type=float, default=30, help="seconds each workload runs for")
+    parser.add_argument("--workloads", default=",".join(WORKLOADS), help="comma separated, from: " + ", ".join(WORKLOADS))
+    parser.add_argument("--first-user", type=int, default=1, help="benchmark user number the concurrent users start from")
+    parser.add_argument("--output", help="file to write the results to (default benchmark/results/<commit>-<time>.json)")
+    args = parser.parse_args()
+
+    commit = git_commit()
+    run = {
+        "commit": commit,
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "base_url": args.base_url,
+        "concurrency": args.concurrency,
+        "duration": args.duration,
+        "workloads": {},
+    }
+
+    for name in args.workloads.split(","):
+        summary = await run_workload(args.base_url, name, args.concurrency, args.duration, args.first_user)
+        run["workloads"][name] = summary
+        print(f"{name:22} {summary['throughput_rps']:8.1f} req/s   p50 {summary['p50_ms'] or 0:7.1f}ms   "
+              f"p99 {summary['p99_ms'] or 0:7.1f}ms   queries {summary['queries_per_request'] or 0:4.1f}   errors {summary['errors']}")
+
+    output = args.output or os.path.join(os.path.dirname(os.path.abspath(__file__)), "results",
+                                         f"{commit or 'unknown'}-{datetime.now():%Y%m%d%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(run, f, indent=2)
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,53 @@
+from decouple import config
+from sqlalchemy.orm import selectinload
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from models import Story
+from serialization import serialize_story
+from shared_state import create_backend, SHARED_STATE_REDIS_URL
+
+
+# Completed story cache config from env
+# (shared through SHARED_STATE_REDIS_URL if set, or STORY_CACHE_REDIS_URL to use a different Redis)
+STORY_CACHE_MAX_BYTES = config("STORY_CACHE_MAX_BYTES", default=16 * 1024 * 1024, cast=int)
+STORY_CACHE_REDIS_URL = config("STORY_CACHE_REDIS_URL", default=SHARED_STATE_REDIS_URL)
+
+
+"""
+Completed stories as StoryPublicWithParts JSON, keyed by story id
+Completed stories never change so entries never need invalidating
+"""
+class StoryCache:
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    async def get(self, story_id: int):
+        return await self.backend.get(story_id)
+
+    async def put(self, story: Story):
+        story_json = serialize_story(story)
+        await self.backend.set(story.id, story_json)
+        return story_json
+
+    """
+    The JSON for each story (in the order given), loading any not cached in one query
+    """
+    async def get_many(self, session: AsyncSession, story_ids: list[int]):
+        cached = await self.backend.get_many(story_ids)
+
+        missing = [story_id for story_id in story_ids if story_id not in cached]
+        if missing:
+            stories = (await session.exec(
+                            select(Story).options(selectinload(Story.parts))
+                                         .where(Story.id.in_(missing))
+                                         .execution_options(populate_existing=True)
+                        )).all()
+            for story in stories:
+                cached[story.id] = await self.put(story)
+
+        return [cached[story_id] for story_id in story_ids if story_id in cached]
+
+
+story_cache = StoryCache(create_backend("story:", STORY_CACHE_MAX_BYTES, STORY_CACHE_REDIS_URL))
@@ -0,0 +1,20 @@
+from sqlalchemy import update, case
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from models import Counters
+
+
+"""
+Add to counters in the counters table (e.g. stories_complete=1, stories_in_progress=-1)
+One statement, run in the caller's transaction so the counters change with the rows they count
+"""
+async def add_to_counters(session: AsyncSession, **amounts: int):
+    amounts = {name: amount for name, amount in amounts.items() if amount}
+    if not amounts:
+        return
+
+    await session.exec(
+        update(Counters).where(Counters.name.in_(amounts))
+                        .values(value=Counters.value + case(amounts, value=Counters.name))
+                        .execution_options(synchronize_session=False)
+    )
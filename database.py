@@ -1,8 +1,14 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from typing import Annotated
 from sqlmodel import Session, SQLModel
+from sqlmodel.ext.asyncio.session import AsyncSession
 from fastapi import Depends
 from decouple import config
+from contextvars import ContextVar
+from functools import lru_cache
+import time
 
 
 # Database config from env
@@ -12,14 +18,80 @@ DB_USER     = config('DB_USER')
 DB_PASSWORD = config('DB_PASSWORD')
 DB_PORT     = config('DB_PORT')
 
+# Connection pool config from env
+DB_POOL_SIZE        = config('DB_POOL_SIZE', default=5, cast=int)
+DB_MAX_OVERFLOW     = config('DB_MAX_OVERFLOW', default=10, cast=int)
+DB_POOL_PRE_PING    = config('DB_POOL_PRE_PING', default=True, cast=bool)
+DB_POOL_RECYCLE     = config('DB_POOL_RECYCLE', default=1800, cast=int)
+
+# Connections the whole app may open (e.g. the server's max_connections less a margin),
+# shared between the worker processes (WEB_CONCURRENCY, set by gunicorn.conf.py)
+# each worker's pool then gets its share, replacing DB_POOL_SIZE and DB_MAX_OVERFLOW
+DB_MAX_CONNECTIONS  = config('DB_MAX_CONNECTIONS', default=0, cast=int)
+WEB_CONCURRENCY     = config('WEB_CONCURRENCY', default=1, cast=int)
+
+if DB_MAX_CONNECTIONS:
+    # every worker needs a connection, so more workers than that would go over the budget
+    if WEB_CONCURRENCY > DB_MAX_CONNECTIONS:
+        raise ValueError(f"WEB_CONCURRENCY ({WEB_CONCURRENCY}) is more than DB_MAX_CONNECTIONS ({DB_MAX_CONNECTIONS}), "
+                         "use fewer workers or allow more connections")
+    # (never more than the budget, so no overflow)
+    DB_POOL_SIZE = DB_MAX_CONNECTIONS // WEB_CONCURRENCY
+    DB_MAX_OVERFLOW = 0
+
 SQLALCHEMY_DATABASE_URL = f'postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}'
-engine = create_engine(SQLALCHEMY_DATABASE_URL, echo=False)
+
+# Sync engine, only for creating tables and for scripts (made on first use,
+# so the app doesn't import psycopg2 when starting)
+@lru_cache
+def get_engine():
+    return create_engine(SQLALCHEMY_DATABASE_URL, echo=False)
+
+ASYNC_SQLALCHEMY_DATABASE_URL = f'postgresql+asyncpg://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}'
+async_engine = create_async_engine(
+    ASYNC_SQLALCHEMY_DATABASE_URL,
+    echo=False,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_pre_ping=DB_POOL_PRE_PING,
+    pool_recycle=DB_POOL_RECYCLE,
+)
+
+# objects stay usable after commit (no lazy refresh, which async sessions can't do)
+async_session_maker = async_sessionmaker(async_engine, class_=AsyncSession, expire_on_commit=False)
+
+# Statements run (and time spent running them) while handling the current request
+class QueryStats:
+    def __init__(self):
+        self.count = 0
+        self.time = 0.0
+
+query_stats: ContextVar[QueryStats | None] = ContextVar("query_stats", default=None)
+
+@event.listens_for(Engine, "before_cursor_execute")
+def count_query(conn, cursor, statement, parameters, context, executemany):
+    stats = query_stats.get()
+    if stats is not None:
+        stats.count += 1
+        if context is not None:
+            context.query_start = time.perf_counter()
+
+@event.listens_for(Engine, "after_cursor_execute")
+def time_query(conn, cursor, statement, parameters, context, executemany):
+    stats = query_stats.get()
+    if stats is not None and hasattr(context, "query_start"):
+        stats.time += time.perf_counter() - context.query_start
 
 def create_db_and_tables():
-    SQLModel.metadata.create_all(engine)
+    SQLModel.metadata.create_all(get_engine())
 
 def get_session():
-    with Session(engine) as session:
+    with Session(get_engine()) as session:
+        yield session
+
+async def get_async_session():
+    async with async_session_maker() as session:
         yield session
 
-SessionDep = Annotated[Session, Depends(get_session)]
\ No newline at end of file
+SessionDep = Annotated[Session, Depends(get_session)]
+AsyncSessionDep = Annotated[AsyncSession, Depends(get_async_session)]
@@ -0,0 +1,66 @@
+"""initial schema
+
+Creates the tables from database/tables.sql. Every statement is idempotent so
+databases first created with tables.sql (or create_all) can be upgraded too.
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-17
+"""
+from alembic import op
+
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            id              SERIAL PRIMARY KEY,
+            auth_user_id    text,
+            refresh_token   text,
+            locked          boolean DEFAULT false
+        )
+    """)
+
+    op.execute("""
+        CREATE TABLE IF NOT EXISTS story (
+            id              SERIAL PRIMARY KEY,
+            title           text CONSTRAINT title_chk CHECK (length(title) <= 50),
+            date_complete   timestamp,
+            locked          boolean DEFAULT false,
+            last_user_id    integer,
+            random_key      double precision,
+            next_part       integer DEFAULT 1
+        )
+    """)
+    op.execute("ALTER TABLE story ADD COLUMN IF NOT EXISTS random_key double precision")
+    op.execute("ALTER TABLE story ADD COLUMN IF NOT EXISTS next_part integer DEFAULT 1")
+
+    op.execute("""
+        CREATE TABLE IF NOT EXISTS part (
+            id              SERIAL PRIMARY KEY,
+            part_number     integer,
+            part_text       text CONSTRAINT part_text_chk CHECK (length(part_text) <= 1000),
+            story_id        integer REFERENCES story (id),
+            user_id         integer REFERENCES users (id),
+            date_started    timestamp,
+            date_complete   timestamp
+        )
+    """)
+
+    # backfill the columns added after the first release
+    op.execute("UPDATE story SET random_key = random() WHERE date_complete IS NOT NULL AND random_key IS NULL")
+    op.execute("UPDATE story SET next_part = (SELECT count(*) + 1 FROM part WHERE part.story_id = story.id)")
+
+    op.execute("CREATE INDEX IF NOT EXISTS story_random_key_idx ON story (random_key) WHERE date_complete IS NOT NULL")
+    op.execute("CREATE INDEX IF NOT EXISTS story_unlocked_idx ON story (id) WHERE locked = false")
+
+
+def downgrade():
+    op.execute("DROP TABLE IF EXISTS part")
+    op.execute("DROP TABLE IF EXISTS story")
+    op.execute("DROP TABLE IF EXISTS users")
@@ -0,0 +1,60 @@
+"""indexes for the hot query predicates
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-17
+"""
+from alembic import op
+
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # logins used to select then insert, so two at once could add a user twice
+    # merge any duplicates into the user's first row before making auth_user_id unique
+    op.execute("""
+        CREATE TEMPORARY TABLE duplicate_users ON COMMIT DROP AS
+        SELECT id, first_value(id) OVER (PARTITION BY auth_user_id ORDER BY id) AS keep_id,
+               bool_or(locked) OVER (PARTITION BY auth_user_id) AS locked,
+               last_value(refresh_token) OVER (PARTITION BY auth_user_id ORDER BY id
+                                               ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING) AS refresh_token
+        FROM users WHERE auth_user_id IS NOT NULL
+    """)
+    # (the first row keeps the newest refresh token, and stays locked if any of them was)
+    op.execute("""
+        UPDATE users SET locked = duplicate_users.locked, refresh_token = duplicate_users.refresh_token
+        FROM duplicate_users
+        WHERE users.id = duplicate_users.id AND users.id = duplicate_users.keep_id
+          AND EXISTS (SELECT 1 FROM duplicate_users other WHERE other.keep_id = users.id AND other.id <> users.id)
+    """)
+    op.execute("DELETE FROM duplicate_users WHERE id = keep_id")
+    op.execute("UPDATE part SET user_id = duplicate_users.keep_id FROM duplicate_users WHERE part.user_id = duplicate_users.id")
+    op.execute("UPDATE story SET last_user_id = duplicate_users.keep_id FROM duplicate_users WHERE story.last_user_id = duplicate_users.id")
+    op.execute("DELETE FROM users USING duplicate_users WHERE users.id = duplicate_users.id")
+
+    # looking up the logged in user (unique, so logins can upsert on it)
+    op.execute("CREATE UNIQUE INDEX IF NOT EXISTS users_auth_user_id_key ON users (auth_user_id)")
+
+    # a user's open (not complete) part
+    op.execute("CREATE INDEX IF NOT EXISTS part_open_user_idx ON part (user_id) WHERE date_complete IS NULL")
+
+    # a user's stories
+    op.execute("CREATE INDEX IF NOT EXISTS part_user_story_idx ON part (user_id, story_id)")
+
+    # the previous part of a story
+    op.execute("CREATE INDEX IF NOT EXISTS part_story_part_number_idx ON part (story_id, part_number)")
+
+    # completed stories in date order
+    op.execute("CREATE INDEX IF NOT EXISTS story_date_complete_idx ON story (date_complete) WHERE date_complete IS NOT NULL")
+
+
+def downgrade():
+    op.execute("DROP INDEX IF EXISTS story_date_complete_idx")
+    op.execute("DROP INDEX IF EXISTS part_story_part_number_idx")
+    op.execute("DROP INDEX IF EXISTS part_user_story_idx")
+    op.execute("DROP INDEX IF EXISTS part_open_user_idx")
+    op.execute("DROP INDEX IF EXISTS users_auth_user_id_key")
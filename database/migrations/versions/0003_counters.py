@@ -0,0 +1,42 @@
+"""counters for stats
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-17
+"""
+from alembic import op
+
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute("""
+        CREATE TABLE IF NOT EXISTS counters (
+            name            text PRIMARY KEY,
+            value           bigint NOT NULL DEFAULT 0
+        )
+    """)
+    op.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS parts_complete integer NOT NULL DEFAULT 0")
+
+    # start the counters from the rows already there (the only time they are counted)
+    op.execute("""
+        INSERT INTO counters (name, value) VALUES
+            ('stories_complete',    (SELECT count(*) FROM story WHERE date_complete IS NOT NULL)),
+            ('stories_in_progress', (SELECT count(*) FROM story WHERE date_complete IS NULL)),
+            ('parts_complete',      (SELECT count(*) FROM part WHERE date_complete IS NOT NULL))
+        ON CONFLICT (name) DO UPDATE SET value = excluded.value
+    """)
+    op.execute("""
+        UPDATE users SET parts_complete = (
+            SELECT count(*) FROM part WHERE part.user_id = users.id AND part.date_complete IS NOT NULL
+        )
+    """)
+
+
+def downgrade():
+    op.execute("ALTER TABLE users DROP COLUMN IF EXISTS parts_complete")
+    op.execute("DROP TABLE IF EXISTS counters")
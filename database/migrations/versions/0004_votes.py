@@ -0,0 +1,38 @@
+"""story votes and scores
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-17
+"""
+from alembic import op
+
+
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute("ALTER TABLE story ADD COLUMN IF NOT EXISTS votes integer NOT NULL DEFAULT 0")
+    op.execute("ALTER TABLE story ADD COLUMN IF NOT EXISTS score double precision")
+
+    op.execute("""
+        CREATE TABLE IF NOT EXISTS vote (
+            id              SERIAL PRIMARY KEY,
+            user_id         integer NOT NULL REFERENCES users (id),
+            story_id        integer NOT NULL REFERENCES story (id),
+            date_voted      timestamp NOT NULL,
+            CONSTRAINT vote_user_story_key UNIQUE (user_id, story_id)
+        )
+    """)
+
+    # top stories
+    op.execute("CREATE INDEX IF NOT EXISTS story_score_idx ON story (score DESC, id DESC) WHERE score IS NOT NULL")
+
+
+def downgrade():
+    op.execute("DROP INDEX IF EXISTS story_score_idx")
+    op.execute("DROP TABLE IF EXISTS vote")
+    op.execute("ALTER TABLE story DROP COLUMN IF EXISTS score")
+    op.execute("ALTER TABLE story DROP COLUMN IF EXISTS votes")
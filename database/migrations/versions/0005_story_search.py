@@ -0,0 +1,39 @@
+"""full text search of completed stories
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-17
+"""
+from alembic import op
+
+
+revision = "0005"
+down_revision = "0004"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute("""
+        CREATE TABLE IF NOT EXISTS story_search (
+            story_id        integer PRIMARY KEY REFERENCES story (id),
+            document        tsvector NOT NULL
+        )
+    """)
+    op.execute("CREATE INDEX IF NOT EXISTS story_search_document_idx ON story_search USING gin (document)")
+
+    # documents for the stories already complete (as search.py builds them)
+    op.execute("""
+        INSERT INTO story_search (story_id, document)
+        SELECT story.id,
+               setweight(to_tsvector('english', coalesce(story.title, '')), 'A') ||
+               setweight(to_tsvector('english', coalesce(string_agg(part.part_text, ' ' ORDER BY part.part_number), '')), 'B')
+        FROM story JOIN part ON part.story_id = story.id
+        WHERE story.date_complete IS NOT NULL
+        GROUP BY story.id
+        ON CONFLICT (story_id) DO NOTHING
+    """)
+
+
+def downgrade():
+    op.execute("DROP TABLE IF EXISTS story_search")
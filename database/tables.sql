@@ -8,14 +8,21 @@ BEGIN TRANSACTION;
     - auth_user_id:  Google authentication user ID
     - refresh_token: Refresh token from Google
     - locked:        User can no longer login (misuse of website)
+    - parts_complete: How many parts the user has completed
 */
 CREATE TABLE IF NOT EXISTS users (
     id              SERIAL PRIMARY KEY,
     auth_user_id    text,
     refresh_token   text,
-    locked          boolean DEFAULT false
+    locked          boolean DEFAULT false,
+    parts_complete  integer NOT NULL DEFAULT 0
 );
 
+-- existing databases: add the parts_complete counter (backfilled below, once the part table exists)
+ALTER TABLE users ADD COLUMN IF NOT EXISTS parts_complete integer NOT NULL DEFAULT 0;
+
+CREATE UNIQUE INDEX IF NOT EXISTS users_auth_user_id_key ON users (auth_user_id);
+
 
 /*
     Table:           story
@@ -26,15 +33,44 @@ CREATE TABLE IF NOT EXISTS users (
     - date_complete: When the story was completed
     - locked:        Whether the story is locked for editing
     - last_user_id:  ID of the last user who contributed to the story
+    - random_key:    Random value set on completion, used to pick a random story
+    - next_part:     Part number given to the next writer to claim the story
+    - votes:         Number of votes for the story
+    - score:         Score from the votes, favouring recent ones (see voting.py)
 */
 CREATE TABLE IF NOT EXISTS story (
     id              SERIAL PRIMARY KEY,
     title           text CONSTRAINT title_chk CHECK (length(title) <= 50),
     date_complete   timestamp,
     locked          boolean DEFAULT false,
-    last_user_id    integer
+    last_user_id    integer,
+    random_key      double precision,
+    next_part       integer DEFAULT 1,
+    votes           integer NOT NULL DEFAULT 0,
+    score           double precision
 );
 
+-- existing databases: add the random_key column and give completed stories a key
+ALTER TABLE story ADD COLUMN IF NOT EXISTS random_key double precision;
+UPDATE story SET random_key = random() WHERE date_complete IS NOT NULL AND random_key IS NULL;
+
+CREATE INDEX IF NOT EXISTS story_random_key_idx ON story (random_key) WHERE date_complete IS NOT NULL;
+
+-- existing databases: add the next_part counter (backfilled below, once the part table exists)
+ALTER TABLE story ADD COLUMN IF NOT EXISTS next_part integer DEFAULT 1;
+
+-- stories that can be claimed by a writer
+CREATE INDEX IF NOT EXISTS story_unlocked_idx ON story (id) WHERE locked = false;
+
+CREATE INDEX IF NOT EXISTS story_date_complete_idx ON story (date_complete) WHERE date_complete IS NOT NULL;
+
+-- existing databases: add votes and score
+ALTER TABLE story ADD COLUMN IF NOT EXISTS votes integer NOT NULL DEFAULT 0;
+ALTER TABLE story ADD COLUMN IF NOT EXISTS score double precision;
+
+-- top stories
+CREATE INDEX IF NOT EXISTS story_score_idx ON story (score DESC, id DESC) WHERE score IS NOT NULL;
+
 
 /*
     Table:           part
@@ -58,4 +94,76 @@ CREATE TABLE IF NOT EXISTS part (
     date_complete   timestamp
 );
 
+-- a user's open (not complete) part
+CREATE INDEX IF NOT EXISTS part_open_user_idx ON part (user_id) WHERE date_complete IS NULL;
+
+CREATE INDEX IF NOT EXISTS part_user_story_idx ON part (user_id, story_id);
+CREATE INDEX IF NOT EXISTS part_story_part_number_idx ON part (story_id, part_number);
+
+-- existing databases: start each story's counter after its current parts
+UPDATE story SET next_part = (SELECT count(*) + 1 FROM part WHERE part.story_id = story.id);
+UPDATE users SET parts_complete = (SELECT count(*) FROM part WHERE part.user_id = users.id AND part.date_complete IS NOT NULL);
+
+
+/*
+    Table:           vote
+    Purpose:         Stores votes for stories (one per user per story)
+    Columns:
+    - id:            SERIAL PRIMARY KEY
+    - user_id:       Foreign key referencing the users table
+    - story_id:      Foreign key referencing the story table
+    - date_voted:    When the vote was made
+*/
+CREATE TABLE IF NOT EXISTS vote (
+    id              SERIAL PRIMARY KEY,
+    user_id         integer NOT NULL REFERENCES users (id),
+    story_id        integer NOT NULL REFERENCES story (id),
+    date_voted      timestamp NOT NULL,
+    CONSTRAINT vote_user_story_key UNIQUE (user_id, story_id)
+);
+
+
+/*
+    Table:           story_search
+    Purpose:         Full text search document for each completed story (see search.py)
+    Columns:
+    - story_id:      Foreign key referencing the story table
+    - document:      The story's title (weight A) and its parts' text (weight B)
+*/
+CREATE TABLE IF NOT EXISTS story_search (
+    story_id        integer PRIMARY KEY REFERENCES story (id),
+    document        tsvector NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS story_search_document_idx ON story_search USING gin (document);
+
+-- existing databases: documents for the stories already complete
+INSERT INTO story_search (story_id, document)
+SELECT story.id,
+       setweight(to_tsvector('english', coalesce(story.title, '')), 'A') ||
+       setweight(to_tsvector('english', coalesce(string_agg(part.part_text, ' ' ORDER BY part.part_number), '')), 'B')
+FROM story JOIN part ON part.story_id = story.id
+WHERE story.date_complete IS NOT NULL
+GROUP BY story.id
+ON CONFLICT (story_id) DO NOTHING;
+
+
+/*
+    Table:           counters
+    Purpose:         Totals kept up to date as stories and parts are written (for stats)
+    Columns:
+    - name:          stories_complete, stories_in_progress or parts_complete
+    - value:         The total
+*/
+CREATE TABLE IF NOT EXISTS counters (
+    name            text PRIMARY KEY,
+    value           bigint NOT NULL DEFAULT 0
+);
+
+INSERT INTO counters (name, value) VALUES
+    ('stories_complete',    (SELECT count(*) FROM story WHERE date_complete IS NOT NULL)),
+    ('stories_in_progress', (SELECT count(*) FROM story WHERE date_complete IS NULL)),
+    ('parts_complete',      (SELECT count(*) FROM part WHERE date_complete IS NOT NULL))
+ON CONFLICT (name) DO UPDATE SET value = excluded.value;
+
 END TRANSACTION;
\ No newline at end of file
@@ -0,0 +1,26 @@
+# Production server: gunicorn managing uvicorn worker processes
+# gunicorn main:app -c gunicorn.conf.py
+from decouple import config
+import multiprocessing
+import os
+
+
+# Workers are async so one per core keeps every core busy (WEB_CONCURRENCY overrides it)
+# (cores this process may run on, which can be fewer than the machine has)
+cores = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else multiprocessing.cpu_count()
+
+# but no more than DB_MAX_CONNECTIONS, as every worker needs a connection
+# (a WEB_CONCURRENCY over it stops the workers starting, see database.py)
+db_max_connections = config("DB_MAX_CONNECTIONS", default=0, cast=int)
+workers = config("WEB_CONCURRENCY", default=min(cores, db_max_connections) if db_max_connections else cores, cast=int)
+worker_class = "uvicorn_worker.UvicornWorker"
+
+bind = f"0.0.0.0:{config('PORT', default=8000)}"
+
+# restart a worker that stops responding, and give requests time to finish on shutdown
+timeout = config("WORKER_TIMEOUT_IN_SECONDS", default=60, cast=int)
+graceful_timeout = 30
+keepalive = 5
+
+# the workers read this to share DB_MAX_CONNECTIONS between them (see database.py)
+os.environ["WEB_CONCURRENCY"] = str(workers)
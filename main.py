@@ -1,26 +1,57 @@
 from fastapi import FastAPI, Header, HTTPException, Depends, Request, Response, Query
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, ORJSONResponse, StreamingResponse
 from sqlmodel import Session, select
-from sqlalchemy import func, and_, or_
+from sqlmodel.ext.asyncio.session import AsyncSession
+from sqlalchemy import func, and_, or_, tuple_, update
+from sqlalchemy.orm import selectinload
 from sqlalchemy.sql.operators import is_not, is_
 from starlette import status
 from decouple import config
+import asyncio
 import time
 import datetime
+import random
+import base64
+import json
+import hashlib
 
 # pagination
 from fastapi_pagination import add_pagination, paginate
 from fastapi_pagination.links import Page as BasePage
 from fastapi_pagination.customization import UseParamsFields, CustomizedPage
 from fastapi_pagination.utils import disable_installed_extensions_check
+from fastapi_pagination.ext.sqlalchemy import apaginate
 
 from models import *
 from auth import *
-from database import SessionDep, get_session, create_db_and_tables
+from database import SessionDep, AsyncSessionDep, get_session, async_engine, create_db_and_tables, QueryStats, query_stats
+from profanity import load_profanity_checker
+from autosave import autosaver
+from cache import story_cache
+from shared_state import close_backends
+from serialization import FAST_JSON, part_to_dict
+from reaper import reaper, REAPER_ENABLED
+from counters import add_to_counters
+from voting import add_vote, weighted_sampler
+from search import index_story, search_stories
+from archive import export_stories, ADMIN_USER_IDS, EXPORT_FORMATS
+from ratelimit import RateLimitMiddleware, rate_limiter, RATE_LIMIT_ENABLED
+from metrics import (
+    request_seconds, request_db_seconds, request_db_statements, profanity_check_seconds,
+    add_pool_metrics, render_metrics, setup_logging, log_sampled, logger
+)
+
+
+# Logging (through a queue) and connection pool metrics
+log_listener = setup_logging()
+add_pool_metrics(async_engine.pool)
+
 
-# profanity checker
-# https://pypi.org/project/safetext/
-from safetext import SafeText
+# Rate limiting of the part routes
+# (added before CORS so it runs inside it, and the frontend can read its 429s)
+if RATE_LIMIT_ENABLED:
+    app.add_middleware(RateLimitMiddleware, limiter=rate_limiter)
 
 
 # CORS middleware
@@ -45,244 +76,564 @@ Page = CustomizedPage[
         size=Query(PAGE_SIZE, ge=0),
     ),
 ]
-add_pagination(app)
+
+
+# Startup config from env
+# (warming up in the background lets the first requests in as soon as the app is imported)
+WARM_UP_IN_BACKGROUND = config("WARM_UP_IN_BACKGROUND", default=True, cast=bool)
+CREATE_TABLES_ON_STARTUP = config("CREATE_TABLES_ON_STARTUP", default=False, cast=bool)
+
+"""
+Do the slow one time setup before it is first needed, rather than in the request needing it
+"""
+async def warm_up():
+    try:
+        # load the profanity word list (in a thread, it is slow and would hold up requests)
+        await load_profanity_checker()
+        get_oauth()
+        get_http_client()
+
+        # open a database connection for the pool
+        async with async_engine.connect():
+            pass
+    except Exception:
+        logger.exception("Warm up failed")
 
 
 @app.on_event('startup')
-def on_startup():
-    create_db_and_tables()
+async def on_startup():
+    # schema changes normally come from the migrations (alembic upgrade head)
+    if CREATE_TABLES_ON_STARTUP:
+        await asyncio.to_thread(create_db_and_tables)
+
+    if WARM_UP_IN_BACKGROUND:
+        app.state.warm_up_task = asyncio.create_task(warm_up())
+    else:
+        await warm_up()
+
+    # take back abandoned parts in the background
+    if REAPER_ENABLED:
+        reaper.start()
+
 
+@app.on_event('shutdown')
+async def on_shutdown():
+    await reaper.stop()
+    await autosaver.flush_all()
+    await close_http_client()
+    await close_backends()
+    await async_engine.dispose()
+    log_listener.stop()
+
+
+# Record the time taken, and database statements run, for each api request
+# (the statement count is also returned in an X-Query-Count header when QUERY_COUNT_HEADER is set)
+QUERY_COUNT_HEADER = config("QUERY_COUNT_HEADER", default=False, cast=bool)
 
-# # Logging time taken for each api request
 @app.middleware("http")
-async def log_response_time(request: Request, call_next):
-    start_time = time.time()
+async def record_request(request: Request, call_next):
+    stats = QueryStats()
+    query_stats.set(stats)
+    start_time = time.perf_counter()
     response = await call_next(request)
-    process_time = time.time() - start_time
-    print(f"Request: {request.url.path} completed in {process_time:.4f} seconds")
-    return response 
+    process_time = time.perf_counter() - start_time
+
+    # label by route template (e.g. /save_part/{part_id}) rather than the url
+    route = request.scope.get("route")
+    route_path = route.path if route else "unmatched"
+    request_seconds.observe(process_time, method=request.method, route=route_path, status=response.status_code)
+    request_db_seconds.observe(stats.time, route=route_path)
+    request_db_statements.inc(stats.count, route=route_path)
+    log_sampled("Request: %s completed in %.4f seconds (%d queries, %.4f seconds in database)",
+                request.url.path, process_time, stats.count, stats.time)
+
+    if QUERY_COUNT_HEADER:
+        response.headers["X-Query-Count"] = str(stats.count)
+    return response
+
+
+# GET - metrics in Prometheus text format
+@app.get('/metrics', response_class=PlainTextResponse)
+def get_metrics():
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
 
 
 app.include_router(router)
 
 
+"""
+Set the (possibly refreshed) access token in the response cookie
+"""
+def set_access_token_cookie(response: Response, access_token: str):
+    response.set_cookie(
+        key="access_token",
+        value=access_token,
+        httponly=True,
+        domain=config("COOKIE_DOMAIN"),
+        path=config("COOKIE_PATH"),
+        secure=True,  # Ensure you're using HTTPS
+        samesite=config("COOKIE_SAMESITE"),  # Set the SameSite attribute to None
+    )
+
+
 @app.get("/user")
-def get_user(session: SessionDep, current_user: dict = Depends(get_current_user)):
+async def get_user(current_user: dict = Depends(get_current_user)):
+
+    user = current_user['user']
+
+    return {"user": {"user_id": current_user['user_id'], "user_name": current_user['user_name']}, "user_id": user.id}
+
 
-    auth_user_id = current_user['user_id']
-    user = session.exec(select(Users).where(Users.auth_user_id == auth_user_id)).first()
+"""
+Pick a random completed story, returning its (id, date_complete)
+Seeks the random_key index from a random point (wrapping round to the start)
+instead of sorting every completed story with ORDER BY random()
+"""
+async def select_random_complete_story(session: AsyncSession):
+    complete = is_not(Story.date_complete, None)
+    key = random.random()
 
-    return {"user": current_user, "user_id": user.id}
+    query = select(Story.id, Story.date_complete).order_by(Story.random_key).limit(1)
+    story = (await session.exec(query.where(complete, Story.random_key >= key))).first()
+    if not story:
+        story = (await session.exec(query.where(complete, is_not(Story.random_key, None)))).first()
+
+    return story
+
+
+"""
+HTTP caching
+A completed story never changes, so its id and date_complete identify its content
+"""
+STORY_MAX_AGE_IN_SECONDS = config("STORY_MAX_AGE_IN_SECONDS", default=86400, cast=int)
+
+def story_etag(story_id: int, date_complete: datetime):
+    return f'"{story_id}-{date_complete:%Y%m%d%H%M%S%f}"'
+
+def etag_matches(request: Request, etag: str):
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags
+
+"""
+Respond with the story's cached JSON, or 304 Not Modified if the client has it already
+"""
+async def story_response(session: AsyncSession, request: Request, story_id: int, date_complete: datetime, cache_control: str):
+    headers = {"ETag": story_etag(story_id, date_complete), "Cache-Control": cache_control}
+    if etag_matches(request, headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+
+    # the story's JSON comes straight from the completed story cache
+    story_json = (await story_cache.get_many(session, [story_id]))[0]
+    return Response(content=story_json, media_type="application/json", headers=headers)
 
 
 # GET - random completed story
 @app.get('/random_complete_story/', response_model=StoryPublicWithParts)
-def get_random_story(session: SessionDep):
-    story = session.exec(select(Story).where(is_not(Story.date_complete, None)).order_by(func.random())).first()
+async def get_random_story(session: AsyncSessionDep, request: Request, weighted: bool = False):
+    if weighted:
+        # stories with more votes are more likely to be picked
+        story_id = await weighted_sampler.sample()
+        story = None
+        if story_id:
+            story = (await session.exec(select(Story.id, Story.date_complete).where(Story.id == story_id))).first()
+    else:
+        story = await select_random_complete_story(session)
 
     if not story:
         raise HTTPException(status_code=204, detail='No stories found')
-    return story
+
+    # a different story each time, so only ever used after revalidating
+    return await story_response(session, request, story.id, story.date_complete, "no-cache")
+
+
+# GET - a completed story (e.g. for shared links, can be cached by browsers and CDNs)
+@app.get('/stories/{story_id}', response_model=StoryPublicWithParts)
+async def get_story(story_id: int, session: AsyncSessionDep, request: Request):
+    date_complete = (await session.exec(select(Story.date_complete).where(Story.id == story_id))).first()
+
+    if not date_complete:
+        raise HTTPException(status_code=404, detail='Story not found')
+
+    return await story_response(session, request, story_id, date_complete, f"public, max-age={STORY_MAX_AGE_IN_SECONDS}")
+
+
+# GET - how many stories and parts have been written
+@app.get('/stats', response_model=StatsPublic)
+async def get_stats(session: AsyncSessionDep, current_user: dict | None = Depends(get_optional_current_user)):
+    stats = dict((await session.exec(select(Counters.name, Counters.value))).all())
+
+    # and how many parts the logged in user has written
+    if current_user:
+        stats["user_parts_complete"] = (await session.exec(select(Users.parts_complete).where(Users.id == current_user['user'].id))).first()
+
+    return stats
 
 
 # GET - a random available part
 @app.get('/get_part/', response_model=PartPublicWithStory)
-def get_part(
-        session: SessionDep, 
+async def get_part(
+        session: AsyncSessionDep, 
         current_user: dict = Depends(get_current_user_with_refresh), 
         response: Response = None
     ):
 
-    # get the user id from the database using authenticated user_id
-    user_id = current_user['user_id']
-    user = session.exec(select(Users).where(Users.auth_user_id == user_id)).first()
+    # the user's database row (resolved from the authenticated user_id)
+    user = current_user['user']
 
     # if the user already has a part assigned (not complete) return this
-    part = session.exec(select(Part).where(and_(Part.user_id == user.id, is_(Part.date_complete, None)))).first()
+    part = (await session.exec(
+                select(Part).options(selectinload(Part.story))
+                            .where(and_(Part.user_id == user.id, is_(Part.date_complete, None)))
+            )).first()
 
     if not part:
         # no part assigned so create one
-        # try to get a random story that is not locked
-        # (and you were not the last person to write a part for it)
-        story_id = session.exec(select(Story.id).where(and_(is_(Story.locked, False)), Story.last_user_id != user.id).order_by(func.random())).first()
-        if story_id:
-            part_rows = session.exec(select(func.count(Part.story_id)).where(Part.story_id == story_id)).first()
-            new_part_number = int(part_rows) + 1
-            part = Part(part_number=new_part_number, part_text="", user_id=user.id, story_id=story_id, date_started=datetime.now())
+        # claim an unlocked story (that you were not the last person to write a part for)
+        # rows locked by another writer's claim are skipped rather than waited on,
+        # so two writers can never be given the same story
+        # (locked = false rather than IS false, which the partial story_unlocked_idx can't be used for)
+        story = (await session.exec(
+                    select(Story).where(and_(Story.locked == False, Story.last_user_id != user.id))
+                                 .order_by(Story.id)
+                                 .limit(1)
+                                 .with_for_update(skip_locked=True)
+                )).first()
+        if story:
+            part = Part(part_number=story.next_part, part_text="", user_id=user.id, story_id=story.id, date_started=datetime.now())
+            part.story = story
             session.add(part)
 
-            story = session.get(Story, story_id)
-            story.locked = True
+            story.sqlmodel_update({"locked": True, "next_part": story.next_part + 1})
             session.add(story)
 
-            session.commit()
+            await session.commit()
 
-            print("Created new part for existing story and assigned to user")
+            logger.info("Created new part for existing story and assigned to user")
         else:
             # All stories have 5 parts (or you wrote the last part) so create a new story and a part
-            story = Story(title="", locked=True)
+            story = Story(title="", locked=True, next_part=2)
             session.add(story)
-            session.commit()
+            await session.flush()
 
             part = Part(part_number=1, part_text="", user_id=user.id, story_id=story.id, date_started=datetime.now())
+            part.story = story
             session.add(part)
-            session.commit()
+            await add_to_counters(session, stories_in_progress=1)
+            await session.commit()
+
+            logger.info("Created new story and part and assigned to user")
 
-            print("Created new story and part and assigned to user")
+    # the part and story were just loaded, so skip validating them again
+    if FAST_JSON:
+        response = ORJSONResponse(part_to_dict(part, with_story=True))
 
     # Set new access token in cookie
-    access_token = current_user['access_token']
-    response.set_cookie(
-        key="access_token",
-        value=access_token,
-        httponly=True,
-        domain=config("COOKIE_DOMAIN"),
-        path=config("COOKIE_PATH"),
-        secure=True,  # Ensure you're using HTTPS
-        samesite=config("COOKIE_SAMESITE"),  # Set the SameSite attribute to None
-    )
+    set_access_token_cookie(response, current_user['access_token'])
 
-    return part
+    return response if FAST_JSON else part
 
 
 # GET - end of previous part
 @app.get('/get_previous_part/', response_model=PartPublic)
-def get_previous_part(session: SessionDep, current_user: dict = Depends(get_current_user)):
+async def get_previous_part(session: AsyncSessionDep, current_user: dict = Depends(get_current_user)):
 
     # aside: we could use part_number and story_id as parameters then just use the last query
     # but this opens up people being able to see any story through urls
 
     # get the part assigned to the user 
-    user_id = current_user['user_id']
-    user = session.exec(select(Users).where(Users.auth_user_id == user_id)).first()
-    part = session.exec(select(Part).where(and_(Part.user_id == user.id, is_(Part.date_complete, None)))).first()
+    user = current_user['user']
+    part = (await session.exec(select(Part).where(and_(Part.user_id == user.id, is_(Part.date_complete, None))))).first()
 
     # get the previous part
     prev_part_number = part.part_number - 1
     story_id = part.story_id
-    prev_part = session.exec(select(Part).where(and_(Part.story_id == story_id, Part.part_number == prev_part_number))).first()
+    prev_part = (await session.exec(select(Part).where(and_(Part.story_id == story_id, Part.part_number == prev_part_number)))).first()
+
+    if FAST_JSON and prev_part is not None:
+        return ORJSONResponse(part_to_dict(prev_part))
 
     return prev_part
 
 
 # PATCH - submit a completed part (pending moderation)
 @app.patch("/complete_part/{part_id}")
-def complete_part(part_id: int, part: PartUpdate, session: SessionDep, current_user: dict = Depends(get_current_user)):
+async def complete_part(part_id: int, part: PartUpdate, session: AsyncSessionDep, current_user: dict = Depends(get_current_user)):
 
     date_complete = datetime.now()
     
     # get part from request
     part_data = part.model_dump(exclude_unset=True)
     part_text = part_data.get("part_text")
+    story_title = part_data.get("story_title")
+    user = current_user['user']
 
-    # get part from database
-    db_part = session.get(Part, part_id)
-
-    # profanity check for part_text
-    st = SafeText(language='en')
-    text_results = st.check_profanity(text=part_text)
+    # profanity check for part_text and the story title (only used for the first part)
+    checker = await load_profanity_checker()
+    with profanity_check_seconds.time():
+        title_results, text_results = checker.check_part(part_text, story_title)
     if text_results:
         return {"results": text_results, "status": 400}
-    db_part.sqlmodel_update({"part_text": part_text, "date_complete": date_complete})
 
-    # update the story if necessary
-    title_results = []
-    db_story = session.get(Story, db_part.story_id)
-
-    if db_part.part_number == 1:
-        story_title = part_data.get("story_title")
+    # complete the part, only if it is the user's and not already complete
+    # (the row stays locked until commit, so a second submission waits then finds nothing to update)
+    completed = (await session.exec(
+                    update(Part).where(Part.id == part_id, Part.user_id == user.id, is_(Part.date_complete, None))
+                                .values(part_text=part_text, date_complete=date_complete)
+                                .returning(Part.story_id, Part.part_number)
+                                .execution_options(synchronize_session=False)
+                )).first()
+    if not completed:
+        raise HTTPException(status_code=404, detail='Part not found')
+    story_id, part_number = completed
+
+    # update the story
+    # the last user to write a part for this story
+    story_values = {"last_user_id": user.id}
 
+    if part_number == 1:
         # profanity check on story title
-        title_results = st.check_profanity(text=story_title)
         if title_results:
+            await session.rollback()
             return {"results": title_results, "status": 400}
-        db_story.sqlmodel_update({"title": story_title})
+        story_values["title"] = story_title
 
-    if db_part.part_number == 5:
-        db_story.sqlmodel_update({"date_complete": date_complete})
+    if part_number == 5:
+        story_values.update({"date_complete": date_complete, "random_key": random.random()})
+    else:
+        # unlock the story for someone else to write the next part
+        story_values["locked"] = False
 
-    # unlock the story for someone else to write the next part
-    if db_part.part_number != 5:
-        db_story.sqlmodel_update({"locked": False})
+    await session.exec(update(Story).where(Story.id == story_id).values(**story_values).execution_options(synchronize_session=False))
 
-    # the last user to write a part for this story
-    db_story.sqlmodel_update({"last_user_id": db_part.user_id})
+    # the user's count of parts
+    await session.exec(update(Users).where(Users.id == user.id).values(parts_complete=Users.parts_complete + 1))
 
-    if not title_results:
-        session.add(db_part)
-        session.add(db_story)
-        session.commit()
-    
-    return {"results": title_results, "status": 200}
+    # the story is complete so it can be found by searching
+    if part_number == 5:
+        await index_story(session, story_id)
+
+    # update the stats last, every completion writes the same counters rows
+    # so their lock is held for as little of the transaction as possible
+    story_complete = 1 if part_number == 5 else 0
+    await add_to_counters(session, parts_complete=1, stories_complete=story_complete, stories_in_progress=-story_complete)
+
+    await session.commit()
+    autosaver.discard(user.id, part_id)
+
+    # the story is complete so it can be cached
+    if part_number == 5:
+        await story_cache.get_many(session, [story_id])
+
+    return {"results": [], "status": 200}
 
 
 # PATCH - save a part so you can come back to it (not complete)
 @app.patch("/save_part/{part_id}")
-def save_part(part_id: int, part: PartUpdate, session: SessionDep, current_user: dict = Depends(get_current_user)):
+async def save_part(part_id: int, part: PartUpdate, current_user: dict = Depends(get_current_user)):
 
     # get the data from the request
     part_data = part.model_dump(exclude_unset=True)
     part_text = part_data.get("part_text")
     story_title = part_data.get("story_title")
+    user = current_user['user']
 
-    # profanity check
-    st = SafeText(language='en')
-    title_results = []
-    if story_title:
-        title_results = st.check_profanity(text=story_title)
-    text_results = st.check_profanity(text=part_text)
-    results = title_results + text_results
+    # profanity check (only what changed since the last save)
+    results = await autosaver.check_profanity(user.id, part_id, part_text, story_title)
 
     if results:
         status = 400 # Bad Request
     else: 
-        # get the part and story we are updating from the database
-        # and update
-
-        db_part = session.get(Part, part_id)
-        db_story = session.get(Story, db_part.story_id)
-
-        db_part.sqlmodel_update({"part_text": part_text})
-        session.add(db_part)
-        
-        if story_title is not None:
-            db_story.sqlmodel_update({"title": story_title})
-            session.add(db_story)
-        
-        session.commit()
+        # update the part and story on the database
+        # (unchanged saves are skipped, quick successive saves are combined)
+        await autosaver.save(user.id, part_id, part_text, story_title)
         status = 200
 
     return {"results": results, "status": status}
 
+"""
+Query for the completed stories a user wrote a part for, oldest first
+"""
+def my_stories_query(user_id: int, *columns):
+    user_story_ids = select(Part.story_id).where(Part.user_id == user_id)
+    query = select(*columns) if columns else select(Story).options(selectinload(Story.parts))
+    return (
+        query.where(and_(is_not(Story.date_complete, None), Story.id.in_(user_story_ids)))
+             .order_by(Story.date_complete, Story.id)
+    )
+
+
+"""
+ETag for a page of a user's stories
+Changes when the user has another completed story (the set only ever grows)
+"""
+async def my_stories_etag(session: AsyncSession, request: Request, user_id: int):
+    count, latest = (await session.exec(my_stories_query(user_id, func.count(Story.id), func.max(Story.date_complete)).order_by(None))).one()
+    version = hashlib.sha1(f"{user_id}|{count}|{latest}|{request.url.query}".encode()).hexdigest()
+    return f'"{version}"'
+
+
+"""
+Cursors for keyset pagination hold the sort key of the last story on the page
+e.g. (date_complete, id) for a user's stories
+"""
+def encode_cursor(*values):
+    return base64.urlsafe_b64encode("|".join(str(value) for value in values).encode()).decode()
+
+def decode_cursor(cursor: str, *parsers):
+    try:
+        values = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        if len(values) != len(parsers):
+            raise ValueError(cursor)
+        return tuple(parse(value) for parse, value in zip(parsers, values))
+    except ValueError:
+        raise HTTPException(status_code=400, detail='Invalid cursor')
+
+
+"""
+A StoryCursorPage response built from the stories' cached JSON
+"""
+async def story_page_response(session: AsyncSession, story_ids: list[int], next_cursor: str | None, headers: dict):
+    items = await story_cache.get_many(session, story_ids)
+    content = b'{"items":[' + b','.join(items) + b'],"next_cursor":' + json.dumps(next_cursor).encode() + b'}'
+    return Response(content=content, media_type="application/json", headers=headers)
+
+
 # GET - a user's stories
 @app.get('/my_stories/')
-def get_my_stories(
-        session: SessionDep, 
+async def get_my_stories(
+        session: AsyncSessionDep, 
+        request: Request,
         current_user: dict = Depends(get_current_user_with_refresh), 
         response: Response = None
     ) -> Page[StoryPublicWithParts]:
 
-    # get distinct story_ids from parts by the logged in user
-    user_id = current_user['user_id']
-    user = session.exec(select(Users).where(Users.auth_user_id == user_id)).first()
-    story_ids = session.exec(select(Part.story_id).distinct().where(Part.user_id == user.id)).all()
+    # completed stories with parts by the logged in user (paginated in the database)
+    user = current_user['user']
 
-    # now get the stories 
-    stories = session.exec(
-                select(Story).where(and_(is_not(Story.date_complete, None), Story.id.in_(story_ids)))
-                             .order_by(Story.date_complete)
-            ).all()
+    # nothing to send if the client already has this page
+    headers = {"ETag": await my_stories_etag(session, request, user.id), "Cache-Control": "private, no-cache"}
+    if etag_matches(request, headers["ETag"]):
+        not_modified = Response(status_code=304, headers=headers)
+        set_access_token_cookie(not_modified, current_user['access_token'])
+        return not_modified
+
+    page = await apaginate(session, my_stories_query(user.id))
+
+    # the page is validated as it is built, so send it as it is
+    if FAST_JSON:
+        response = ORJSONResponse(page.model_dump(), headers=headers)
+    else:
+        response.headers.update(headers)
 
     # Set new access token in cookie
-    access_token = current_user['access_token']
-    response.set_cookie(
-        key="access_token",
-        value=access_token,
-        httponly=True,
-        domain=config("COOKIE_DOMAIN"),
-        path=config("COOKIE_PATH"),
-        secure=True,  # Ensure you're using HTTPS
-        samesite=config("COOKIE_SAMESITE"),  # Set the SameSite attribute to None
-    )
+    set_access_token_cookie(response, current_user['access_token'])
+
+    return response if FAST_JSON else page
 
-    return paginate(stories)
\ No newline at end of file
+
+# GET - a user's stories (keyset pagination, pass next_cursor back to get the next page)
+@app.get('/my_stories/cursor/', response_model=StoryCursorPage)
+async def get_my_stories_cursor(
+        session: AsyncSessionDep, 
+        request: Request,
+        current_user: dict = Depends(get_current_user_with_refresh), 
+        cursor: str | None = None,
+        size: int = Query(int(PAGE_SIZE), ge=1, le=100)
+    ):
+
+    user = current_user['user']
+
+    # nothing to send if the client already has this page
+    headers = {"ETag": await my_stories_etag(session, request, user.id), "Cache-Control": "private, no-cache"}
+    if etag_matches(request, headers["ETag"]):
+        not_modified = Response(status_code=304, headers=headers)
+        set_access_token_cookie(not_modified, current_user['access_token'])
+        return not_modified
+
+    query = my_stories_query(user.id, Story.id, Story.date_complete)
+    if cursor:
+        query = query.where(tuple_(Story.date_complete, Story.id) > tuple_(*decode_cursor(cursor, datetime.fromisoformat, int)))
+
+    # get one extra story to know if there is another page
+    stories = (await session.exec(query.limit(size + 1))).all()
+    next_cursor = None
+    if len(stories) > size:
+        next_cursor = encode_cursor(stories[size - 1].date_complete, stories[size - 1].id)
+
+    # the stories' JSON comes from the completed story cache
+    response = await story_page_response(session, [story.id for story in stories[:size]], next_cursor, headers)
+
+    # Set new access token in cookie
+    set_access_token_cookie(response, current_user['access_token'])
+
+    return response
+
+
+# GET - the highest scoring stories (votes, recent votes counting for more)
+# (keyset pagination, pass next_cursor back to get the next page)
+@app.get('/top_stories/', response_model=StoryCursorPage)
+async def get_top_stories(
+        session: AsyncSessionDep, 
+        cursor: str | None = None,
+        size: int = Query(int(PAGE_SIZE), ge=1, le=100)
+    ):
+
+    query = select(Story.id, Story.score).where(is_not(Story.score, None)).order_by(Story.score.desc(), Story.id.desc())
+    if cursor:
+        query = query.where(tuple_(Story.score, Story.id) < tuple_(*decode_cursor(cursor, float, int)))
+
+    # get one extra story to know if there is another page
+    stories = (await session.exec(query.limit(size + 1))).all()
+    next_cursor = None
+    if len(stories) > size:
+        next_cursor = encode_cursor(stories[size - 1].score, stories[size - 1].id)
+
+    return await story_page_response(session, [story.id for story in stories[:size]], next_cursor, {"Cache-Control": "public, max-age=60"})
+
+
+# GET - search completed stories' titles and text (best matches first, pass next_cursor back to get the next page)
+@app.get('/search', response_model=StoryCursorPage)
+async def search(
+        session: AsyncSessionDep, 
+        q: str = Query(min_length=1, max_length=200),
+        cursor: str | None = None,
+        size: int = Query(int(PAGE_SIZE), ge=1, le=100)
+    ):
+
+    after = decode_cursor(cursor, float, int) if cursor else None
+
+    # get one extra story to know if there is another page
+    stories = await search_stories(session, q, size + 1, after)
+    next_cursor = None
+    if len(stories) > size:
+        next_cursor = encode_cursor(stories[size - 1].rank, stories[size - 1].story_id)
+
+    return await story_page_response(session, [story.story_id for story in stories[:size]], next_cursor, {"Cache-Control": "public, max-age=60"})
+
+
+# POST - vote for a completed story (one vote per user)
+@app.post('/stories/{story_id}/vote', response_model=VotePublic)
+async def vote_for_story(story_id: int, session: AsyncSessionDep, current_user: dict = Depends(get_current_user)):
+    votes = await add_vote(session, current_user['user'].id, story_id)
+
+    if votes is None:
+        raise HTTPException(status_code=409, detail='Already voted or story not complete')
+    return {"story_id": story_id, "votes": votes}
+
+
+# GET - all completed stories with their parts, streamed as NDJSON (a story per line) or CSV (a part per row)
+@app.get('/admin/export')
+async def export(format: str = Query("ndjson", pattern="^(ndjson|csv)$"), current_user: dict = Depends(get_current_user)):
+    if current_user['user_id'] not in ADMIN_USER_IDS:
+        raise HTTPException(status_code=403, detail='Not allowed')
+
+    filename = f"stories-{datetime.now():%Y%m%d}.{format}"
+    return StreamingResponse(export_stories(format), media_type=EXPORT_FORMATS[format],
+                             headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+
+# (after the routes, so those returning a Page are set up for it without waiting for startup)
+add_pagination(app)
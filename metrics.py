@@ -0,0 +1,168 @@
+from contextlib import contextmanager
+from decouple import config
+import logging
+import logging.handlers
+import queue
+import random
+import threading
+import time
+
+
+# Share of request log lines written (1 logs every request, 0.1 one in ten)
+LOG_SAMPLE_RATE = config("LOG_SAMPLE_RATE", default=1.0, cast=float)
+LOG_LEVEL = config("LOG_LEVEL", default="INFO")
+
+logger = logging.getLogger("partofthestory")
+
+
+"""
+Metrics kept in memory and rendered in Prometheus text format at /metrics
+Each metric has a fixed set of label names, values are keyed by the label values
+"""
+class Metric:
+    type = ""
+
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values = {}
+        self.lock = threading.Lock()
+        registry.append(self)
+
+    def label_values(self, labels: dict):
+        return tuple(str(labels.get(label, "")) for label in self.labels)
+
+    def format_labels(self, values: tuple, extra: str = ""):
+        pairs = [f'{label}="{value}"' for label, value in zip(self.labels, values)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        with self.lock:
+            for values, value in sorted(self.values.items()):
+                lines += self.render_value(values, value)
+        return lines
+
+    def render_value(self, values: tuple, value):
+        return [f"{self.name}{self.format_labels(values)} {value}"]
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self.label_values(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def __init__(self, name: str, help: str, labels: tuple = (), function=None):
+        super().__init__(name, help, labels)
+        # read the value when rendered (only for gauges without labels)
+        self.function = function
+
+    def set(self, value: float, **labels):
+        with self.lock:
+            self.values[self.label_values(labels)] = value
+
+    def render(self):
+        if self.function is not None:
+            self.set(self.function())
+        return super().render()
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)):
+        super().__init__(name, help, labels)
+        self.buckets = buckets
+
+    def observe(self, value: float, **labels):
+        key = self.label_values(labels)
+        with self.lock:
+            counts = self.values.get(key)
+            if counts is None:
+                # a count per bucket, then the sum and the total count
+                counts = self.values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bucket in enumerate(self.buckets):
+                if value <= bucket:
+                    counts[i] += 1
+            counts[-2] += value
+            counts[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render_value(self, values: tuple, counts: list):
+        lines = []
+        for bucket, count in zip(self.buckets, counts):
+            bucket_labels = self.format_labels(values, f'le="{bucket}"')
+            lines.append(f"{self.name}_bucket{bucket_labels} {count}")
+        bucket_labels = self.format_labels(values, 'le="+Inf"')
+        lines.append(f"{self.name}_bucket{bucket_labels} {counts[-1]}")
+        lines.append(f"{self.name}_sum{self.format_labels(values)} {counts[-2]}")
+        lines.append(f"{self.name}_count{self.format_labels(values)} {counts[-1]}")
+        return lines
+
+
+registry: list[Metric] = []
+
+def render_metrics():
+    lines = []
+    for metric in registry:
+        lines += metric.render()
+    return "\n".join(lines) + "\n"
+
+
+# Requests
+request_seconds = Histogram("http_request_duration_seconds", "Time taken to handle a request", ("method", "route", "status"))
+request_db_seconds = Histogram("http_request_db_seconds", "Time spent running database statements per request", ("route",))
+request_db_statements = Counter("http_request_db_statements_total", "Database statements run", ("route",))
+
+# Outbound calls and checks
+google_refresh_seconds = Histogram("google_token_refresh_seconds", "Time taken to refresh an access token with Google")
+profanity_check_seconds = Histogram("profanity_check_seconds", "Time taken to check text for profanity", buckets=(.0001, .0005, .001, .005, .01, .05, .1))
+
+
+"""
+Gauges for how much of a connection pool is in use
+"""
+def add_pool_metrics(pool):
+    Gauge("db_pool_size", "Connections kept open in the pool", function=pool.size)
+    Gauge("db_pool_checked_out", "Connections currently in use", function=pool.checkedout)
+    Gauge("db_pool_overflow", "Connections open beyond the pool size", function=pool.overflow)
+
+
+"""
+Send log records through a queue so writing them never blocks a request
+Returns the listener writing the records (stop it on shutdown)
+"""
+def setup_logging():
+    log_queue = queue.SimpleQueue()
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    listener = logging.handlers.QueueListener(log_queue, handler)
+
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    logger.setLevel(LOG_LEVEL)
+    logger.propagate = False
+
+    listener.start()
+    return listener
+
+
+def log_sampled(message: str, *args):
+    if LOG_SAMPLE_RATE >= 1 or random.random() < LOG_SAMPLE_RATE:
+        logger.info(message, *args)
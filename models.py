@@ -1,4 +1,6 @@
 from sqlmodel import Field, SQLModel, Relationship
+from sqlalchemy import DDL, Column, Index, UniqueConstraint, event, text
+from sqlalchemy.dialects.postgresql import TSVECTOR
 from datetime import datetime
 from pydantic import BaseModel
 
@@ -10,9 +12,16 @@ class UsersBase(SQLModel):
     locked:             bool = Field(default=False)
 
 class Users(UsersBase, table=True):
+    __table_args__ = (
+        Index("users_auth_user_id_key", "auth_user_id", unique=True),
+    )
+
     id: int | None = Field(default=None, primary_key=True)
 
-    parts: list["Part"] = Relationship(back_populates="user")
+    # how many parts the user has completed
+    parts_complete: int = Field(default=0)
+
+    parts: list["Part"] = Relationship(back_populates="user", sa_relationship_kwargs={"lazy": "raise"})
 
 
 # Story
@@ -23,9 +32,26 @@ class StoryBase(SQLModel):
     last_user_id:   int | None = Field(default=None)
 
 class Story(StoryBase, table=True):
+    __table_args__ = (
+        Index("story_random_key_idx", "random_key", postgresql_where=text("date_complete IS NOT NULL")),
+        Index("story_unlocked_idx", "id", postgresql_where=text("locked = false")),
+        Index("story_date_complete_idx", "date_complete", postgresql_where=text("date_complete IS NOT NULL")),
+        Index("story_score_idx", text("score DESC"), text("id DESC"), postgresql_where=text("score IS NOT NULL")),
+    )
+
     id:    int = Field(default=None, primary_key=True)
+
+    # set when the story is completed, used to pick a random story with an index seek
+    random_key: float | None = Field(default=None)
+
+    # part number given to the next writer to claim the story
+    next_part:  int = Field(default=1)
+
+    # votes for the story, and a score from them favouring recent votes (see voting.py)
+    votes:      int = Field(default=0)
+    score:      float | None = Field(default=None)
     
-    parts: list["Part"] = Relationship(back_populates="story")
+    parts: list["Part"] = Relationship(back_populates="story", sa_relationship_kwargs={"lazy": "raise", "order_by": "Part.part_number"})
 
 class StoryPublic(StoryBase):
     id: int
@@ -40,10 +66,16 @@ class PartBase(SQLModel):
     date_complete:  datetime | None
 
 class Part(PartBase, table=True):
+    __table_args__ = (
+        Index("part_open_user_idx", "user_id", postgresql_where=text("date_complete IS NULL")),
+        Index("part_user_story_idx", "user_id", "story_id"),
+        Index("part_story_part_number_idx", "story_id", "part_number"),
+    )
+
     id:    int = Field(default=None, primary_key=True)
     
-    story: Story | None = Relationship(back_populates="parts")
-    user:  Users | None = Relationship(back_populates="parts")
+    story: Story | None = Relationship(back_populates="parts", sa_relationship_kwargs={"lazy": "raise"})
+    user:  Users | None = Relationship(back_populates="parts", sa_relationship_kwargs={"lazy": "raise"})
 
 class PartPublic(PartBase):
     id: int
@@ -53,12 +85,67 @@ class PartUpdate(SQLModel):
     story_title:    str | None
 
 # Get relationships in return data
+# (relationships are never lazy loaded, queries returning these must eager load them
+#  e.g. selectinload(Story.parts) for StoryPublicWithParts, selectinload(Part.story) for PartPublicWithStory)
 class PartPublicWithStory(PartPublic):
     story: StoryPublic | None = None
 
 class StoryPublicWithParts(StoryPublic):
     parts: list[PartPublic] = []
 
+# Vote (one per user per story)
+class Vote(SQLModel, table=True):
+    __table_args__ = (
+        UniqueConstraint("user_id", "story_id", name="vote_user_story_key"),
+    )
+
+    id:         int | None = Field(default=None, primary_key=True)
+    user_id:    int = Field(foreign_key="users.id")
+    story_id:   int = Field(foreign_key="story.id")
+    date_voted: datetime
+
+class VotePublic(BaseModel):
+    story_id:   int
+    votes:      int
+
+
+# Counters
+# kept up to date in the same transaction as the rows they count, so stats
+# don't need to count rows (names: stories_complete, stories_in_progress, parts_complete)
+class Counters(SQLModel, table=True):
+    name:   str = Field(primary_key=True)
+    value:  int = Field(default=0)
+
+# the rows start at 0 when the table is created from the models (create_all), as there
+# is nothing to count yet (the migrations and tables.sql add them from the rows there)
+event.listen(Counters.__table__, "after_create", DDL("""
+    INSERT INTO counters (name, value) VALUES ('stories_complete', 0), ('stories_in_progress', 0), ('parts_complete', 0)
+    ON CONFLICT (name) DO NOTHING
+"""))
+
+class StatsPublic(BaseModel):
+    stories_complete:       int
+    stories_in_progress:    int
+    parts_complete:         int
+    user_parts_complete:    int | None = None
+
+
+# Search document for each completed story (its title and parts' text, see search.py)
+class StorySearch(SQLModel, table=True):
+    __tablename__ = "story_search"
+    __table_args__ = (
+        Index("story_search_document_idx", "document", postgresql_using="gin"),
+    )
+
+    story_id:   int = Field(primary_key=True, foreign_key="story.id")
+    document:   str = Field(sa_column=Column(TSVECTOR, nullable=False))
+
+
+# A page of stories from keyset (cursor) pagination
+class StoryCursorPage(BaseModel):
+    items: list[StoryPublicWithParts]
+    next_cursor: str | None = None
+
 class StoryPublicWithPartsAndCount(BaseModel):
     the_story: StoryPublicWithParts
     count: int
@@ -0,0 +1,136 @@
+from functools import lru_cache
+from pathlib import Path
+import asyncio
+import re
+
+# profanity checker (SafeText is imported when the checker is first made, it is slow to import)
+# https://pypi.org/project/safetext/
+
+
+"""
+Profanity checker shared by all requests
+
+SafeText (and its word list) is loaded once. The word list is also compiled into
+a single trie-shaped regex which finds any word from the list in one pass over
+the text. Text with no possible match (nearly all of it) skips SafeText, text with
+a possible match goes to SafeText so results are exactly those of check_profanity.
+"""
+class ProfanityChecker:
+
+    def __init__(self, language: str = "en"):
+        from safetext import SafeText
+        self.safe_text = SafeText(language=language)
+        words = load_word_list(language)
+        self.pattern = compile_word_list(words)
+        self.max_word_length = max(map(len, words), default=0)
+
+    def might_contain_profanity(self, text: str):
+        # without a word list every text has to go through SafeText
+        return self.pattern is None or self.pattern.search(text) is not None
+
+    def check(self, text: str | None):
+        if not text or not self.might_contain_profanity(text):
+            return []
+        return self.safe_text.check_profanity(text=text)
+
+    """
+    Check a story title and part text in a single pass
+    Returns (title_results, text_results), each as check_profanity would
+    """
+    def check_part(self, part_text: str | None, story_title: str | None = None):
+        if not self.might_contain_profanity(f"{story_title or ''}\n{part_text or ''}"):
+            return [], []
+        return self.check(story_title), self.check(part_text)
+
+    """
+    Check text that was clean before it was edited
+    Only the edited region (plus enough either side to catch a word across
+    the edge) can hold new profanity, so only that region is scanned
+    """
+    def check_edit(self, previous_text: str | None, text: str | None):
+        if not text or self.pattern is None:
+            return self.check(text)
+        previous_text = previous_text or ""
+
+        # skip the unchanged start and end of the text
+        limit = min(len(previous_text), len(text))
+        start = 0
+        while start < limit and previous_text[start] == text[start]:
+            start += 1
+        end = 0
+        while end < limit - start and previous_text[-1 - end] == text[-1 - end]:
+            end += 1
+
+        edited = text[max(start - self.max_word_length, 0):len(text) - end + self.max_word_length]
+        if not self.might_contain_profanity(edited):
+            return []
+        return self.safe_text.check_profanity(text=text)
+
+
+"""
+The words SafeText checks for in a language (empty if they can't be found)
+"""
+def load_word_list(language: str):
+    import safetext
+    words = set()
+    for words_file in (Path(safetext.__file__).parent / "languages" / language).glob("*.txt"):
+        for line in words_file.read_text(encoding="utf-8").splitlines():
+            if line.strip():
+                words.add(line.strip().lower())
+    return words
+
+
+"""
+Compile words into one regex shaped like a trie, e.g. ["ab", "ac"] -> a(?:b|c)
+Matching stops at the shortest word, so it only says whether some word is present
+"""
+def compile_word_list(words: set[str]):
+    if not words:
+        return None
+
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    return re.compile(trie_pattern(trie), re.IGNORECASE)
+
+def trie_pattern(node: dict):
+    if "" in node:
+        return ""
+    alternatives = [re.escape(char) + trie_pattern(child) for char, child in sorted(node.items())]
+    if len(alternatives) == 1:
+        return alternatives[0]
+    return "(?:" + "|".join(alternatives) + ")"
+
+
+@lru_cache
+def get_profanity_checker(language: str = "en"):
+    return ProfanityChecker(language=language)
+
+
+# Checkers being made (or made) in a thread for each language, so requests share one
+checker_tasks: dict[str, asyncio.Task] = {}
+
+"""
+The shared profanity checker, for use on the event loop
+The first call makes it in a thread (it is slow and would hold up every request),
+and calls arriving while it is made (e.g. from warm up and requests) wait on the same one
+"""
+async def load_profanity_checker(language: str = "en"):
+    task = checker_tasks.get(language)
+    if task is None:
+        task = checker_tasks[language] = asyncio.create_task(asyncio.to_thread(get_profanity_checker, language))
+
+        # a failed load is tried again by the next call
+        def forget_failed(task: asyncio.Task):
+            if task.cancelled() or task.exception() is not None:
+                checker_tasks.pop(language, None)
+        task.add_done_callback(forget_failed)
+
+    if task.done():
+        return task.result()
+    # shield so one request disconnecting doesn't cancel the load for the others
+    return await asyncio.shield(task)
@@ -0,0 +1,191 @@
+from cachetools import TTLCache
+from decouple import config
+from fastapi.responses import JSONResponse
+from jose import jwt, JWTError
+from starlette.requests import HTTPConnection
+import math
+import time
+
+from auth import JWT_SECRET_KEY, ALGORITHM
+from metrics import Counter
+from shared_state import get_redis_client, SHARED_STATE_REDIS_URL
+
+
+# Rate limit config from env
+# budgets are "requests/seconds", e.g. 30/60 is 30 requests a minute (allowed all at once)
+RATE_LIMIT_ENABLED = config("RATE_LIMIT_ENABLED", default=True, cast=bool)
+RATE_LIMIT_GET_PART = config("RATE_LIMIT_GET_PART", default="30/60")
+RATE_LIMIT_SAVE_PART = config("RATE_LIMIT_SAVE_PART", default="60/60")
+RATE_LIMIT_COMPLETE_PART = config("RATE_LIMIT_COMPLETE_PART", default="10/60")
+# all users together on the limited routes (empty for no limit)
+RATE_LIMIT_GLOBAL = config("RATE_LIMIT_GLOBAL", default="")
+RATE_LIMIT_MAX_USERS = config("RATE_LIMIT_MAX_USERS", default=100000, cast=int)
+# (share the budgets between workers and instances through Redis)
+RATE_LIMIT_REDIS_URL = config("RATE_LIMIT_REDIS_URL", default=SHARED_STATE_REDIS_URL)
+
+rate_limited = Counter("rate_limited_requests_total", "Requests refused for going over a rate limit", ("budget",))
+
+
+def parse_budget(budget: str):
+    requests, seconds = budget.split("/")
+    return int(requests), float(seconds)
+
+
+"""
+Token buckets kept in this process, one per key
+Each holds the tokens left and when they were counted, refilling continuously
+"""
+class MemoryBuckets:
+
+    def __init__(self, capacity: int, per_seconds: float, maxsize: int):
+        self.capacity = capacity
+        self.rate = capacity / per_seconds
+        # a bucket left long enough to fill up again is the same as no bucket, so idle ones are dropped
+        self.buckets = TTLCache(maxsize=maxsize, ttl=per_seconds)
+
+    """
+    Take a token for the key, returns 0 if there was one or else the seconds until there will be
+    """
+    async def take(self, key: str):
+        now = time.monotonic()
+        bucket = self.buckets.get(key)
+        tokens = self.capacity if bucket is None else min(self.capacity, bucket[0] + (now - bucket[1]) * self.rate)
+
+        if tokens < 1:
+            return (1 - tokens) / self.rate
+
+        self.buckets[key] = (tokens - 1, now)
+        return 0
+
+
+"""
+Token buckets shared through Redis, taken from atomically by a script
+(using the Redis server's clock, so every instance agrees on the time)
+"""
+class RedisBuckets:
+
+    TAKE_SCRIPT = """
+        local capacity = tonumber(ARGV[1])
+        local rate = tonumber(ARGV[2])
+        local time = redis.call('TIME')
+        local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+
+        local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+        local tokens = capacity
+        if bucket[1] then
+            tokens = math.min(capacity, tonumber(bucket[1]) + (now - tonumber(bucket[2])) * rate)
+        end
+
+        if tokens < 1 then
+            return tostring((1 - tokens) / rate)
+        end
+
+        redis.call('HSET', KEYS[1], 'tokens', tokens - 1, 'updated', now)
+        redis.call('PEXPIRE', KEYS[1], math.ceil(capacity / rate * 1000))
+        return '0'
+    """
+
+    def __init__(self, client, prefix: str, capacity: int, per_seconds: float):
+        self.prefix = prefix
+        self.capacity = capacity
+        self.rate = capacity / per_seconds
+        self.script = client.register_script(self.TAKE_SCRIPT)
+
+    async def take(self, key: str):
+        return float(await self.script(keys=[f"{self.prefix}{key}"], args=[self.capacity, self.rate]))
+
+
+def create_buckets(name: str, budget: str):
+    capacity, per_seconds = parse_budget(budget)
+    if RATE_LIMIT_REDIS_URL:
+        return RedisBuckets(get_redis_client(RATE_LIMIT_REDIS_URL), f"ratelimit:{name}:", capacity, per_seconds)
+    return MemoryBuckets(capacity, per_seconds, RATE_LIMIT_MAX_USERS)
+
+
+"""
+Rate limits for the routes starting with each prefix, per user (the auth user id
+in their access token, or their address if they don't have a valid one)
+"""
+class RateLimiter:
+
+    def __init__(self, budgets: dict, global_budget: str = ""):
+        # path prefix -> (budget name, buckets)
+        self.routes = {prefix: (name, create_buckets(name, budget)) for prefix, (name, budget) in budgets.items()}
+        self.global_buckets = create_buckets("global", global_budget) if global_budget else None
+        # access token -> auth user id, so each token is only verified once
+        self.token_users = TTLCache(maxsize=RATE_LIMIT_MAX_USERS, ttl=300)
+
+    def match(self, path: str):
+        for prefix, route in self.routes.items():
+            if path.startswith(prefix):
+                return route
+        return None
+
+    def user_key(self, connection: HTTPConnection):
+        access_token = connection.cookies.get("access_token")
+        if access_token:
+            user_id = self.token_users.get(access_token)
+            if user_id is None:
+                try:
+                    user_id = jwt.decode(access_token, JWT_SECRET_KEY, algorithms=[ALGORITHM]).get("sub")
+                except JWTError:
+                    user_id = None
+                if user_id:
+                    self.token_users[access_token] = user_id
+            if user_id:
+                return f"user:{user_id}"
+
+        return f"address:{connection.client.host if connection.client else ''}"
+
+    """
+    Seconds to wait before the request would be allowed, or 0 if it is allowed now
+    """
+    async def retry_after(self, connection: HTTPConnection):
+        route = self.match(connection.scope["path"])
+        if route is None:
+            return 0
+
+        name, buckets = route
+        wait = await buckets.take(self.user_key(connection))
+        if wait:
+            rate_limited.inc(budget=name)
+            return wait
+
+        if self.global_buckets is not None:
+            wait = await self.global_buckets.take("all")
+            if wait:
+                rate_limited.inc(budget="global")
+                return wait
+
+        return 0
+
+
+"""
+ASGI middleware refusing requests over their rate limit with a 429 and a Retry-After header
+"""
+class RateLimitMiddleware:
+
+    def __init__(self, app, limiter: RateLimiter):
+        self.app = app
+        self.limiter = limiter
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            retry_after = await self.limiter.retry_after(HTTPConnection(scope))
+            if retry_after:
+                response = JSONResponse({"detail": "Too many requests"}, status_code=429,
+                                        headers={"Retry-After": str(math.ceil(retry_after))})
+                await response(scope, receive, send)
+                return
+
+        await self.app(scope, receive, send)
+
+
+rate_limiter = RateLimiter(
+    {
+        "/get_part/": ("get_part", RATE_LIMIT_GET_PART),
+        "/save_part/": ("save_part", RATE_LIMIT_SAVE_PART),
+        "/complete_part/": ("complete_part", RATE_LIMIT_COMPLETE_PART),
+    },
+    RATE_LIMIT_GLOBAL,
+)
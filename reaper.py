@@ -0,0 +1,106 @@
+from datetime import datetime, timedelta
+from decouple import config
+from sqlalchemy import delete, update, exists, func
+from sqlalchemy.sql.operators import is_
+from sqlmodel import select
+import asyncio
+
+from models import Part, Story
+from database import async_session_maker
+from metrics import Counter, logger
+from counters import add_to_counters
+
+
+# Reaper config from env
+REAPER_ENABLED = config("REAPER_ENABLED", default=True, cast=bool)
+PART_TIMEOUT_IN_HOURS = config("PART_TIMEOUT_IN_HOURS", default=24, cast=float)
+REAPER_INTERVAL_IN_SECONDS = config("REAPER_INTERVAL_IN_SECONDS", default=600, cast=int)
+
+parts_reclaimed = Counter("reaper_parts_reclaimed_total", "Abandoned parts taken back from their writer")
+stories_removed = Counter("reaper_stories_removed_total", "Stories removed because they were left with no parts")
+locks_released = Counter("reaper_locks_released_total", "Stories unlocked because nobody was writing them")
+
+# advisory lock key, so only one worker (or instance) reaps at a time
+REAPER_LOCK_ID = 4242001
+
+
+"""
+Takes back parts that were assigned but not completed in time, so the stories
+they belong to can be given to someone else
+
+Everything is done with a few set based statements, however many rows are affected
+"""
+class Reaper:
+
+    def __init__(self, timeout: timedelta = timedelta(hours=PART_TIMEOUT_IN_HOURS),
+                 interval: int = REAPER_INTERVAL_IN_SECONDS, clock=datetime.now):
+        self.timeout = timeout
+        self.interval = interval
+        # (the clock can be replaced, e.g. frozen for testing)
+        self.clock = clock
+        self.task = None
+
+    async def reap(self):
+        cutoff = self.clock() - self.timeout
+        open_part = exists().where(Part.story_id == Story.id, is_(Part.date_complete, None))
+        any_part = exists().where(Part.story_id == Story.id)
+
+        async with async_session_maker() as session:
+            # another worker is already reaping (the lock is released when the transaction ends)
+            if not (await session.exec(select(func.pg_try_advisory_xact_lock(REAPER_LOCK_ID)))).first():
+                return {"parts_reclaimed": 0, "stories_removed": 0, "locks_released": 0}
+
+            # parts started before the cutoff and not complete
+            reclaimed = await session.exec(
+                delete(Part).where(is_(Part.date_complete, None), Part.date_started < cutoff)
+                            .execution_options(synchronize_session=False)
+            )
+
+            # stories left with no parts (their first part was abandoned)
+            removed = await session.exec(
+                delete(Story).where(is_(Story.date_complete, None), ~any_part)
+                             .execution_options(synchronize_session=False)
+            )
+            await add_to_counters(session, stories_in_progress=-removed.rowcount)
+
+            # stories locked with nobody writing a part, the next writer gets the next part number
+            part_count = select(func.count(Part.id)).where(Part.story_id == Story.id).scalar_subquery()
+            released = await session.exec(
+                update(Story).where(is_(Story.locked, True), is_(Story.date_complete, None), ~open_part)
+                             .values(locked=False, next_part=part_count + 1)
+                             .execution_options(synchronize_session=False)
+            )
+
+            await session.commit()
+
+        parts_reclaimed.inc(reclaimed.rowcount)
+        stories_removed.inc(removed.rowcount)
+        locks_released.inc(released.rowcount)
+        if reclaimed.rowcount or removed.rowcount or released.rowcount:
+            logger.info("Reaper reclaimed %d parts, removed %d stories and released %d locks",
+                        reclaimed.rowcount, removed.rowcount, released.rowcount)
+
+        return {"parts_reclaimed": reclaimed.rowcount, "stories_removed": removed.rowcount, "locks_released": released.rowcount}
+
+    async def run(self):
+        while True:
+            try:
+                await self.reap()
+            except Exception:
+                logger.exception("Reaper failed")
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+
+reaper = Reaper()
@@ -0,0 +1,53 @@
+from sqlalchemy import cast, func, literal, literal_column, tuple_
+from sqlalchemy.dialects.postgresql import REGCONFIG, aggregate_order_by, insert
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from models import Story, Part, StorySearch
+
+
+# Text search configuration used for documents and queries
+SEARCH_LANGUAGE = "english"
+
+language = cast(literal(SEARCH_LANGUAGE), REGCONFIG)
+
+
+"""
+Insert (or replace) the search documents of the stories matching the conditions
+A document is the story's title (weighted above the text) and its parts' text in order
+"""
+def index_stories(*conditions):
+    title = func.setweight(func.to_tsvector(language, func.coalesce(Story.title, "")), literal_column("'A'"))
+    parts_text = func.string_agg(Part.part_text, aggregate_order_by(literal_column("' '"), Part.part_number))
+    text = func.setweight(func.to_tsvector(language, func.coalesce(parts_text, "")), literal_column("'B'"))
+
+    documents = (select(Story.id, title.op("||")(text))
+                    .join(Part, Part.story_id == Story.id)
+                    .where(*conditions)
+                    .group_by(Story.id))
+
+    statement = insert(StorySearch).from_select(["story_id", "document"], documents)
+    return statement.on_conflict_do_update(index_elements=[StorySearch.story_id], set_={"document": statement.excluded.document})
+
+
+async def index_story(session: AsyncSession, story_id: int):
+    await session.exec(index_stories(Story.id == story_id))
+
+
+"""
+Ids and ranks of completed stories matching the search (web search syntax,
+e.g. dragon -castle "once upon"), best match first
+Pass the rank and id of the last story of a page as after to get the next page
+"""
+async def search_stories(session: AsyncSession, search: str, limit: int, after: tuple[float, int] | None = None):
+    ts_query = func.websearch_to_tsquery(language, search)
+    rank = func.ts_rank(StorySearch.document, ts_query)
+
+    query = (select(StorySearch.story_id, rank.label("rank"))
+                .where(StorySearch.document.op("@@")(ts_query))
+                .order_by(rank.desc(), StorySearch.story_id.desc())
+                .limit(limit))
+    if after:
+        query = query.where(tuple_(rank, StorySearch.story_id) < tuple_(*after))
+
+    return (await session.exec(query)).all()
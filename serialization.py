@@ -0,0 +1,45 @@
+from decouple import config
+import orjson
+
+from models import Story, Part, StoryPublic, PartPublic, StoryPublicWithParts
+
+
+# Serialize hot read responses with orjson straight from the ORM rows
+# (rows loaded from the database are trusted, so response_model validation is skipped)
+FAST_JSON = config("FAST_JSON", default=False, cast=bool)
+
+# field names in the order the response models give them, so the JSON is the same either way
+STORY_FIELDS = tuple(StoryPublic.model_fields)
+PART_FIELDS = tuple(PartPublic.model_fields)
+
+
+def row_to_dict(row, fields: tuple):
+    return {field: getattr(row, field) for field in fields}
+
+
+"""
+A part as PartPublic, or PartPublicWithStory with its story (which must be loaded)
+"""
+def part_to_dict(part: Part, with_story: bool = False):
+    part_dict = row_to_dict(part, PART_FIELDS)
+    if with_story:
+        part_dict["story"] = row_to_dict(part.story, STORY_FIELDS) if part.story is not None else None
+    return part_dict
+
+
+"""
+A story as StoryPublicWithParts (its parts must be loaded)
+"""
+def story_to_dict(story: Story):
+    story_dict = row_to_dict(story, STORY_FIELDS)
+    story_dict["parts"] = [row_to_dict(part, PART_FIELDS) for part in story.parts]
+    return story_dict
+
+
+"""
+A story as StoryPublicWithParts JSON
+"""
+def serialize_story(story: Story):
+    if FAST_JSON:
+        return orjson.dumps(story_to_dict(story))
+    return StoryPublicWithParts.model_validate(story).model_dump_json().encode()
@@ -0,0 +1,96 @@
+from collections import OrderedDict
+from decouple import config
+
+
+# Shared state config from env
+# (set SHARED_STATE_REDIS_URL to share caches between workers and instances,
+#  otherwise each worker process keeps its own in memory)
+SHARED_STATE_REDIS_URL = config("SHARED_STATE_REDIS_URL", default="")
+
+
+"""
+State kept in this process, dropping the least recently used values when over max_bytes
+"""
+class MemoryBackend:
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.values = OrderedDict()
+
+    async def get(self, key):
+        value = self.values.get(key)
+        if value is not None:
+            self.values.move_to_end(key)
+        return value
+
+    async def get_many(self, keys: list):
+        values = {}
+        for key in keys:
+            value = await self.get(key)
+            if value is not None:
+                values[key] = value
+        return values
+
+    async def set(self, key, value: bytes):
+        old_value = self.values.pop(key, None)
+        if old_value is not None:
+            self.size -= len(old_value)
+        if len(value) > self.max_bytes:
+            return
+
+        self.values[key] = value
+        self.size += len(value)
+        while self.size > self.max_bytes:
+            _, evicted = self.values.popitem(last=False)
+            self.size -= len(evicted)
+
+
+"""
+State shared through Redis (or anything speaking its protocol, e.g. fakeredis for testing)
+Memory is capped by the server's maxmemory with an LRU eviction policy
+"""
+class RedisBackend:
+
+    def __init__(self, client, prefix: str):
+        self.client = client
+        self.prefix = prefix
+
+    async def get(self, key):
+        return await self.client.get(f"{self.prefix}{key}")
+
+    async def get_many(self, keys: list):
+        if not keys:
+            return {}
+        values = await self.client.mget([f"{self.prefix}{key}" for key in keys])
+        return {key: value for key, value in zip(keys, values) if value is not None}
+
+    async def set(self, key, value: bytes):
+        await self.client.set(f"{self.prefix}{key}", value)
+
+
+# One client (and connection pool) per Redis URL, shared by all the backends using it
+redis_clients = {}
+
+def get_redis_client(url: str):
+    client = redis_clients.get(url)
+    if client is None:
+        import redis.asyncio
+        client = redis_clients[url] = redis.asyncio.from_url(url)
+    return client
+
+
+"""
+A backend for one kind of state, its keys prefixed so kinds can share a Redis
+max_bytes caps the memory used when kept in process
+"""
+def create_backend(prefix: str, max_bytes: int, redis_url: str = SHARED_STATE_REDIS_URL):
+    if redis_url:
+        return RedisBackend(get_redis_client(redis_url), prefix)
+    return MemoryBackend(max_bytes)
+
+
+async def close_backends():
+    for client in redis_clients.values():
+        await client.aclose()
+    redis_clients.clear()
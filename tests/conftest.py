@@ -0,0 +1,212 @@
+"""
+The tests needing a database run against one of their own, named by TEST_DB_NAME
+(the other DB_ variables are as for the app). It is emptied, migrated and filled
+with benchmark/seed.py's users and stories, so never point it at a real database.
+
+TEST_DB_NAME=partofthestory_test pytest
+
+Without TEST_DB_NAME those tests are skipped.
+"""
+from sqlalchemy import event, text
+import httpx
+import json
+import os
+import pytest
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(1, os.path.join(ROOT, "benchmark"))
+
+TEST_DB_NAME = os.environ.get("TEST_DB_NAME")
+if TEST_DB_NAME:
+    os.environ["DB_NAME"] = TEST_DB_NAME
+
+# the rest of the config the app needs (anything already set is kept)
+for name, value in {
+    "DB_HOST": "localhost", "DB_NAME": "partofthestory_test", "DB_USER": "postgres", "DB_PASSWORD": "postgres", "DB_PORT": "5432",
+    "SECRET_KEY": "test-secret-key", "JWT_SECRET_KEY": "test-jwt-secret-key",
+    "GOOGLE_CLIENT_ID": "test-client-id", "GOOGLE_CLIENT_SECRET": "test-client-secret",
+    "REDIRECT_URL": "http://test/auth", "FRONTEND_URL": "http://test", "ALLOWED_ORIGINS": "http://test",
+    "COOKIE_DOMAIN": "test", "COOKIE_PATH": "/", "COOKIE_SAMESITE": "none", "PAGE_SIZE": "10",
+}.items():
+    os.environ.setdefault(name, value)
+
+# statements counted, nothing throttled, kept in process or left running in the background
+# (and every save written straight away)
+os.environ.update({
+    "QUERY_COUNT_HEADER": "True", "RATE_LIMIT_ENABLED": "False", "REAPER_ENABLED": "False",
+    "SHARED_STATE_REDIS_URL": "", "AUTOSAVE_WINDOW_IN_SECONDS": "0",
+})
+
+# seeded data: completed stories 1..SEEDED_STORIES, then SEEDED_IN_PROGRESS in progress
+# (users write about 10 parts each, as real users do, so the planner sees the same selectivity)
+SEEDED_USERS = 10000
+SEEDED_STORIES = 20000
+SEEDED_IN_PROGRESS = 1000
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+"""
+The test database, migrated with the app's migrations
+"""
+class DatabaseFixture:
+
+    def __init__(self):
+        from database import get_engine
+        self.engine = get_engine()
+        self.seeded = False
+
+    def migrate(self):
+        from alembic import command
+        from alembic.config import Config
+
+        with self.engine.begin() as connection:
+            connection.execute(text("DROP SCHEMA public CASCADE"))
+            connection.execute(text("CREATE SCHEMA public"))
+
+        config = Config(os.path.join(ROOT, "alembic.ini"))
+        config.set_main_option("script_location", os.path.join(ROOT, "database", "migrations"))
+        command.upgrade(config, "head")
+
+    def empty(self):
+        with self.engine.begin() as connection:
+            connection.execute(text("TRUNCATE story_search, vote, part, story, users RESTART IDENTITY CASCADE"))
+            connection.execute(text("UPDATE counters SET value = 0"))
+        self.seeded = False
+
+    def seed(self):
+        from seed import seed
+
+        self.empty()
+        with self.engine.begin() as connection:
+            seed(connection, SEEDED_USERS, SEEDED_STORIES, SEEDED_IN_PROGRESS)
+        # (statistics for the planner, outside a transaction)
+        with self.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+            connection.execute(text("ANALYZE"))
+        self.seeded = True
+
+
+@pytest.fixture(scope="session")
+def database():
+    if not TEST_DB_NAME:
+        pytest.skip("set TEST_DB_NAME to run the tests needing a database")
+
+    database = DatabaseFixture()
+    database.migrate()
+    return database
+
+
+"""
+The database with the seeded users and stories (seeded again if a test emptied it)
+"""
+@pytest.fixture
+def seeded(database):
+    if not database.seeded:
+        database.seed()
+    return database
+
+
+"""
+The app's async engine, its pool emptied after the test
+(the pool's connections belong to the test's event loop)
+"""
+@pytest.fixture
+async def async_engine():
+    from database import async_engine
+
+    yield async_engine
+    await async_engine.dispose()
+
+
+"""
+A client for the app, each request handled in process
+Caches are emptied first so every test sees the queries of a cold request
+"""
+@pytest.fixture
+async def client(seeded, async_engine):
+    from main import app
+    from auth import cached_users
+    from cache import story_cache, STORY_CACHE_MAX_BYTES
+    from shared_state import MemoryBackend
+
+    cached_users.clear()
+    story_cache.backend = MemoryBackend(STORY_CACHE_MAX_BYTES)
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        yield client
+
+
+"""
+The cookie of seeded user n
+"""
+def user_cookies(n: int):
+    from tokens import bench_cookie
+    return bench_cookie(n)
+
+
+"""
+Claim a part as seeded user n (their open part if they have one)
+"""
+async def claim_part(client, n: int):
+    client.cookies = user_cookies(n)
+    response = await client.get("/get_part/")
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+"""
+Records the SQL statements run by the app (with their parameters) while in use
+"""
+class StatementRecorder:
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.statements = []
+
+    def record(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append((statement, parameters))
+
+    def __enter__(self):
+        self.statements = []
+        event.listen(self.engine, "before_cursor_execute", self.record)
+        return self
+
+    def __exit__(self, *exc_info):
+        event.remove(self.engine, "before_cursor_execute", self.record)
+
+
+@pytest.fixture
+def recorder(client):
+    from database import async_engine
+    return StatementRecorder(async_engine.sync_engine)
+
+
+"""
+The nodes of each statement's plan (EXPLAIN, so nothing is run)
+"""
+async def explain(statements: list):
+    from database import async_engine
+
+    nodes = []
+    async with async_engine.connect() as connection:
+        for statement, parameters in statements:
+            # (statements like SHOW, run when a connection is first made, have no plan)
+            if not statement.lstrip().upper().startswith(("SELECT", "INSERT", "UPDATE", "DELETE", "WITH")):
+                continue
+            plan = (await connection.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {statement}", parameters)).scalar()
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            nodes += plan_nodes(plan[0]["Plan"], statement)
+        await connection.rollback()
+    return nodes
+
+def plan_nodes(plan: dict, statement: str):
+    nodes = [{"type": plan["Node Type"], "relation": plan.get("Relation Name"), "index": plan.get("Index Name"), "statement": statement}]
+    for child in plan.get("Plans", []):
+        nodes += plan_nodes(child, statement)
+    return nodes
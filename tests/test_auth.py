@@ -0,0 +1,65 @@
+"""
+Tokens close to expiry refreshed with Google, and kept while Google can't be reached
+"""
+from datetime import timedelta
+import httpx
+import pytest
+
+from conftest import user_cookies
+
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def google_failing(monkeypatch):
+    import auth
+
+    # (as a timeout does, after HTTP_TIMEOUT_IN_SECONDS)
+    async def request_access_token(user, user_name):
+        raise httpx.ReadTimeout("timed out")
+
+    monkeypatch.setattr(auth, "request_access_token", request_access_token)
+    auth.refreshed_tokens.clear()
+    yield
+    auth.refreshed_tokens.clear()
+
+
+def token_cookie(n: int, expires_in: timedelta):
+    from tokens import bench_cookie
+    return bench_cookie(n, expires_in)
+
+
+async def test_token_kept_when_refresh_fails(client, google_failing):
+    # inside TOKEN_REFRESH_THRESHOLD_IN_MINUTES, so refreshed
+    client.cookies = token_cookie(70, timedelta(minutes=2))
+    access_token = client.cookies["access_token"]
+
+    response = await client.get("/get_part/")
+    assert response.status_code == 200, response.text
+    # the same token set again, to be refreshed on a later request
+    assert response.cookies["access_token"] == access_token
+
+
+async def test_expired_token_refused(client, google_failing):
+    client.cookies = token_cookie(71, timedelta(minutes=-1))
+
+    response = await client.get("/get_part/")
+    assert response.status_code == 401
+    assert response.json()["detail"] == "Session expired. Please login again."
+
+
+async def test_token_refreshed(client, monkeypatch):
+    import auth
+
+    async def request_access_token(user, user_name):
+        return user_cookies(72)["access_token"]
+
+    monkeypatch.setattr(auth, "request_access_token", request_access_token)
+    auth.refreshed_tokens.clear()
+    client.cookies = token_cookie(72, timedelta(minutes=2))
+    access_token = client.cookies["access_token"]
+
+    response = await client.get("/get_part/")
+    assert response.status_code == 200, response.text
+    assert response.cookies["access_token"] != access_token
@@ -0,0 +1,59 @@
+"""
+Autosaves written by more than one worker (each with an Autosaver of its own),
+and combined within a window by one
+"""
+from sqlalchemy import text
+import pytest
+
+from conftest import claim_part
+
+
+pytestmark = pytest.mark.anyio
+
+
+def part_row(database, part_id: int):
+    with database.engine.connect() as connection:
+        # (xmin changes whenever the row is written)
+        return connection.execute(text("SELECT part_text, xmin::text FROM part WHERE id = :id"), {"id": part_id}).one()
+
+
+async def test_saves_across_workers(client, seeded):
+    from autosave import Autosaver
+
+    part = await claim_part(client, 50)
+    first, second = Autosaver(window=0), Autosaver(window=0)
+
+    await first.save(part["user_id"], part["id"], "Once upon", None)
+    await second.save(part["user_id"], part["id"], "Once upon a time", None)
+    # the same text as the first worker last saved, but not what the second wrote
+    await first.save(part["user_id"], part["id"], "Once upon", None)
+
+    assert part_row(seeded, part["id"]).part_text == "Once upon"
+
+
+async def test_unchanged_save_writes_nothing(client, seeded):
+    from autosave import Autosaver
+
+    part = await claim_part(client, 51)
+    await Autosaver(window=0).save(part["user_id"], part["id"], "Once upon", None)
+    written = part_row(seeded, part["id"])
+
+    # e.g. from another worker, which can't know the text is already saved
+    await Autosaver(window=0).save(part["user_id"], part["id"], "Once upon", None)
+    assert part_row(seeded, part["id"]) == written
+
+
+async def test_saves_combined_within_window(client, seeded):
+    from autosave import Autosaver
+
+    part = await claim_part(client, 52)
+    autosaver = Autosaver(window=60)
+
+    await autosaver.save(part["user_id"], part["id"], "Once upon", None)
+    await autosaver.save(part["user_id"], part["id"], "Once upon a time", None)
+    # held back until the window ends
+    assert part_row(seeded, part["id"]).part_text == "Once upon"
+
+    await autosaver.flush_all()
+    assert part_row(seeded, part["id"]).part_text == "Once upon a time"
+    autosaver.discard(part["user_id"], part["id"])
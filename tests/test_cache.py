@@ -0,0 +1,106 @@
+"""
+The story cache kept in Redis (run against fakeredis, which speaks its protocol
+in process) and in memory
+"""
+import fakeredis
+import orjson
+import pytest
+
+from conftest import StatementRecorder
+
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def redis():
+    return fakeredis.FakeAsyncRedis()
+
+
+async def test_redis_backend(redis):
+    from shared_state import RedisBackend
+
+    backend = RedisBackend(redis, "story:")
+    await backend.set(1, b"one")
+    await backend.set(2, b"two")
+
+    assert await backend.get(1) == b"one"
+    assert await backend.get(3) is None
+    # (missing keys are left out)
+    assert await backend.get_many([2, 3, 1]) == {2: b"two", 1: b"one"}
+    assert await backend.get_many([]) == {}
+
+    # stored under the prefix
+    assert await redis.get("story:1") == b"one"
+
+
+async def test_redis_backend_prefixes(redis):
+    from shared_state import RedisBackend
+
+    stories = RedisBackend(redis, "story:")
+    users = RedisBackend(redis, "user:")
+    await stories.set(1, b"story")
+    await users.set(1, b"user")
+
+    assert await stories.get(1) == b"story"
+    assert await users.get(1) == b"user"
+    assert await users.get_many([1, 2]) == {1: b"user"}
+
+
+async def test_memory_backend_evicts_least_recently_used():
+    from shared_state import MemoryBackend
+
+    backend = MemoryBackend(max_bytes=10)
+    await backend.set(1, b"aaaa")
+    await backend.set(2, b"bbbb")
+    # 1 used more recently than 2, so 2 is dropped to make room
+    assert await backend.get(1) == b"aaaa"
+    await backend.set(3, b"cccc")
+
+    assert await backend.get_many([1, 2, 3]) == {1: b"aaaa", 3: b"cccc"}
+    assert backend.size == 8
+
+    # too big to keep at all
+    await backend.set(4, b"x" * 11)
+    assert await backend.get(4) is None
+
+
+async def test_story_cache_with_redis(seeded, redis, async_engine):
+    from cache import StoryCache
+    from database import async_session_maker
+    from shared_state import RedisBackend
+
+    story_cache = StoryCache(RedisBackend(redis, "story:"))
+    recorder = StatementRecorder(async_engine.sync_engine)
+    # stories not cached are loaded from the database, in the order asked for
+    # (and ids that aren't stories left out)
+    async with async_session_maker() as session:
+        with recorder:
+            stories = await story_cache.get_many(session, [5, 3, 0])
+    assert [orjson.loads(story)["id"] for story in stories] == [5, 3]
+    assert all(len(orjson.loads(story)["parts"]) == 5 for story in stories)
+    assert recorder.statements
+
+    # then come from Redis, shared by every worker using it
+    assert await redis.get("story:3") == stories[1]
+    async with async_session_maker() as session:
+        with recorder:
+            assert await story_cache.get_many(session, [5, 3]) == stories
+        assert await StoryCache(RedisBackend(redis, "story:")).get_many(session, [3]) == [stories[1]]
+    assert not recorder.statements
+
+
+async def test_story_route_with_redis(client, redis):
+    from cache import story_cache
+    from shared_state import RedisBackend
+
+    story_cache.backend = RedisBackend(redis, "story:")
+
+    first = await client.get("/stories/11")
+    assert first.status_code == 200, first.text
+    assert await redis.get("story:11") is not None
+
+    # the story's JSON from Redis, so only its date_complete is queried
+    second = await client.get("/stories/11")
+    assert second.json() == first.json()
+    assert int(second.headers["X-Query-Count"]) <= 1
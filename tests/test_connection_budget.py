@@ -0,0 +1,41 @@
+"""
+DB_MAX_CONNECTIONS shared between the workers (read when database.py is
+imported, so each case imports it in a process of its own; nothing connects)
+"""
+import os
+import subprocess
+import sys
+
+from conftest import ROOT
+
+
+def import_database(**env: str):
+    return subprocess.run([sys.executable, "-c", "import database; print(database.DB_POOL_SIZE, database.DB_MAX_OVERFLOW)"],
+                          cwd=ROOT, env={**os.environ, **env}, capture_output=True, text=True)
+
+
+def test_pool_is_a_share_of_the_budget():
+    result = import_database(DB_MAX_CONNECTIONS="10", WEB_CONCURRENCY="4")
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.split() == ["2", "0"]
+
+
+def test_more_workers_than_connections_refused():
+    result = import_database(DB_MAX_CONNECTIONS="2", WEB_CONCURRENCY="4")
+    assert result.returncode != 0
+    assert "WEB_CONCURRENCY (4) is more than DB_MAX_CONNECTIONS (2)" in result.stderr
+
+
+def gunicorn_workers(**env: str):
+    # (as if on 8 cores)
+    code = "import os, runpy; os.sched_getaffinity = lambda pid: set(range(8)); print(runpy.run_path('gunicorn.conf.py')['workers'])"
+    environ = {name: value for name, value in os.environ.items() if name not in ("WEB_CONCURRENCY", "DB_MAX_CONNECTIONS")}
+    result = subprocess.run([sys.executable, "-c", code], cwd=ROOT, env={**environ, **env}, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    return int(result.stdout)
+
+
+def test_default_workers_capped_by_budget():
+    assert gunicorn_workers() == 8
+    assert gunicorn_workers(DB_MAX_CONNECTIONS="100") == 8
+    assert gunicorn_workers(DB_MAX_CONNECTIONS="3") == 3
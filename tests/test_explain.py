@@ -0,0 +1,112 @@
+"""
+Every statement each route runs is planned (EXPLAIN) against the seeded
+database, and must find its rows with the indexes from the migrations rather
+than by scanning a whole table
+"""
+import pytest
+
+from conftest import claim_part, explain, user_cookies
+
+
+pytestmark = pytest.mark.anyio
+
+# tables that grow with the number of stories (counters has a row per stat, so is scanned)
+LARGE_TABLES = {"users", "story", "part", "vote", "story_search"}
+
+
+async def route_plans(client, recorder, method: str, url: str, **kwargs):
+    with recorder:
+        response = await client.request(method, url, **kwargs)
+    assert response.status_code < 400, response.text
+    return await explain(recorder.statements)
+
+
+def assert_uses_indexes(nodes: list, *indexes: str):
+    seq_scans = [node for node in nodes if node["type"] == "Seq Scan" and node["relation"] in LARGE_TABLES]
+    assert not seq_scans, "\n".join(f"Seq Scan on {node['relation']} in: {node['statement']}" for node in seq_scans)
+
+    used = {node["index"] for node in nodes}
+    missing = set(indexes) - used
+    assert not missing, f"{sorted(missing)} not used, only {sorted(filter(None, used))}"
+
+
+async def test_user(client, recorder):
+    client.cookies = user_cookies(10)
+    nodes = await route_plans(client, recorder, "GET", "/user")
+    assert_uses_indexes(nodes, "users_auth_user_id_key")
+
+
+async def test_random_complete_story(client, recorder):
+    nodes = await route_plans(client, recorder, "GET", "/random_complete_story/")
+    assert_uses_indexes(nodes, "story_random_key_idx", "story_pkey", "part_story_part_number_idx")
+
+
+async def test_story(client, recorder):
+    nodes = await route_plans(client, recorder, "GET", "/stories/123")
+    assert_uses_indexes(nodes, "story_pkey", "part_story_part_number_idx")
+
+
+async def test_get_part(client, recorder):
+    client.cookies = user_cookies(11)
+    nodes = await route_plans(client, recorder, "GET", "/get_part/")
+    assert_uses_indexes(nodes, "users_auth_user_id_key", "part_open_user_idx", "story_unlocked_idx")
+
+
+async def test_get_part_already_assigned(client, recorder):
+    await claim_part(client, 12)
+    nodes = await route_plans(client, recorder, "GET", "/get_part/")
+    assert_uses_indexes(nodes, "part_open_user_idx")
+
+
+async def test_get_previous_part(client, recorder):
+    await claim_part(client, 13)
+    nodes = await route_plans(client, recorder, "GET", "/get_previous_part/")
+    assert_uses_indexes(nodes, "part_open_user_idx", "part_story_part_number_idx")
+
+
+async def test_complete_part(client, recorder):
+    part = await claim_part(client, 14)
+    nodes = await route_plans(client, recorder, "PATCH", f"/complete_part/{part['id']}",
+                              json={"part_text": "Once upon a time", "story_title": "A test story"})
+    assert_uses_indexes(nodes, "story_pkey", "users_pkey")
+
+
+async def test_save_part(client, recorder):
+    part = await claim_part(client, 15)
+    nodes = await route_plans(client, recorder, "PATCH", f"/save_part/{part['id']}",
+                              json={"part_text": "Once upon", "story_title": "A test story"})
+    assert_uses_indexes(nodes, "story_pkey")
+
+
+async def test_my_stories(client, recorder):
+    client.cookies = user_cookies(16)
+    nodes = await route_plans(client, recorder, "GET", "/my_stories/", params={"page": 1})
+    assert_uses_indexes(nodes, "part_user_story_idx", "part_story_part_number_idx")
+
+
+async def test_my_stories_cursor(client, recorder):
+    client.cookies = user_cookies(17)
+    nodes = await route_plans(client, recorder, "GET", "/my_stories/cursor/")
+    assert_uses_indexes(nodes, "part_user_story_idx", "part_story_part_number_idx")
+
+
+async def test_top_stories(client, recorder):
+    nodes = await route_plans(client, recorder, "GET", "/top_stories/")
+    assert_uses_indexes(nodes, "story_score_idx")
+
+
+async def test_search(client, recorder):
+    nodes = await route_plans(client, recorder, "GET", "/search", params={"q": "word123"})
+    assert_uses_indexes(nodes, "story_search_document_idx", "part_story_part_number_idx")
+
+
+async def test_stats(client, recorder):
+    client.cookies = user_cookies(18)
+    nodes = await route_plans(client, recorder, "GET", "/stats")
+    assert_uses_indexes(nodes, "users_pkey")
+
+
+async def test_vote(client, recorder):
+    client.cookies = user_cookies(19)
+    nodes = await route_plans(client, recorder, "POST", "/stories/42/vote")
+    assert_uses_indexes(nodes, "story_pkey")
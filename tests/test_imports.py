@@ -0,0 +1,17 @@
+"""
+Slow imports left until first use, so they aren't paid for on every cold start
+(the app is imported in a process of its own; nothing connects)
+"""
+import os
+import subprocess
+import sys
+
+from conftest import ROOT
+
+
+def test_slow_imports_deferred():
+    deferred = ["httpx", "psycopg2", "authlib", "safetext", "redis"]
+    code = f"import sys, main; print(' '.join(name for name in {deferred!r} if name in sys.modules))"
+    result = subprocess.run([sys.executable, "-c", code], cwd=ROOT, env=os.environ, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.split() == []
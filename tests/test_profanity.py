@@ -0,0 +1,87 @@
+"""
+The shared profanity checker made once, in a thread, however many requests
+need it while it is being made
+"""
+import asyncio
+import pytest
+import time
+
+from conftest import claim_part
+
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def unloaded(monkeypatch):
+    import profanity
+
+    # a checker as slow to make as the first one in a new worker
+    made = []
+    class SlowChecker(profanity.ProfanityChecker):
+        def __init__(self, language: str = "en"):
+            time.sleep(0.3)
+            super().__init__(language)
+            made.append(self)
+
+    get_profanity_checker = profanity.get_profanity_checker
+    monkeypatch.setattr(profanity, "ProfanityChecker", SlowChecker)
+    get_profanity_checker.cache_clear()
+    profanity.checker_tasks.clear()
+    yield made
+
+    get_profanity_checker.cache_clear()
+    profanity.checker_tasks.clear()
+
+
+async def test_made_once(unloaded):
+    from profanity import load_profanity_checker
+
+    ticks = 0
+    async def tick():
+        nonlocal ticks
+        while True:
+            await asyncio.sleep(0.01)
+            ticks += 1
+
+    ticker = asyncio.create_task(tick())
+    checkers = await asyncio.gather(*(load_profanity_checker() for _ in range(20)))
+    ticker.cancel()
+
+    assert len(unloaded) == 1
+    assert all(checker is unloaded[0] for checker in checkers)
+    # the event loop kept running while it was made
+    assert ticks >= 10
+
+    # then it is returned straight away
+    assert await load_profanity_checker() is unloaded[0]
+
+
+async def test_failed_load_tried_again(unloaded, monkeypatch):
+    import profanity
+
+    get_profanity_checker = profanity.get_profanity_checker
+    def fail_once(language: str = "en"):
+        if not failed:
+            failed.append(language)
+            raise OSError("word list missing")
+        return get_profanity_checker(language)
+
+    failed = []
+    monkeypatch.setattr(profanity, "get_profanity_checker", fail_once)
+    with pytest.raises(OSError):
+        await profanity.load_profanity_checker()
+
+    assert await profanity.load_profanity_checker() is unloaded[0]
+
+
+async def test_routes_wait_for_the_checker(client, unloaded):
+    # saves arriving before there is a checker wait for the one being made, rather than each making one
+    part = await claim_part(client, 60)
+
+    responses = await asyncio.gather(
+        client.patch(f"/save_part/{part['id']}", json={"part_text": "Once upon", "story_title": "A story"}),
+        client.patch(f"/save_part/{part['id']}", json={"part_text": "Once upon a", "story_title": "A story"}),
+    )
+    assert all(response.json()["status"] == 200 for response in responses)
+    assert len(unloaded) == 1
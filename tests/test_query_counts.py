@@ -0,0 +1,108 @@
+"""
+Each route runs at most a fixed number of statements (X-Query-Count), however
+many stories or parts it returns, so relationships can't start being loaded
+one row at a time again
+
+Counts are for a cold request, the user's row and the stories' JSON not yet cached.
+"""
+import pytest
+
+from conftest import claim_part, user_cookies
+
+
+pytestmark = pytest.mark.anyio
+
+
+async def query_count(client, method: str, url: str, **kwargs):
+    response = await client.request(method, url, **kwargs)
+    assert response.status_code < 400, response.text
+    return int(response.headers["X-Query-Count"])
+
+
+async def test_user(client):
+    client.cookies = user_cookies(30)
+    # the user's row
+    assert await query_count(client, "GET", "/user") <= 1
+    # then cached
+    assert await query_count(client, "GET", "/user") == 0
+
+
+async def test_random_complete_story(client):
+    # the random story, again from the start if none was after the random key, then its story and parts
+    assert await query_count(client, "GET", "/random_complete_story/") <= 4
+
+
+async def test_story(client):
+    # the story's date_complete, then its story and parts
+    assert await query_count(client, "GET", "/stories/7") <= 3
+    # then only the date_complete, the JSON is cached
+    assert await query_count(client, "GET", "/stories/7") <= 1
+
+
+async def test_get_part(client):
+    client.cookies = user_cookies(31)
+    # the user, their open part, claiming a story, then the new part and the story (or a new story and the stats)
+    assert await query_count(client, "GET", "/get_part/") <= 6
+    # then the open part with its story
+    assert await query_count(client, "GET", "/get_part/") <= 2
+
+
+async def test_get_previous_part(client):
+    await claim_part(client, 32)
+    assert await query_count(client, "GET", "/get_previous_part/") <= 2
+
+
+async def test_complete_part(client):
+    part = await claim_part(client, 33)
+    count = await query_count(client, "PATCH", f"/complete_part/{part['id']}",
+                              json={"part_text": "Once upon a time", "story_title": "A test story"})
+    # the part, the story, the stats and the user's count
+    # (and for the last part, its search document then its story and parts for the cache)
+    assert count <= (7 if part["part_number"] == 5 else 4)
+
+
+async def test_save_part(client):
+    part = await claim_part(client, 34)
+    # the part and the story's title
+    assert await query_count(client, "PATCH", f"/save_part/{part['id']}",
+                             json={"part_text": "Once upon", "story_title": "A test story"}) <= 2
+
+
+@pytest.mark.parametrize("size", [1, 50])
+async def test_my_stories(client, size: int):
+    client.cookies = user_cookies(35)
+    # the user, the ETag, the total, the page of stories and their parts
+    assert await query_count(client, "GET", "/my_stories/", params={"page": 1, "size": size}) <= 5
+
+
+@pytest.mark.parametrize("size", [1, 50])
+async def test_my_stories_cursor(client, size: int):
+    client.cookies = user_cookies(36)
+    # the user, the ETag, the page of story ids, then their stories and parts
+    assert await query_count(client, "GET", "/my_stories/cursor/", params={"size": size}) <= 5
+
+
+async def test_top_stories(client):
+    # the page of story ids, then their stories and parts
+    assert await query_count(client, "GET", "/top_stories/", params={"size": 50}) <= 3
+
+
+@pytest.mark.parametrize("size", [1, 50])
+async def test_search(client, size: int):
+    # the matching story ids, then their stories and parts
+    assert await query_count(client, "GET", "/search", params={"q": "word7", "size": size}) <= 3
+
+
+async def test_stats(client):
+    # the counters
+    assert await query_count(client, "GET", "/stats") <= 1
+
+    # and the user, and their count
+    client.cookies = user_cookies(37)
+    assert await query_count(client, "GET", "/stats") <= 3
+
+
+async def test_vote(client):
+    client.cookies = user_cookies(38)
+    # the user, the vote and the story's votes
+    assert await query_count(client, "POST", "/stories/9/vote") <= 3
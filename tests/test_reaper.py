@@ -0,0 +1,103 @@
+"""
+The reaper against a frozen clock, with parts started either side of the cutoff
+"""
+from datetime import datetime, timedelta
+from sqlalchemy import text
+import pytest
+
+
+pytestmark = pytest.mark.anyio
+
+FROZEN = datetime(2026, 1, 1, 12)
+TIMEOUT = timedelta(hours=24)
+
+# story id -> (locked, next_part, date_complete), then its parts: (part number, user, started, completed)
+STORIES = {
+    # part 2 abandoned: reclaimed, and the story unlocked for part 2 again
+    1: (True, 3, None, [(1, 1, FROZEN - timedelta(hours=40), FROZEN - timedelta(hours=39)),
+                        (2, 2, FROZEN - timedelta(hours=30), None)]),
+    # its only part abandoned: reclaimed, and the story removed
+    2: (True, 2, None, [(1, 3, FROZEN - timedelta(hours=30), None)]),
+    # part 2 started an hour ago: left alone
+    3: (True, 3, None, [(1, 2, FROZEN - timedelta(hours=5), FROZEN - timedelta(hours=4)),
+                        (2, 1, FROZEN - timedelta(hours=1), None)]),
+    # locked with nobody writing it: unlocked for part 4
+    4: (True, 5, None, [(n, 1, FROZEN - timedelta(hours=10), FROZEN - timedelta(hours=9)) for n in (1, 2, 3)]),
+    # complete: left alone
+    5: (False, 6, FROZEN - timedelta(days=2), [(n, 2, FROZEN - timedelta(days=3), FROZEN - timedelta(days=2)) for n in range(1, 6)]),
+    # started exactly at the cutoff: not yet abandoned
+    6: (True, 2, None, [(1, 4, FROZEN - TIMEOUT, None)]),
+}
+
+
+@pytest.fixture
+def stories(database):
+    database.empty()
+    with database.engine.begin() as connection:
+        connection.execute(text("INSERT INTO users (auth_user_id, refresh_token) SELECT 'reaper-' || n, '' FROM generate_series(1, 4) n"))
+        for story_id, (locked, next_part, date_complete, parts) in STORIES.items():
+            connection.execute(text("INSERT INTO story (id, title, locked, next_part, date_complete) VALUES (:id, '', :locked, :next_part, :date_complete)"),
+                               {"id": story_id, "locked": locked, "next_part": next_part, "date_complete": date_complete})
+            for part_number, user_id, date_started, part_complete in parts:
+                connection.execute(text("""
+                    INSERT INTO part (story_id, part_number, part_text, user_id, date_started, date_complete)
+                    VALUES (:story_id, :part_number, 'text', :user_id, :date_started, :date_complete)
+                """), {"story_id": story_id, "part_number": part_number, "user_id": user_id,
+                       "date_started": date_started, "date_complete": part_complete})
+        connection.execute(text("UPDATE counters SET value = 5 WHERE name = 'stories_in_progress'"))
+    return database
+
+
+def story_rows(database):
+    with database.engine.connect() as connection:
+        stories = connection.execute(text("SELECT id, locked, next_part FROM story ORDER BY id")).all()
+        parts = connection.execute(text("SELECT story_id, part_number FROM part ORDER BY story_id, part_number")).all()
+        in_progress = connection.execute(text("SELECT value FROM counters WHERE name = 'stories_in_progress'")).scalar()
+    return {story_id: (locked, next_part) for story_id, locked, next_part in stories}, parts, in_progress
+
+
+def metric_values():
+    from reaper import parts_reclaimed, stories_removed, locks_released
+    return [counter.values.get((), 0) for counter in (parts_reclaimed, stories_removed, locks_released)]
+
+
+async def test_reap(stories, async_engine):
+    from reaper import Reaper
+
+    before = metric_values()
+    reaper = Reaper(timeout=TIMEOUT, clock=lambda: FROZEN)
+    assert await reaper.reap() == {"parts_reclaimed": 2, "stories_removed": 1, "locks_released": 2}
+
+    story_states, parts, in_progress = story_rows(stories)
+    assert story_states == {1: (False, 2), 3: (True, 3), 4: (False, 4), 5: (False, 6), 6: (True, 2)}
+    assert parts == ([(1, 1), (3, 1), (3, 2), (4, 1), (4, 2), (4, 3)]
+                     + [(5, n) for n in range(1, 6)] + [(6, 1)])
+    assert in_progress == 4
+    assert [after - value for after, value in zip(metric_values(), before)] == [2, 1, 2]
+
+    # nothing left to reap
+    assert await reaper.reap() == {"parts_reclaimed": 0, "stories_removed": 0, "locks_released": 0}
+    assert story_rows(stories) == (story_states, parts, in_progress)
+
+
+async def test_reap_later(stories, async_engine):
+    from reaper import Reaper
+
+    # a day on, the parts that were recent are abandoned too
+    reaper = Reaper(timeout=TIMEOUT, clock=lambda: FROZEN + timedelta(days=1))
+    assert await reaper.reap() == {"parts_reclaimed": 4, "stories_removed": 2, "locks_released": 3}
+    story_states, _, in_progress = story_rows(stories)
+    assert story_states == {1: (False, 2), 3: (False, 2), 4: (False, 4), 5: (False, 6)}
+    assert in_progress == 3
+
+
+async def test_reap_while_another_worker_reaps(stories, async_engine):
+    from reaper import Reaper, REAPER_LOCK_ID
+
+    before = story_rows(stories)
+    reaper = Reaper(timeout=TIMEOUT, clock=lambda: FROZEN)
+    # another worker holds the lock until its transaction ends
+    with stories.engine.begin() as connection:
+        connection.execute(text("SELECT pg_advisory_xact_lock(:id)"), {"id": REAPER_LOCK_ID})
+        assert await reaper.reap() == {"parts_reclaimed": 0, "stories_removed": 0, "locks_released": 0}
+    assert story_rows(stories) == before
@@ -0,0 +1,23 @@
+"""
+The stats' counters when the tables are made from the models (CREATE_TABLES_ON_STARTUP)
+rather than by the migrations
+"""
+from sqlalchemy import text
+
+
+def test_counters_made_by_create_all(database):
+    from models import StatsPublic
+    from sqlmodel import SQLModel
+
+    with database.engine.connect() as connection:
+        # (in a schema of its own, rolled back after)
+        connection.execute(text("CREATE SCHEMA created"))
+        connection.execute(text("SET LOCAL search_path TO created"))
+        SQLModel.metadata.create_all(connection)
+
+        counters = dict(connection.execute(text("SELECT name, value FROM counters")).all())
+        assert counters == {"stories_complete": 0, "stories_in_progress": 0, "parts_complete": 0}
+        # so /stats has every count
+        StatsPublic.model_validate(counters)
+
+        connection.rollback()
@@ -0,0 +1,56 @@
+"""
+Votes for stories that can and can't be voted for, and the weighted sampler
+starting cold under concurrent requests
+"""
+import asyncio
+import pytest
+
+from conftest import SEEDED_STORIES, user_cookies
+
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_vote(client):
+    client.cookies = user_cookies(40)
+    response = await client.post("/stories/21/vote")
+    assert response.status_code == 200, response.text
+    votes = response.json()["votes"]
+
+    # once per user
+    assert (await client.post("/stories/21/vote")).status_code == 409
+
+    # and by another user
+    client.cookies = user_cookies(41)
+    assert (await client.post("/stories/21/vote")).json() == {"story_id": 21, "votes": votes + 1}
+
+
+async def test_vote_for_missing_story(client):
+    client.cookies = user_cookies(42)
+    response = await client.post(f"/stories/{SEEDED_STORIES * 10}/vote")
+    assert response.status_code == 409, response.text
+
+
+async def test_vote_for_story_in_progress(client):
+    client.cookies = user_cookies(43)
+    response = await client.post(f"/stories/{SEEDED_STORIES + 1}/vote")
+    assert response.status_code == 409, response.text
+
+
+async def test_cold_sampler_rebuilds_once(seeded, async_engine):
+    from voting import WeightedStorySampler
+
+    sampler = WeightedStorySampler()
+    rebuilds = 0
+    rebuild = sampler.rebuild
+
+    async def counted_rebuild():
+        nonlocal rebuilds
+        rebuilds += 1
+        await rebuild()
+
+    sampler.rebuild = counted_rebuild
+    story_ids = await asyncio.gather(*(sampler.sample() for _ in range(50)))
+
+    assert rebuilds == 1
+    assert all(1 <= story_id <= SEEDED_STORIES for story_id in story_ids)
@@ -0,0 +1,136 @@
+from array import array
+from bisect import bisect_right
+from datetime import datetime
+from decouple import config
+from sqlalchemy import update, case, func, literal
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.sql.operators import is_not
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+import asyncio
+import math
+import random
+import time
+
+from models import Story, Vote
+from database import async_session_maker
+
+
+# Voting config from env
+VOTE_HALF_LIFE_IN_HOURS = config("VOTE_HALF_LIFE_IN_HOURS", default=72, cast=float)
+WEIGHTED_INDEX_REFRESH_IN_SECONDS = config("WEIGHTED_INDEX_REFRESH_IN_SECONDS", default=300, cast=int)
+
+# votes are weighted 2 ** (hours since the epoch / half life), so a vote is worth
+# half as much as one cast a half life later
+SCORE_EPOCH = datetime(2025, 1, 1)
+
+
+"""
+A story's score is the log of the sum of its votes' weights
+Stored as a log it never overflows, and adding a vote only needs the old score:
+log(e^score + e^weight) = max(score, weight) + log(1 + e^-|score - weight|)
+"""
+def vote_weight(date_voted: datetime):
+    hours = (date_voted - SCORE_EPOCH).total_seconds() / 3600
+    return hours / VOTE_HALF_LIFE_IN_HOURS * math.log(2)
+
+def add_vote_to_score(weight: float):
+    return case(
+        (Story.score.is_(None), weight),
+        else_=func.greatest(Story.score, weight) + func.ln(1 + func.exp(-func.abs(Story.score - weight))),
+    )
+
+
+"""
+Vote for a completed story (once per user)
+Returns the story's vote count, or None if the user already voted or there's no such completed story
+"""
+async def add_vote(session: AsyncSession, user_id: int, story_id: int):
+    date_voted = datetime.now()
+
+    # only inserted if the story exists and is complete (so no foreign key error for a missing story)
+    # and the unique constraint on (user_id, story_id) makes a second vote a no-op
+    complete_story = select(literal(user_id), Story.id, literal(date_voted)).where(Story.id == story_id, is_not(Story.date_complete, None))
+    vote_id = (await session.exec(
+        insert(Vote).from_select(["user_id", "story_id", "date_voted"], complete_story)
+                    .on_conflict_do_nothing(constraint="vote_user_story_key")
+                    .returning(Vote.id)
+    )).first()
+    if vote_id is None:
+        await session.rollback()
+        return None
+
+    votes = (await session.exec(
+        update(Story).where(Story.id == story_id, is_not(Story.date_complete, None))
+                     .values(votes=Story.votes + 1, score=add_vote_to_score(vote_weight(date_voted)))
+                     .returning(Story.votes)
+                     .execution_options(synchronize_session=False)
+    )).first()
+    if votes is None:
+        await session.rollback()
+        return None
+
+    await session.commit()
+    return votes[0]
+
+
+"""
+Picks a random completed story, weighted by its votes (votes + 1 so every story can be picked)
+
+Keeps story ids and the running total of their weights in memory: a sample is a
+binary search for a random point in the total, O(log n). The index is rebuilt in
+the background when older than WEIGHTED_INDEX_REFRESH_IN_SECONDS.
+"""
+class WeightedStorySampler:
+
+    def __init__(self, refresh: int = WEIGHTED_INDEX_REFRESH_IN_SECONDS):
+        self.refresh = refresh
+        self.story_ids = array("q")
+        self.cumulative_weights = array("d")
+        self.built_at = None
+        self.rebuild_task = None
+
+    async def rebuild(self):
+        story_ids = array("q")
+        cumulative_weights = array("d")
+        total = 0.0
+
+        async with async_session_maker() as session:
+            rows = await session.stream(
+                select(Story.id, Story.votes).where(is_not(Story.date_complete, None))
+                                             .execution_options(yield_per=10000)
+            )
+            async for story_id, votes in rows:
+                total += votes + 1
+                story_ids.append(story_id)
+                cumulative_weights.append(total)
+
+        self.story_ids, self.cumulative_weights = story_ids, cumulative_weights
+        self.built_at = time.monotonic()
+
+    """
+    Rebuild in a task, unless one is already running, which is returned instead
+    """
+    def start_rebuild(self):
+        if self.rebuild_task is None or self.rebuild_task.done():
+            self.rebuild_task = asyncio.create_task(self.rebuild())
+        return self.rebuild_task
+
+    async def sample(self):
+        if self.built_at is None:
+            # the requests arriving before the first build (e.g. at a new worker) all wait on one
+            # shield so one request disconnecting doesn't cancel it for the others
+            await asyncio.shield(self.start_rebuild())
+        elif time.monotonic() - self.built_at > self.refresh:
+            self.start_rebuild()
+
+        # (read together so a rebuild finishing can't mix two indexes)
+        story_ids, cumulative_weights = self.story_ids, self.cumulative_weights
+        if not story_ids:
+            return None
+
+        point = random.random() * cumulative_weights[-1]
+        return story_ids[bisect_right(cumulative_weights, point)]
+
+
+weighted_sampler = WeightedStorySampler()